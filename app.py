@@ -1,5 +1,5 @@
 from fastapi import FastAPI, HTTPException, Query, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from starlette import status
 from pathlib import Path
@@ -11,8 +11,22 @@ from sqlalchemy import orm as _orm
 import schema as _schema
 import services as _services
 import db_utils as _db_utils
+import database as _database
 import agent as _agent
+import jobs as _jobs
+import rollups as _rollups
+import notifications as _notifications
+import outbox as _outbox
+import revalidation as _revalidation
+import policy_sim as _policy_sim
+import pipeline as _pipeline
+import finance_cache as _finance_cache_mod
+from finance_cache import finance_cache as _finance_cache
+from policy_index import policy_index as _policy_index
 import os
+import asyncio
+import json
+import time
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel, Field
 import utils as mail_utils
@@ -23,7 +37,7 @@ from db import get_connection, safe_query
 
 from datetime import date, datetime
 import datetime
-from agent import run_finance_agent
+from agent import run_finance_agent, stream_finance_agent
 
 
 # # SINGLE FastAPI INSTANCE
@@ -84,7 +98,7 @@ async def extractor_agent(
         "json_out_dir": json_out_dir,
         "save_json_file": save_json_file,
     }
-    final_state = _agent.extract_node(state)
+    final_state = await _agent.aextract_node(state)
     return final_state
 
 # -------------------------------------------------
@@ -147,7 +161,7 @@ async def agent_router(
 
         payload_dict = inv.model_dump(mode="python")
 
-        employee_details_list = _db_utils.get_employee_details(inv.employee_id)
+        employee_details_list = await _agent.run_blocking(_db_utils.get_employee_details, inv.employee_id)
         employee_row = employee_details_list[0] if employee_details_list else None
         if not employee_row:
             result = {
@@ -180,12 +194,12 @@ async def agent_router(
                 "validation": result
             }), status_code=200)
 
-        policies_df = _db_utils.load_policies_df(emp_grade)
-        policies_list = policies_df.to_dict("records")
-        policy_row = _agent._pick_policy_for(employee_details_list, policies_list, payload_dict.get("category"))
+        # served from memory once the index is warm; the executor hop only matters on (re)build
+        policy_row = await _agent.run_blocking(_policy_index.lookup, emp_grade, payload_dict.get("category"))
 
-        validator = _agent.ValidationAgent(use_llm_message=True)
-        result = validator.validate(employee_row, policy_row, payload_dict)
+        # rule decision returns now; the LLM wording (if enabled) lands under validation.message_ref
+        validator = _agent.ValidationAgent()
+        result = await validator.avalidate(employee_row, policy_row, payload_dict)
 
         return JSONResponse(content=jsonable_encoder({
             "tag": result.get("tag"),
@@ -214,7 +228,7 @@ async def agent_router(
             "save_json_file": save,
         }
 
-        state = _agent.extract_node(state)
+        state = await _agent.aextract_node(state)
         extraction = state.get("extraction")
         if not extraction:
             raise HTTPException(status_code=500, detail="Extraction failed")
@@ -253,8 +267,7 @@ async def agent_router(
             "save_json_file": save
         }
 
-        state = _agent.extract_node(state)
-        state = _agent.validate_node(state)
+        state = await _agent.arun_full(state)
 
         extraction = state.get("extraction") or {}
         payload_json = _agent.payload_to_json_ready(extraction.get("payload", {}))
@@ -280,6 +293,149 @@ async def agent_router(
     raise HTTPException(status_code=400, detail="phase must be one of: extract | validate | full")
 
 
+# -------------------------------------------------
+# Batch extraction (list of files and/or a directory)
+# -------------------------------------------------
+class BatchExtractBody(BaseModel):
+    files: List[str] = Field(default_factory=list, description="Paths to files on server (image/pdf)")
+    directory: Optional[str] = Field(None, description="Directory to scan, e.g. input/images/hotels_v3")
+    emp_id: Optional[str] = None
+    json_out_dir: str = "./output/langchain_json"
+    save_json_file: bool = True
+    concurrency: int = Field(_agent.EXTRACT_BATCH_CONCURRENCY, ge=1, le=_agent.EXTRACT_BATCH_MAX_CONCURRENCY)
+
+@app.post("/api/Agent/batch", response_class=JSONResponse, status_code=status.HTTP_200_OK)
+async def agent_batch_extract(body: BatchExtractBody):
+    global LAST_EMP_ID
+    try:
+        files = _agent.collect_batch_files(body.files, body.directory)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if not files:
+        raise HTTPException(status_code=400, detail="Provide 'files' and/or a 'directory' with supported images/PDFs")
+
+    if body.emp_id:
+        LAST_EMP_ID = body.emp_id
+
+    t0 = time.perf_counter()
+    results = await _agent.extract_batch(
+        files,
+        emp_id_hint=body.emp_id,
+        out_dir=body.json_out_dir,
+        save_json_file=body.save_json_file,
+        concurrency=body.concurrency,
+    )
+    ok = sum(1 for r in results if r.get("ok"))
+    return JSONResponse(content=jsonable_encoder({
+        "count": len(results),
+        "succeeded": ok,
+        "failed": len(results) - ok,
+        "concurrency": body.concurrency,
+        "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1),
+        "results": results,
+    }), status_code=200)
+
+
+# -------------------------------------------------
+# Asynchronous extraction jobs (enqueue + poll)
+# -------------------------------------------------
+class ExtractJobBody(BaseModel):
+    image_name: str = Field(..., description="Path to file on server (image/pdf)")
+    emp_id: Optional[str] = None
+    json_out_dir: str = "./output/langchain_json"
+    save_json_file: bool = True
+
+class PipelineBody(BaseModel):
+    files: List[str] = Field(..., min_length=1, description="Server-side paths (image/pdf)")
+    emp_id: Optional[str] = None
+    json_out_dir: str = "./output/langchain_json"
+    save_json_file: bool = True
+    persist: bool = Field(True, description="Save claim + validation log like the upload pages")
+    notify: bool = Field(False, description="Queue the upload ACK email to each employee")
+
+@app.post("/api/Agent/pipeline")
+async def api_agent_pipeline(body: PipelineBody):
+    """phase=full for a batch: extract / validate / persist run as overlapped stages."""
+    global LAST_EMP_ID
+    missing = [f for f in body.files if not Path(f).exists()]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Not found: {', '.join(missing)}")
+    if body.emp_id:
+        LAST_EMP_ID = body.emp_id
+    res = await _pipeline.run_pipeline(
+        body.files, body.emp_id, body.json_out_dir, body.save_json_file, body.persist, body.notify
+    )
+    return JSONResponse(content=jsonable_encoder(res))
+
+@app.on_event("startup")
+async def _start_job_workers():
+    try:
+        await _jobs.worker_pool.start()
+    except Exception as e:
+        print(f"[jobs] worker pool not started: {e}")
+
+@app.on_event("startup")
+async def _ensure_rollups():
+    try:
+        await _agent.run_blocking(_rollups.ensure_rollups)
+    except Exception as e:
+        print(f"[rollups] not installed: {e}")
+
+@app.on_event("startup")
+async def _ensure_claims_list_index():
+    # CREATE INDEX CONCURRENTLY can take a while on a large table: don't hold up startup
+    async def _build():
+        try:
+            await _agent.run_blocking(queries.ensure_claims_list_index)
+        except Exception as e:
+            print(f"[queries] claims list index not created: {e}")
+    app.state.claims_list_index_task = asyncio.create_task(_build())
+
+@app.on_event("startup")
+async def _warm_policy_index():
+    try:
+        await _agent.run_blocking(_policy_index.rebuild)
+    except Exception as e:
+        print(f"[policy_index] not warmed: {e}")
+
+@app.on_event("shutdown")
+async def _stop_job_workers():
+    await _jobs.worker_pool.stop()
+
+@app.on_event("startup")
+async def _start_email_outbox():
+    # picks up anything left queued by a previous run
+    _outbox.sender.start()
+
+@app.on_event("shutdown")
+async def _stop_email_outbox():
+    await _agent.run_blocking(_outbox.sender.stop)
+
+@app.post("/api/jobs/extract", status_code=status.HTTP_202_ACCEPTED)
+async def api_enqueue_extract_job(body: ExtractJobBody):
+    global LAST_EMP_ID
+    if not Path(body.image_name).exists():
+        raise HTTPException(status_code=404, detail=f"Not found: {body.image_name}")
+    if body.emp_id:
+        LAST_EMP_ID = body.emp_id
+    job_id = await _agent.run_blocking(
+        _jobs.enqueue_extract_job, body.image_name, body.emp_id, body.json_out_dir, body.save_json_file
+    )
+    _jobs.wake_workers()
+    return {"job_id": job_id, "status": "queued", "status_url": f"/api/jobs/{job_id}"}
+
+@app.get("/api/jobs/stats")
+async def api_job_stats():
+    return await _agent.run_blocking(_jobs.get_queue_stats)
+
+@app.get("/api/jobs/{job_id}")
+async def api_get_job(job_id: str):
+    job = await _agent.run_blocking(_jobs.get_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return JSONResponse(content=jsonable_encoder(job))
+
+
 # ============================================================
 # ======  ANALYTICS / KPI ROUTES (moved from queries.py) =====
 # ============================================================
@@ -288,6 +444,53 @@ async def agent_router(
 def health():
     return {"db_tables": _db_utils.get_table_health()}
 
+@app.get("/meta/extraction-cache")
+def extraction_cache_stats():
+    return _agent.extraction_cache.stats()
+
+@app.get("/meta/image-prep")
+def image_prep_stats():
+    return _agent.image_prep.stats()
+
+@app.get("/meta/db-pool")
+def db_pool_stats():
+    return _database.get_pool_stats()
+
+@app.get("/meta/email-outbox")
+def email_outbox_stats():
+    out = _outbox.stats()
+    out["digest"] = _notifications.stats()
+    return out
+
+@app.get("/meta/pdf-reader")
+def pdf_reader_stats():
+    return _agent.pdf_reader.stats()
+
+@app.get("/meta/policy-index")
+def policy_index_stats():
+    return _policy_index.stats()
+
+@app.get("/meta/finance-cache")
+def finance_cache_stats():
+    return _finance_cache.stats()
+
+@app.get("/meta/pipeline")
+def pipeline_stats():
+    return _pipeline.last_run or {"files": 0}
+
+@app.get("/meta/validation-messages")
+def validation_message_stats():
+    out = _agent.validation_messages.stats()
+    out["templates"] = _agent.message_renderer.stats()
+    return out
+
+@app.get("/api/validation/messages/{message_ref}")
+def api_validation_message(message_ref: str):
+    msg = _agent.validation_messages.get_message(message_ref)
+    if msg is None:
+        return JSONResponse(content={"message_ref": message_ref, "ready": False}, status_code=202)
+    return {"message_ref": message_ref, "ready": True, "message": msg}
+
 # @app.get("/claims/summary")
 # def claims_summary():
 #     summary = _db_utils.get_claims_summary()
@@ -303,10 +506,15 @@ def health():
 def claims_summary(start_date: str | None = None, end_date: str | None = None):
     return queries.get_claims_summary(start_date, end_date)
 
+@app.get("/claims/summary/full")
+def claims_summary_full(start_date: str | None = None, end_date: str | None = None, limit: int = 10):
+    # totals + category/vendor/employee breakdowns in one round-trip
+    return _db_utils.get_claims_summary(start_date, end_date, limit=limit)
+
 
 @app.get("/claims/by-date")
 def claims_by_date(start_date: str | None = None, end_date: str | None = None):
-    return _db_utils.get_claims_by_date(start_date, end_date)
+    return _rollups.get_claims_by_date(start_date, end_date)
 
 # @app.get("/claims/automation-rate")
 # def automation_rate(start_date: str | None = None, end_date: str | None = None):
@@ -314,7 +522,7 @@ def claims_by_date(start_date: str | None = None, end_date: str | None = None):
 
 @app.get("/claims/automation-rate")
 def automation_rate(start_date: str | None = None, end_date: str | None = None):
-    return queries.get_automation_rate_by_date(start_date, end_date)
+    return _rollups.get_automation_rate_by_date(start_date, end_date)
 
 
 
@@ -333,7 +541,7 @@ def processing_time_by_date(start_date: str | None = None, end_date: str | None
 
 @app.get("/claims/by-department")
 def by_department(limit: int = 20):
-    return queries.get_claims_by_department(limit)
+    return _rollups.get_claims_by_department(limit)
 
 
 # @app.get("/claims/top-employees")
@@ -343,7 +551,7 @@ def by_department(limit: int = 20):
 
 @app.get("/claims/top-employees")
 def top_employees(limit: int = 20):
-    return queries.get_top_employees(limit)
+    return _rollups.get_top_employees(limit)
 
 
 
@@ -421,6 +629,36 @@ class FinanceDecisionBody(BaseModel):
     comment: str = ""
     approver_id: Optional[str] = None
 
+class DecisionItem(BaseModel):
+    claim_id: str
+    decision: str  # "Approve" | "Reject"
+    comment: str = ""
+
+class DecisionBatchBody(BaseModel):
+    actor_role: str = Field("Finance", description="'Manager' or 'Finance'")
+    approver_id: Optional[str] = None
+    decisions: List[DecisionItem]
+    notify: bool = True
+    notify_recipient: Optional[str] = Field(None, description="Override; default is each employee's email")
+
+class RevalidateBody(BaseModel):
+    statuses: List[str] = Field(default_factory=lambda: list(_revalidation.REVALIDATE_STATUSES))
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    dry_run: bool = True
+
+class CandidatePolicy(BaseModel):
+    category: str
+    applicable_grades: str = Field(..., description="Comma-separated grades, e.g. 'G2' or 'G1,G2'")
+    max_allowance: Optional[float] = None
+
+class PolicySimBody(BaseModel):
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    policies: List[CandidatePolicy] = Field(default_factory=list)
+    manager_band: float = Field(_revalidation.MANAGER_BAND, ge=0)
+    finance_band: float = Field(_revalidation.FINANCE_BAND, ge=0)
+
 @app.get("/api/policies")
 def api_get_policies():
     return _db_utils.get_expense_policy()
@@ -493,6 +731,49 @@ def api_finance_decision(claim_id: str, body: FinanceDecisionBody):
     )
     return {"ok": True, "claim_id": claim_id, "status": "Approved" if body.decision == "Approve" else "Rejected"}
 
+@app.post("/api/claims/decisions:batch")
+def api_batch_decisions(body: DecisionBatchBody):
+    if body.actor_role not in {"Manager", "Finance"}:
+        raise HTTPException(status_code=400, detail="actor_role must be 'Manager' or 'Finance'")
+    t0 = time.perf_counter()
+    res = _db_utils.bulk_update_claim_decisions(
+        [d.model_dump() for d in body.decisions], body.actor_role, body.approver_id or ""
+    )
+    elapsed_ms = int((time.perf_counter() - t0) * 1000)
+    # emails are queued in the outbox before we answer; SMTP happens in its sender
+    notify: Dict[str, Any] = {"queued": 0}
+    if body.notify and res["rows"]:
+        try:
+            notify["queued"] = _notifications.notify_decisions(res["rows"], body.actor_role, body.notify_recipient)
+        except Exception as e:
+            # the decisions are committed: report the notification failure, don't fail the call
+            notify = {"queued": 0, "error": f"could not queue notifications: {e}"}
+    return JSONResponse(content=jsonable_encoder({
+        "updated": len(res["rows"]),
+        "rows": res["rows"],
+        "missing": res["missing"],
+        "elapsed_ms": elapsed_ms,
+        "notifications": notify,
+    }))
+
+@app.post("/api/claims/revalidate")
+def api_revalidate_claims(body: RevalidateBody):
+    """Re-band stored claims against the current policies (dry run by default)."""
+    res = _revalidation.revalidate_claims(body.statuses, body.start_date, body.end_date, body.dry_run)
+    return JSONResponse(content=jsonable_encoder(res))
+
+@app.post("/api/policies/simulate")
+def api_simulate_policies(body: PolicySimBody):
+    """What-if: replay claims in the range under candidate policies / band thresholds."""
+    if body.finance_band < body.manager_band:
+        raise HTTPException(status_code=400, detail="finance_band must be >= manager_band")
+    res = _policy_sim.simulate(
+        body.start_date, body.end_date,
+        [p.model_dump() for p in body.policies],
+        body.manager_band, body.finance_band,
+    )
+    return JSONResponse(content=jsonable_encoder(res))
+
 #===============Finance agent===================
 
 
@@ -517,9 +798,26 @@ class FinanceInsightsResponse(BaseModel):
     risk_alerts: Optional[list]
     actions: Optional[list]
     recommended_claim_decisions: Optional[list]
+    meta: Optional[dict] = None
+
+
 
 
 
+def _finance_response_dict(result: dict, computed_at: float, cache_meta: dict) -> dict:
+    response = FinanceInsightsResponse(
+        ok=True,
+        generated_at=datetime.datetime.utcfromtimestamp(computed_at).isoformat(),
+        executive_summary=result.get("executive_summary"),
+        key_metrics=result.get("key_metrics"),
+        insights=result.get("insights"),
+        policy_optimizations=result.get("policy_optimizations"),
+        risk_alerts=result.get("risk_alerts"),
+        actions=result.get("actions"),
+        recommended_claim_decisions=result.get("recommended_claim_decisions"),
+        meta={**(result.get("meta") or {}), "cache": cache_meta},
+    )
+    return jsonable_encoder(response)
 
 
 @app.post("/api/ai/finance-insights")
@@ -529,32 +827,71 @@ def api_finance_insights(body: FinanceInsightsRequest):
     generates insights, KPIs, risks, and policy optimization suggestions.
     """
     try:
-        # Run the finance AI agent
-        result = run_finance_agent(
-            start_date=body.start_date,
-            end_date=body.end_date
+        # Run the finance AI agent (cached per range + data watermark, stale-while-revalidate)
+        include_ai = bool(body.include_ai_recommendations)
+        result, cache_meta = _finance_cache.get(
+            body.start_date, body.end_date, include_ai,
+            lambda: run_finance_agent(start_date=body.start_date, end_date=body.end_date, include_ai=include_ai),
         )
 
         # Construct response in unified structure
-        response = FinanceInsightsResponse(
-            ok=True,
-            generated_at=datetime.datetime.utcnow().isoformat(),
-            executive_summary=result.get("executive_summary"),
-            key_metrics=result.get("key_metrics"),
-            insights=result.get("insights"),
-            policy_optimizations=result.get("policy_optimizations"),
-            risk_alerts=result.get("risk_alerts"),
-            actions=result.get("actions"),
-            recommended_claim_decisions=result.get("recommended_claim_decisions"),
-        )
-
-        return JSONResponse(content=jsonable_encoder(response))
+        return JSONResponse(content=_finance_response_dict(result, cache_meta["computed_at"], cache_meta))
 
     except Exception as e:
         print(e)
         raise HTTPException(status_code=500, detail=f"Finance insights generation failed: {e}")
 
 
+@app.post("/api/ai/finance-insights/stream")
+def api_finance_insights_stream(
+    body: FinanceInsightsRequest,
+    format: str = Query(default="ndjson", pattern="^(ndjson|sse)$", description="ndjson | sse"),
+):
+    """
+    Streaming variant of /api/ai/finance-insights. Emits the deterministic
+    sections ("metrics") as soon as the SQL aggregates are in, then the executive
+    summary text ("summary" deltas) while the LLM writes it, then "final" with
+    the same payload as the non-streaming endpoint. A fresh cached result is
+    replayed as metrics + final without touching the database or the LLM.
+    """
+    include_ai = bool(body.include_ai_recommendations)
+    watermark = _finance_cache_mod.data_watermark()
+
+    def _events():
+        cached = _finance_cache.peek(body.start_date, body.end_date, include_ai, watermark)
+        if cached is not None:
+            result = cached["result"]
+            cache_meta = {"status": "hit", "age_s": round(time.time() - cached["computed_at"], 1),
+                          "computed_at": cached["computed_at"]}
+            yield {"event": "metrics", **{k: result.get(k) for k in
+                   ("key_metrics", "insights", "policy_optimizations", "risk_alerts")}}
+            yield {"event": "final", "result": _finance_response_dict(result, cached["computed_at"], cache_meta)}
+            return
+        for ev in stream_finance_agent(start_date=body.start_date, end_date=body.end_date, include_ai=include_ai):
+            if ev["event"] != "final":
+                yield ev
+                continue
+            entry = _finance_cache.store(body.start_date, body.end_date, include_ai, watermark, ev["result"])
+            cache_meta = {"status": "miss", "age_s": 0.0, "computed_at": entry["computed_at"]}
+            yield {"event": "final", "result": _finance_response_dict(ev["result"], entry["computed_at"], cache_meta)}
+
+    def _encode():
+        try:
+            for ev in _events():
+                data = json.dumps(jsonable_encoder(ev), default=str)
+                if format == "sse":
+                    yield f"event: {ev['event']}\ndata: {data}\n\n"
+                else:
+                    yield data + "\n"
+        except Exception as e:
+            print(e)
+            data = json.dumps({"event": "error", "detail": f"Finance insights generation failed: {e}"})
+            yield f"event: error\ndata: {data}\n\n" if format == "sse" else data + "\n"
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(_encode(), media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 # ======================================================
 # ======  EMAIL UTIL ROUTES  ==========================
 # ======================================================
@@ -723,13 +1060,13 @@ def get_employee_leaderboard(start_date: date, end_date: date):
 
 @app.get("/claims/monthly_trend")
 def get_trend(start_date: date, end_date: date):
-    data = queries.get_monthly_trend(start_date, end_date)
+    data = _rollups.get_monthly_trend(start_date, end_date)
     return JSONResponse(content=jsonable_encoder(data))
 
 
 @app.get("/claims/top_vendors")
 def get_top_vendors(start_date: date, end_date: date, limit: int = 10):
-    data = queries.get_top_vendors(start_date, end_date, limit)
+    data = _rollups.get_top_vendors(start_date, end_date, limit)
     return JSONResponse(content=data)
 
 @app.get("/claims/fraud")
@@ -754,15 +1091,26 @@ def get_pending(start_date: date, end_date: date):
 def get_claims_list(
     start_date: date,
     end_date: date,
-    status: str | None = None,
+    status: List[str] | None = Query(default=None, description="Repeat for several statuses"),
     employee_id: str | None = None,
-    limit: int = 500,
+    category: str | None = Query(default=None, description="Exact expense_category"),
+    currency: str | None = None,
+    vendor: str | None = Query(default=None, description="Vendor name contains (case-insensitive)"),
+    cursor: str | None = Query(default=None, description="next_cursor from the previous page"),
+    limit: int = Query(default=500, ge=1, le=1000),
 ):
-    data = queries.get_claims_list(start_date, end_date, status, employee_id, limit)
-    # Either return the plain object (FastAPI will encode) ...
-    # return data
-
-    # ...or keep JSONResponse but wrap with jsonable_encoder:
+    """
+    Keyset-paginated claims listing, newest first, filtered on the server.
+    Returns {items, next_cursor, total, total_exact, total_source[, by_category]};
+    totals are only included on the first page (no cursor).
+    """
+    try:
+        data = queries.get_claims_list(
+            start_date, end_date, status, employee_id, limit,
+            category=category, currency=currency, vendor=vendor, cursor=cursor,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return JSONResponse(content=jsonable_encoder(data))
 
 
@@ -0,0 +1,161 @@
+# claim_ids.py
+"""
+Claim-id allocator backed by a Postgres sequence.
+
+Ids look like CLM-YYYYMMDD-NNNNNNN: the date prefix is the allocation day and
+the number comes from `claim_id_seq`, so two callers can never get the same id
+(nextval is atomic and never rolls back). The 7-digit width keeps new ids
+distinct from the older CLM-YYYYMMDD-NNNN (count based) and
+CLM-YYYYMMDD-HHMMSS (timestamp based) formats already in expense_claims.
+
+For batch ingestion, `reserve(n)` fetches n numbers in one round-trip, and
+CLAIM_ID_BLOCK > 1 makes next_id() pre-fetch blocks in the background of
+normal calls.
+
+`python claim_ids.py [threads] [inserts_per_thread]` inserts claims into
+expense_claims concurrently and counts unique violations on claim_id.
+"""
+
+import os
+import sys
+import time
+import threading
+import datetime as dt
+from typing import List
+
+from sqlalchemy import text
+
+import database as _database
+
+CLAIM_ID_BLOCK = int(os.getenv("CLAIM_ID_BLOCK", "1"))
+_SEQ = "claim_id_seq"
+
+
+def format_claim_id(n: int, day: dt.date | None = None) -> str:
+    day = day or dt.date.today()
+    return f"CLM-{day.strftime('%Y%m%d')}-{n:07d}"
+
+
+class ClaimIdAllocator:
+    def __init__(self, block_size: int = CLAIM_ID_BLOCK):
+        self.block_size = max(1, int(block_size))
+        self._lock = threading.Lock()
+        self._pool: List[int] = []
+        self._ready = False
+
+    def _ensure_sequence(self) -> None:
+        # concurrent CREATE ... IF NOT EXISTS can still collide in pg_class, and
+        # nobody may call nextval before the creating transaction has committed
+        if self._ready:
+            return
+        with self._lock:
+            if self._ready:
+                return
+            with _database.get_engine().begin() as conn:
+                conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('claim_id_seq_install'))"))
+                conn.execute(text(f"CREATE SEQUENCE IF NOT EXISTS {_SEQ} AS bigint START 1"))
+            self._ready = True
+
+    def _fetch(self, n: int) -> List[int]:
+        self._ensure_sequence()
+        with _database.get_engine().begin() as conn:
+            rows = conn.execute(
+                text(f"SELECT nextval('{_SEQ}') FROM generate_series(1, :n)"), {"n": n}
+            ).scalars().all()
+        return [int(r) for r in rows]
+
+    def reserve(self, n: int) -> List[str]:
+        """n fresh ids in one round-trip (batch ingestion)."""
+        if n <= 0:
+            return []
+        today = dt.date.today()
+        return [format_claim_id(x, today) for x in self._fetch(n)]
+
+    def next_id(self) -> str:
+        if self.block_size == 1:
+            return format_claim_id(self._fetch(1)[0])
+        self._ensure_sequence()  # before taking the lock it also uses
+        with self._lock:
+            if not self._pool:
+                self._pool = self._fetch(self.block_size)
+            return format_claim_id(self._pool.pop(0))
+
+
+claim_id_allocator = ClaimIdAllocator()
+
+
+def next_claim_id() -> str:
+    return claim_id_allocator.next_id()
+
+
+def reserve_claim_ids(n: int) -> List[str]:
+    return claim_id_allocator.reserve(n)
+
+
+# =========================================================
+# CONCURRENCY CHECK
+# =========================================================
+def _insert_check(threads: int, per_thread: int) -> None:
+    """
+    Concurrent inserts into expense_claims through db_utils.save_expense_claim,
+    each with an id from a fresh next_claim_id(). The UNIQUE constraint on
+    claim_id is the oracle: a collision is a unique violation. Rows are tagged
+    with receipt_id IDCHECK-<run> and deleted afterwards.
+    """
+    import db_utils  # local import: db_utils imports this module
+
+    from sqlalchemy.exc import IntegrityError
+
+    run = f"IDCHECK-{int(time.time())}"
+    with _database.get_engine().connect() as conn:
+        employee_id = conn.execute(text("SELECT employee_id FROM employees ORDER BY employee_id LIMIT 1")).scalar()
+    if employee_id is None:
+        sys.exit("no employees to attach test claims to")
+    payload = {"employee_id": employee_id, "category": "Other", "total_amount": 1.0, "currency": "INR",
+               "vendor": "claim id check", "invoice_number": run}
+
+    counts = {"inserted": 0, "collisions": 0, "errors": 0}
+    counts_lock = threading.Lock()
+
+    def worker():
+        mine = {"inserted": 0, "collisions": 0, "errors": 0}
+        for _ in range(per_thread):
+            try:
+                db_utils.save_expense_claim(payload, "Pending Review")
+                mine["inserted"] += 1
+            except IntegrityError as ex:
+                is_dupe = getattr(ex.orig.diag, "constraint_name", None) == "expense_claims_claim_id_key"
+                mine["collisions" if is_dupe else "errors"] += 1
+                if not is_dupe:
+                    print(f"insert failed: {ex.orig}")
+            except Exception as ex:
+                mine["errors"] += 1
+                print(f"insert failed: {ex}")
+        with counts_lock:
+            for k, v in mine.items():
+                counts[k] += v
+
+    t0 = time.perf_counter()
+    ts = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    with _database.get_engine().begin() as conn:
+        stored, distinct = conn.execute(
+            text("SELECT COUNT(*), COUNT(DISTINCT claim_id) FROM expense_claims WHERE receipt_id = :r"), {"r": run}
+        ).one()
+        conn.execute(text("DELETE FROM expense_claims WHERE receipt_id = :r"), {"r": run})
+    print(f"{counts['inserted']} claims inserted by {threads} threads in {elapsed:.2f}s "
+          f"({counts['inserted'] / elapsed:,.0f} inserts/s, block={claim_id_allocator.block_size}); "
+          f"unique violations on claim_id: {counts['collisions']}, other errors: {counts['errors']}, "
+          f"rows stored/distinct ids: {stored}/{distinct}")
+    if counts["collisions"] or counts["errors"] or stored != distinct:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    _insert_check(*(args + [32, 200][len(args):]))
@@ -360,6 +360,7 @@ Single 'Report' tab with two rows of slicers at the top, then KPIs, charts, and
 
 import os
 import io
+import json
 from datetime import date, timedelta
 from typing import List, Optional  # <-- important for Python 3.8/3.9
 
@@ -426,14 +427,26 @@ def to_df(obj):
 # Data loaders (API-backed)
 # -------------------------
 # @st.cache_data(ttl=3)
-def load_claims(start_date: date, end_date: date, filters: dict):
-    params = {"start_date": start_date.isoformat(), "end_date": end_date.isoformat()}
+def load_claims(start_date: date, end_date: date, filters: dict, status_list: Optional[List[str]] = None,
+                cursor: Optional[str] = None, limit: int = 500):
+    """One page of /claims/list with every filter applied server-side. Returns (df, page_meta)."""
+    params = {"start_date": start_date.isoformat(), "end_date": end_date.isoformat(), "limit": int(limit)}
     if filters.get("employee_id"):
         params["employee_id"] = filters["employee_id"]
-    if filters.get("status"):
-        params["status"] = filters["status"]
+    if filters.get("expense_category"):
+        params["category"] = filters["expense_category"]
+    if filters.get("currency"):
+        params["currency"] = filters["currency"]
+    if filters.get("vendor_name"):
+        params["vendor"] = filters["vendor_name"]
+    if status_list:
+        params["status"] = list(status_list)
+    if cursor:
+        params["cursor"] = cursor
     data = api_get("/claims/list", params=params)
-    return to_df(data)
+    if not isinstance(data, dict):
+        return to_df([]), {}
+    return to_df(data.get("items") or []), {k: v for k, v in data.items() if k != "items"}
 
 #
 # @st.cache_data(ttl=3)
@@ -533,26 +546,6 @@ def df_to_csv_bytes(df: pd.DataFrame):
     return buf.getvalue()
 
 
-def apply_client_side_filters(df: pd.DataFrame, filters: dict, status_list: Optional[List[str]]):
-    if df.empty:
-        return df
-    out = df.copy()
-
-    if "expense_category" in filters:
-        out = out[out["expense_category"] == filters["expense_category"]]
-
-    if "currency" in filters:
-        out = out[out["currency"] == filters["currency"]]
-
-    if "vendor_name" in filters and filters["vendor_name"]:
-        needle = str(filters["vendor_name"]).strip().lower()
-        out = out[out["vendor_name"].fillna("").str.lower().str.contains(needle)]
-
-    if status_list:
-        out = out[out["status"].fillna("").isin(status_list)]
-
-    return out
-
 import streamlit as st
 import plotly.graph_objects as go
 
@@ -642,6 +635,53 @@ def render_status_distribution(summary: dict):
 
 
 
+def render_finance_sections(ai_data: dict):
+    """Key metrics, insights, policy suggestions and risk alerts (the SQL-backed part)."""
+    # -------------------------------------------------------------------
+    # Key Metrics Cards
+    # -------------------------------------------------------------------
+    st.markdown("### 📊 Key Metrics")
+    metrics = ai_data.get("key_metrics", {})
+    c1, c2, c3= st.columns(3)
+    c1.metric("Total Claims", f"{metrics.get('total_claims', 0):,}")
+    c2.metric("Total Spend", f"₹{metrics.get('total_spend', 0):,.0f}")
+    c3.metric("Avg Claim", f"₹{metrics.get('avg_claim_amount', 0):,.0f}")
+    # c4.metric("Auto-Approval %", f"{metrics.get('auto_approval_rate', 0)*100:.1f}%")
+
+    # -------------------------------------------------------------------
+    # Insights
+    # -------------------------------------------------------------------
+    st.markdown("### 💡 AI-Detected Insights")
+    insights = ai_data.get("insights", [])
+    if insights:
+        for i in insights:
+            st.markdown(f"- {i}")
+    else:
+        st.info("No insights detected for this period.")
+
+    # -------------------------------------------------------------------
+    # Policy Optimization Suggestions
+    # -------------------------------------------------------------------
+    st.markdown("### ⚙️ Policy Optimization Suggestions")
+    policies = ai_data.get("policy_optimizations", [])
+    if policies:
+        for p in policies:
+            st.markdown(f"- {p}")
+    else:
+        st.info("No policy optimization suggestions available.")
+
+    # -------------------------------------------------------------------
+    # Risk Alerts
+    # -------------------------------------------------------------------
+    st.markdown("### 🚨 Risk Alerts")
+    risks = ai_data.get("risk_alerts", [])
+    if risks:
+        for r in risks:
+            st.markdown(f"- {r}")
+    else:
+        st.success("No high-risk alerts identified.")
+
+
 # -------------------------
 # Main Streamlit app
 # -------------------------
@@ -661,7 +701,7 @@ def main():
             end_date = st.date_input("End date", today, key="rep_end")
 
         # Pull sample to populate dropdowns (handle empty safely)
-        sample_claims = load_claims(start_date, end_date, {})
+        sample_claims, _ = load_claims(start_date, end_date, {})
         employee_list = sorted(sample_claims["employee_id"].dropna().unique().tolist()) if not sample_claims.empty else []
         category_list = sorted(sample_claims["expense_category"].dropna().unique().tolist()) if not sample_claims.empty else []
         currency_list = sorted(sample_claims["currency"].dropna().unique().tolist()) if not sample_claims.empty else []
@@ -669,8 +709,7 @@ def main():
         with r1c3:
             employee_choice = st.selectbox("Employee", options=["All"] + employee_list, index=0, key="rep_emp")
         with r1c4:
-            st.write("")  # spacer
-            st.write("")
+            page_size = st.number_input("Rows per page", min_value=5, max_value=1000, value=100, step=25, key="rep_page_size")
 
         # Row 2: Category + Currency + Vendor + Status
         r2c1, r2c2, r2c3, r2c4 = st.columns([1.1, 1.1, 1.4, 2.4])
@@ -690,7 +729,7 @@ def main():
 
         st.markdown("---")
 
-        # Build filters dict (server-side for supported keys, rest client-side)
+        # Build filters dict (all applied server-side by /claims/list)
         filters = {}
         if employee_choice and employee_choice != "All":
             filters["employee_id"] = employee_choice
@@ -703,8 +742,17 @@ def main():
 
         # ------------- LOAD DATA -------------
         with st.spinner("Loading report..."):
-            df_claims_raw = load_claims(start_date, end_date, filters)
-            df_claims = apply_client_side_filters(df_claims_raw, filters, status_choice)
+            # keyset paging: a stack of cursors per filter set (page 1 has cursor None)
+            page_key = repr((start_date, end_date, sorted(filters.items()), sorted(status_choice or []), page_size))
+            if st.session_state.get("rep_page_key") != page_key:
+                st.session_state["rep_page_key"] = page_key
+                st.session_state["rep_cursors"] = [None]
+            cursors = st.session_state["rep_cursors"]
+            df_claims, page_meta = load_claims(start_date, end_date, filters, status_choice,
+                                               cursor=cursors[-1], limit=page_size)
+            if cursors[-1] is None:
+                st.session_state["rep_totals"] = page_meta
+            totals = st.session_state.get("rep_totals") or {}
 
             summary = load_summary(start_date, end_date, filters)
             # print(summary)
@@ -713,12 +761,12 @@ def main():
             policy_df = load_policy_compliance()
 
             pending_statuses = {"Pending", "Manager Pending", "Finance Pending", "Pending Review"}
-            if df_claims.empty or "status" not in df_claims.columns:
-                pending_df = pd.DataFrame(
-                    columns=["claim_id", "employee_id", "claim_date", "expense_category", "amount", "currency", "vendor_name", "status"]
-                )
+            # no Status filter means every status, so every pending one
+            pending_choice = [s for s in status_choice if s in pending_statuses] if status_choice else sorted(pending_statuses)
+            if pending_choice:
+                pending_df, pending_meta = load_claims(start_date, end_date, filters, pending_choice, limit=500)
             else:
-                pending_df = df_claims[df_claims["status"].fillna("").str.strip().isin(pending_statuses)].copy()
+                pending_df, pending_meta = pd.DataFrame(columns=["expense_category"]), {}
 
 
         # ------------- KPIs -------------
@@ -783,7 +831,11 @@ def main():
                 st.write("No pending claims.")
 
             else:
-                pie_df = pending_df.groupby("expense_category", dropna=False).size().reset_index(name="value")
+                if pending_meta.get("by_category"):
+                    # exact per-category counts from the rollups, not just the first page
+                    pie_df = to_df(pending_meta["by_category"]).rename(columns={"claim_count": "value"})
+                else:
+                    pie_df = pending_df.groupby("expense_category", dropna=False).size().reset_index(name="value")
                 pie_df["expense_category"] = pie_df["expense_category"].fillna("(unknown)")
                 fig = px.pie(pie_df, names="expense_category", values="value", hole=0.6)
                 fig.update_traces(textinfo="label+value", hovertemplate="%{label}: %{value}<extra></extra>")
@@ -801,22 +853,35 @@ def main():
         # ------------- TABLE + EXPORT -------------
         st.markdown("---")
         st.subheader("Claims Table")
+        if totals.get("total") is not None:
+            approx = "" if totals.get("total_exact") else "~"
+            st.caption(f"{approx}{totals['total']:,} matching claims · page {len(cursors)} ({len(df_claims)} rows)")
         if df_claims.empty:
             st.write("No claims found for this filter set.")
         else:
             with st.expander("Table options"):
                 cols = st.multiselect("Columns to show", options=list(df_claims.columns), default=list(df_claims.columns))
-                page_size = st.number_input("Rows per page", min_value=5, max_value=200, value=25)
 
+            # rows arrive newest first, (claim_date, claim_id) DESC
             st.dataframe(
-                df_claims[cols].sort_values("claim_date", ascending=False).reset_index(drop=True),
+                df_claims[cols].reset_index(drop=True),
                 height=500,
                 use_container_width=True,
             )
 
+            p1, p2, _ = st.columns([0.6, 0.6, 4])
+            with p1:
+                if st.button("◀ Previous", disabled=len(cursors) <= 1, key="rep_prev"):
+                    cursors.pop()
+                    st.rerun()
+            with p2:
+                if st.button("Next ▶", disabled=not page_meta.get("next_cursor"), key="rep_next"):
+                    cursors.append(page_meta["next_cursor"])
+                    st.rerun()
+
             csv_bytes = df_to_csv_bytes(df_claims[cols])
             st.download_button(
-                label="Download filtered as CSV",
+                label="Download this page as CSV",
                 data=csv_bytes,
                 file_name="claims_filtered.csv",
                 mime="text/csv",
@@ -837,72 +902,49 @@ def main():
         ai_end_date = st.date_input("End Date (for AI analysis)", date.today(), key="ai_end")
 
     if st.button("🚀 Run AI Finance Analysis"):
-        with st.spinner("AI Agent analyzing financial data..."):
-            try:
-                api_url = "http://localhost:8000/api/ai/finance-insights"
-                payload = {
-                    "start_date": ai_start_date.isoformat(),
-                    "end_date": ai_end_date.isoformat(),
-                    "include_ai_recommendations": True
-                }
-                response = requests.post(api_url, json=payload)
-                response.raise_for_status()
-                ai_data = response.json()
-            except Exception as e:
-                st.error(f"❌ Error fetching AI insights: {e}")
-                st.stop()
-
-        st.success("✅ AI Insights generated successfully")
-        print(ai_data)
-        # -------------------------------------------------------------------
-        # Executive Summary
-        # -------------------------------------------------------------------
+        # the stream sends the SQL-backed sections first and the summary as it is
+        # written, so the page fills in long before the LLM is done
         st.markdown("### 🧾 Executive Summary")
-        st.write(ai_data.get("executive_summary", "No summary available."))
-
-        # -------------------------------------------------------------------
-        # Key Metrics Cards
-        # -------------------------------------------------------------------
-        st.markdown("### 📊 Key Metrics")
-        metrics = ai_data.get("key_metrics", {})
-        c1, c2, c3= st.columns(3)
-        c1.metric("Total Claims", f"{metrics.get('total_claims', 0):,}")
-        c2.metric("Total Spend", f"₹{metrics.get('total_spend', 0):,.0f}")
-        c3.metric("Avg Claim", f"₹{metrics.get('avg_claim_amount', 0):,.0f}")
-        # c4.metric("Auto-Approval %", f"{metrics.get('auto_approval_rate', 0)*100:.1f}%")
-
-        # -------------------------------------------------------------------
-        # Insights
-        # -------------------------------------------------------------------
-        st.markdown("### 💡 AI-Detected Insights")
-        insights = ai_data.get("insights", [])
-        if insights:
-            for i in insights:
-                st.markdown(f"- {i}")
-        else:
-            st.info("No insights detected for this period.")
-
-        # -------------------------------------------------------------------
-        # Policy Optimization Suggestions
-        # -------------------------------------------------------------------
-        st.markdown("### ⚙️ Policy Optimization Suggestions")
-        policies = ai_data.get("policy_optimizations", [])
-        if policies:
-            for p in policies:
-                st.markdown(f"- {p}")
-        else:
-            st.info("No policy optimization suggestions available.")
+        summary_box = st.empty()
+        sections_box = st.container()
+        ai_data, summary_text, sections_shown = None, "", False
+        try:
+            api_url = f"{API_BASE}/api/ai/finance-insights/stream"
+            payload = {
+                "start_date": ai_start_date.isoformat(),
+                "end_date": ai_end_date.isoformat(),
+                "include_ai_recommendations": True
+            }
+            with st.spinner("AI Agent analyzing financial data..."):
+                with requests.post(api_url, json=payload, stream=True, timeout=(TIMEOUT, 300)) as response:
+                    response.raise_for_status()
+                    for line in response.iter_lines(decode_unicode=True):
+                        if not line:
+                            continue
+                        ev = json.loads(line)
+                        if ev["event"] == "metrics":
+                            with sections_box:
+                                render_finance_sections(ev)
+                            sections_shown = True
+                        elif ev["event"] == "summary":
+                            summary_text += ev.get("text") or ""
+                            summary_box.write(summary_text)
+                        elif ev["event"] == "error":
+                            st.warning(ev.get("detail") or "AI insights reported an error")
+                        elif ev["event"] == "final":
+                            ai_data = ev["result"]
+        except Exception as e:
+            st.error(f"❌ Error fetching AI insights: {e}")
+            st.stop()
+        if ai_data is None:
+            st.error("❌ AI insights stream ended without a result")
+            st.stop()
 
-        # -------------------------------------------------------------------
-        # Risk Alerts
-        # -------------------------------------------------------------------
-        st.markdown("### 🚨 Risk Alerts")
-        risks = ai_data.get("risk_alerts", [])
-        if risks:
-            for r in risks:
-                st.markdown(f"- {r}")
-        else:
-            st.success("No high-risk alerts identified.")
+        st.success("✅ AI Insights generated successfully")
+        summary_box.write(ai_data.get("executive_summary") or summary_text or "No summary available.")
+        if not sections_shown:
+            with sections_box:
+                render_finance_sections(ai_data)
 
         # -------------------------------------------------------------------
         # Actions
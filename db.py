@@ -1,42 +1,16 @@
 # db.py
-import os
 import psycopg2
 import psycopg2.extras
-from psycopg2 import pool
 from contextlib import contextmanager
-from dotenv import load_dotenv
-
-# ------------------------------------------------------------------
-# Load environment variables
-# ------------------------------------------------------------------
-load_dotenv()
-
-DB_CONFIG = {
-    "host": os.getenv("DB_HOST", "localhost"),
-    "port": os.getenv("DB_PORT", "5432"),
-    "database": os.getenv("DB_NAME", "agent_max"),
-    "user": os.getenv("DB_USER", "myuser"),
-    "password": os.getenv("DB_PASSWORD", "rootpassword"),
-}
-
-DB_MIN_CONN = int(os.getenv("DB_MIN_CONN", 1))
-DB_MAX_CONN = int(os.getenv("DB_MAX_CONN", 10))
 
+import database as _database
 
 # ------------------------------------------------------------------
-# Create PostgreSQL connection pool
+# Connections come from the shared SQLAlchemy pool in database.py
+# (previously a separate psycopg2 SimpleConnectionPool). raw_connection()
+# hands out the underlying psycopg2 connection; close() returns it to the pool.
 # ------------------------------------------------------------------
-try:
-    connection_pool = psycopg2.pool.SimpleConnectionPool(
-        DB_MIN_CONN,
-        DB_MAX_CONN,
-        **DB_CONFIG
-    )
-    if connection_pool:
-        print("✅ PostgreSQL connection pool created successfully.")
-except Exception as e:
-    print(f"❌ Error creating connection pool: {e}")
-    raise e
+connection_pool = _database.get_engine().pool
 
 
 # ------------------------------------------------------------------
@@ -46,14 +20,14 @@ except Exception as e:
 def get_connection():
     conn = None
     try:
-        conn = connection_pool.getconn()
+        conn = _database.get_engine().raw_connection()
         yield conn
     except Exception as e:
         print(f"❌ Database connection error: {e}")
         raise e
     finally:
         if conn:
-            connection_pool.putconn(conn)
+            conn.close()
 
 
 # ------------------------------------------------------------------
@@ -86,7 +60,5 @@ def safe_query(conn, sql, params=None):
 # ------------------------------------------------------------------
 def close_connection_pool():
     """Close all connections in pool."""
-    global connection_pool
-    if connection_pool:
-        connection_pool.closeall()
-        print("🛑 Connection pool closed.")
+    _database.get_engine().dispose()
+    print("🛑 Connection pool closed.")
@@ -11,12 +11,13 @@ import sqlalchemy as _sql
 from sqlalchemy import text
 
 import database as _database  # expects DATABASE_URL in database.py
+import claim_ids as _claim_ids
 
 # ------------------------------------------------------------------
 # 1. ENGINE SETUP
 # ------------------------------------------------------------------
 DATABASE_URL = _database.DATABASE_URL
-engine = _sql.create_engine(DATABASE_URL, future=True)
+engine = _database.get_engine()  # shared, instrumented process pool
 
 
 # ------------------------------------------------------------------
@@ -91,19 +92,15 @@ def get_per_diem_rates(emp_id: str | None = None):
 
 def generate_claim_id():
     """
-    CLM-YYYYMMDD-XXXX (XXXX = count+1 snapshot at call time)
+    CLM-YYYYMMDD-NNNNNNN (NNNNNNN from the claim_id_seq sequence; see claim_ids.py)
     """
-    date_prefix = dt.datetime.now().strftime("%Y%m%d")
     try:
-        with engine.connect() as conn:
-            result = conn.execute(text("SELECT COUNT(*) FROM expense_claims")).scalar() or 0
-            next_num = int(result) + 1
+        return _claim_ids.next_claim_id()
     except Exception as ex:
         print(f"[db_utils] generate_claim_id error: {ex}")
-        next_num = 1
-    return f"CLM-{date_prefix}-{next_num:04d}"
+        raise
 
-def save_expense_claim(payload_out: dict, status) -> str:
+def save_expense_claim(payload_out: dict, status, claim_id: Optional[str] = None) -> str:
     """
     Insert one row into expense_claims using normalized payload.
     status can be:
@@ -111,7 +108,7 @@ def save_expense_claim(payload_out: dict, status) -> str:
       - validator result dict
     """
     now = datetime.now()
-    claim_id = f"CLM-{now.strftime('%Y%m%d-%H%M%S')}"
+    claim_id = claim_id or generate_claim_id()
 
     employee_id = payload_out.get("employee_id")
     expense_category = payload_out.get("category", "other")
@@ -248,6 +245,8 @@ def log_validation_result(claim_id: str, employee_id: str, validation_obj: dict)
     """
     Write a snapshot of validator output into expense_validation_logs.
     """
+    import validation_messages  # local import: it imports this module
+    validation_obj = validation_messages.merge_into(validation_obj)
     status_val = (
         validation_obj.get("status")
         or validation_obj.get("route_status")
@@ -339,6 +338,63 @@ def finance_update_claim_decision(claim_id: str, decision: str, comment: str, ap
             WHERE claim_id = :cid
         """), {"cid_status": status_val, "cid": claim_id})
 
+DECISION_BATCH_CHUNK = 1000
+
+def bulk_update_claim_decisions(
+    decisions: List[Dict[str, Any]],
+    actor_role: str = "Finance",
+    approver_id: str = "",
+) -> Dict[str, Any]:
+    """
+    Manager/finance Approve/Reject for many claims at once.
+    decisions: [{"claim_id", "decision": 'Approve'|'Reject', "comment"}]
+    One UPDATE ... FROM (VALUES ...) RETURNING per chunk, all in one transaction;
+    the returned rows carry what notifications need (employee, amount, email).
+    """
+    by_id: Dict[str, Dict[str, Any]] = {}
+    for d in decisions:
+        cid = str(d.get("claim_id", "")).strip()
+        decision = str(d.get("decision", "")).strip()
+        if cid and decision in {"Approve", "Reject"}:
+            by_id[cid] = {
+                "status": "Approved" if decision == "Approve" else "Rejected",
+                "comment": str(d.get("comment") or "").strip(),
+            }
+    if not by_id:
+        return {"rows": [], "missing": []}
+
+    ids = list(by_id)
+    rows: List[Dict[str, Any]] = []
+    with engine.begin() as conn:
+        for start in range(0, len(ids), DECISION_BATCH_CHUNK):
+            chunk = ids[start:start + DECISION_BATCH_CHUNK]
+            params: Dict[str, Any] = {}
+            values = []
+            for i, cid in enumerate(chunk):
+                params[f"c{i}"] = cid
+                params[f"s{i}"] = by_id[cid]["status"]
+                values.append(f"(:c{i}, :s{i})")
+            result = conn.execute(text(f"""
+                UPDATE expense_claims AS ec
+                SET status = v.status
+                FROM (VALUES {", ".join(values)}) AS v(claim_id, status)
+                WHERE ec.claim_id = v.claim_id
+                RETURNING ec.claim_id, ec.employee_id, ec.expense_category AS category,
+                          ec.amount::float AS amount, ec.currency, ec.vendor_name,
+                          ec.claim_date, ec.status,
+                          (SELECT e.email FROM employees e WHERE e.employee_id = ec.employee_id) AS employee_email,
+                          (SELECT TRIM(e.first_name || ' ' || e.last_name)
+                             FROM employees e WHERE e.employee_id = ec.employee_id) AS employee_name
+            """), params)
+            rows.extend(dict(r) for r in result.mappings().all())
+
+    for r in rows:
+        r["comment"] = by_id[r["claim_id"]]["comment"]
+        r["actor_role"] = actor_role
+        r["approver_id"] = approver_id
+    found = {r["claim_id"] for r in rows}
+    return {"rows": rows, "missing": [cid for cid in ids if cid not in found]}
+
 
 # ------------------------------------------------------------------
 # 4. DASHBOARD / WORKFLOW QUERIES
@@ -929,20 +985,83 @@ def get_claim_details(claim_id: str) -> Dict[str, Any] | None:
 # 6. HIGH-LEVEL ROLLUP
 # ------------------------------------------------------------------
 
-def get_claims_summary() -> Dict[str, Any]:
+# GROUPING(cat_key, vendor_key, employee_id) bitmask per grouping set
+_GS_TOTAL, _GS_CATEGORY, _GS_VENDOR, _GS_EMPLOYEE = 7, 3, 5, 6
+
+def get_claims_summary(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    limit: int = 10,
+) -> Dict[str, Any]:
     """
     Consolidated KPI summary (was queries.get_claims_summary()).
+    One scan of expense_claims: totals via FILTER aggregates, breakdowns via
+    GROUPING SETS, top-N per breakdown via ROW_NUMBER.
+    """
+    where_sql, params = _date_filter_sql(start_date, end_date)
+    params["lim"] = limit
+    sql = f"""
+        WITH c AS (
+            SELECT
+                COALESCE(expense_category, 'unknown') AS cat_key,
+                COALESCE(vendor_name, 'Unknown')      AS vendor_key,
+                employee_id, amount, fraud_flag, auto_approved
+            FROM expense_claims
+            {where_sql}
+        ),
+        g AS (
+            SELECT
+                GROUPING(cat_key, vendor_key, employee_id) AS gid,
+                cat_key, vendor_key, employee_id,
+                COUNT(*)                                     AS n,
+                COALESCE(SUM(amount)::float, 0)              AS total_amount,
+                ROUND(AVG(amount)::numeric, 2)::float        AS avg_amount,
+                COUNT(*) FILTER (WHERE fraud_flag = TRUE)    AS fraud_count,
+                COUNT(*) FILTER (WHERE auto_approved = TRUE) AS auto_count
+            FROM c
+            GROUP BY GROUPING SETS ((), (cat_key), (vendor_key), (employee_id))
+        )
+        SELECT * FROM (
+            SELECT g.*,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY gid
+                       ORDER BY CASE WHEN gid = {_GS_EMPLOYEE} THEN avg_amount ELSE total_amount END DESC NULLS LAST
+                   ) AS rn
+            FROM g
+        ) r
+        WHERE gid IN ({_GS_TOTAL}, {_GS_CATEGORY}) OR rn <= :lim
+        ORDER BY gid, rn
     """
-    out: Dict[str, Any] = {}
-    out.update(get_total_claims())
-    out.update(get_total_amount())
-    out.update(get_fraud_stats())
-    out.update(get_auto_approved_count())
-    out.update(get_auto_approved_rate())
-    out.update(get_claims_by_category())
-    out.update(get_top_vendors(limit=10))
-    out.update(get_avg_amount_per_employee(limit=10))
-    return out
+    with engine.connect() as conn:
+        rows = conn.execute(text(sql), params).mappings().all()
+
+    total_row = next((r for r in rows if r["gid"] == _GS_TOTAL), None)
+    total = int(total_row["n"] or 0) if total_row else 0
+    frauds = int(total_row["fraud_count"] or 0) if total_row else 0
+    auto = int(total_row["auto_count"] or 0) if total_row else 0
+
+    return {
+        "total_claims": total,
+        "total_amount": float(total_row["total_amount"] or 0.0) if total_row else 0.0,
+        "fraud_count": frauds,
+        "fraud_percent": round((frauds / total * 100.0) if total else 0.0, 2),
+        "auto_approved": auto,
+        "auto_approved_rate": round((auto / total * 100.0) if total else 0.0, 2),
+        "claims_by_category": [
+            {"expense_category": r["cat_key"], "total_claims": int(r["n"] or 0),
+             "total_amount": float(r["total_amount"] or 0.0)}
+            for r in rows if r["gid"] == _GS_CATEGORY
+        ],
+        "top_vendors": [
+            {"vendor_name": r["vendor_key"], "total_spent": float(r["total_amount"] or 0.0)}
+            for r in rows if r["gid"] == _GS_VENDOR
+        ],
+        "avg_claim_amounts": [
+            {"employee_id": r["employee_id"],
+             "avg_amount": float(r["avg_amount"]) if r["avg_amount"] is not None else None}
+            for r in rows if r["gid"] == _GS_EMPLOYEE
+        ],
+    }
 
 
 # @@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@@
@@ -960,6 +1079,7 @@ from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy import String
 
 import database as _database  # single source of truth
+import claim_ids as _claim_ids
 
 engine = _database.get_engine()
 
@@ -1004,19 +1124,19 @@ def get_per_diem_rates(emp_id: str | None = None):
     return [] if err else df.to_dict(orient="records")
 
 def generate_claim_id():
-    date_prefix = dt.datetime.now().strftime("%Y%m%d")
     try:
-        with engine.connect() as conn:
-            result = conn.execute(text("SELECT COUNT(*) FROM expense_claims")).scalar() or 0
-            nxt = int(result) + 1
+        return _claim_ids.next_claim_id()
     except Exception as ex:
         print(f"[db_utils] generate_claim_id error: {ex}")
-        nxt = 1
-    return f"CLM-{date_prefix}-{nxt:04d}"
+        raise
+
+def reserve_claim_ids(n: int) -> List[str]:
+    """Pre-allocate n claim ids in one round-trip for batch ingestion."""
+    return _claim_ids.reserve_claim_ids(n)
 
-def save_expense_claim(payload_out: dict, status) -> str:
+def save_expense_claim(payload_out: dict, status, claim_id: Optional[str] = None) -> str:
     now = datetime.now()
-    claim_id = f"CLM-{now.strftime('%Y%m%d-%H%M%S')}"
+    claim_id = claim_id or generate_claim_id()
 
     employee_id = payload_out.get("employee_id")
     expense_category = payload_out.get("category", "other")
@@ -1106,6 +1226,9 @@ def save_expense_claim(payload_out: dict, status) -> str:
 
 def log_validation_result(claim_id: str, employee_id: str, validation_obj: dict):
     # expects a dict; caller must NOT pass a string
+    import validation_messages  # local import: it imports this module
+    # background LLM message may already be ready for this validation
+    validation_obj = validation_messages.merge_into(validation_obj)
     status_val = (
         validation_obj.get("status")
         or validation_obj.get("route_status")
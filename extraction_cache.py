@@ -0,0 +1,211 @@
+# extraction_cache.py
+"""
+Content-addressed cache for invoice extraction results.
+
+Entries are keyed by SHA-256 of the uploaded file bytes plus a hash of the
+prompt and the model name, so re-uploading the same receipt (even under a new
+file name) skips the LLM call. Entries live as small JSON files on disk and are
+evicted by age and by total size (least recently used first).
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+# =========================================================
+# CONFIG
+# =========================================================
+CACHE_ENABLED = os.getenv("EXTRACTION_CACHE_ENABLED", "true").lower() == "true"
+CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR", "./output/extraction_cache")
+CACHE_MAX_MB = float(os.getenv("EXTRACTION_CACHE_MAX_MB", "256"))
+CACHE_TTL_HOURS = float(os.getenv("EXTRACTION_CACHE_TTL_HOURS", "720"))
+
+_READ_CHUNK = 1024 * 1024
+
+
+def _sha256_text(s: str) -> str:
+    return hashlib.sha256((s or "").encode("utf-8")).hexdigest()
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_READ_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ExtractionCache:
+    """
+    Disk-backed extraction cache with size/age eviction and hit/miss counters.
+    Safe to share between threads of one process; concurrent processes may
+    both miss on the same key, which only costs a duplicate LLM call.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = CACHE_DIR,
+        max_bytes: int = int(CACHE_MAX_MB * 1024 * 1024),
+        max_age_seconds: float = CACHE_TTL_HOURS * 3600,
+        enabled: bool = CACHE_ENABLED,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = int(max_bytes)
+        self.max_age_seconds = float(max_age_seconds)
+        self.enabled = bool(enabled)
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        if self.enabled:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    # ------------------------------
+    # keys
+    # ------------------------------
+    @staticmethod
+    def make_key(file_path: str, instructions: str, model: str, salt: str = "") -> str:
+        """file bytes + prompt + model (+ optional salt for pre-processing settings)."""
+        parts = [file_sha256(file_path), _sha256_text(instructions), model or "", salt or ""]
+        return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+    def _path_for(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    # ------------------------------
+    # get / put
+    # ------------------------------
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        path = self._path_for(key)
+        try:
+            age = time.time() - path.stat().st_mtime
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+
+        if self.max_age_seconds > 0 and age > self.max_age_seconds:
+            self._remove(path)
+            self._count("misses")
+            return None
+
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path, None)  # bump recency for LRU eviction
+        except Exception as ex:
+            print(f"[extraction_cache] unreadable entry {path.name}: {ex}")
+            self._remove(path)
+            self._count("misses")
+            return None
+
+        self._count("hits")
+        return entry
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        path = self._path_for(key)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False, default=str)
+            os.replace(tmp, path)
+            self._count("writes")
+        except Exception as ex:
+            print(f"[extraction_cache] write failed for {path.name}: {ex}")
+            self._remove(tmp)
+            return
+        self.evict()
+
+    # ------------------------------
+    # eviction
+    # ------------------------------
+    def evict(self) -> int:
+        """Drop expired entries, then oldest entries until under max_bytes."""
+        if not self.enabled:
+            return 0
+        now = time.time()
+        entries = []
+        removed = 0
+        for p in self.cache_dir.glob("*.json"):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            if self.max_age_seconds > 0 and now - st.st_mtime > self.max_age_seconds:
+                if self._remove(p):
+                    removed += 1
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+
+        total = sum(size for _, size, _ in entries)
+        if self.max_bytes > 0 and total > self.max_bytes:
+            entries.sort(key=lambda e: e[0])
+            for _, size, p in entries:
+                if total <= self.max_bytes:
+                    break
+                if self._remove(p):
+                    removed += 1
+                    total -= size
+
+        if removed:
+            self._count("evictions", removed)
+        return removed
+
+    def clear(self) -> None:
+        for p in self.cache_dir.glob("*.json"):
+            self._remove(p)
+
+    # ------------------------------
+    # stats
+    # ------------------------------
+    def stats(self) -> Dict[str, Any]:
+        files = list(self.cache_dir.glob("*.json")) if self.enabled else []
+        size = 0
+        for p in files:
+            try:
+                size += p.stat().st_size
+            except FileNotFoundError:
+                pass
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(files),
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "max_age_seconds": self.max_age_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    # ------------------------------
+    # internals
+    # ------------------------------
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    @staticmethod
+    def _remove(path: Path) -> bool:
+        try:
+            path.unlink()
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as ex:
+            print(f"[extraction_cache] could not remove {path}: {ex}")
+            return False
+
+
+# Process-wide instance used by agent.extract_file_internal
+extraction_cache = ExtractionCache()
@@ -0,0 +1,262 @@
+# finance_cache.py
+"""
+Result cache for /api/ai/finance-insights.
+
+Entries are keyed by (start_date, end_date, include_ai) and remember the data
+watermark they were computed at:
+
+    (MAX(expense_claims.id), claims version, policies version)
+
+The versions are sequences (expense_claims_version_seq,
+expense_policies_version_seq) advanced by statement-level triggers, so status
+changes (approvals, bulk re-validation) invalidate just like new claims do.
+nextval() never waits on other writers, unlike a shared counter row, and one
+call per statement costs nothing next to a bulk UPDATE (a per-row deferred
+trigger doubled a 300k-row update). The bump is visible from the end of the
+statement rather than from commit; a reader in that window can cache
+pre-commit data under the new watermark, which lasts until the next write or
+the TTL. Reading the watermark is one round trip.
+
+  * same watermark, younger than FINANCE_CACHE_TTL_SECONDS  -> "hit"
+  * otherwise, younger than FINANCE_CACHE_STALE_MAX_SECONDS  -> "stale": the
+    previous answer is returned at once and a refresh runs in the background
+  * no entry / too old                                       -> "miss": compute
+Concurrent callers for the same key share one computation. Results whose
+LLM step failed (meta.llm_error with include_ai) are returned but never cached,
+so a transient OpenAI error is not replayed for the TTL.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from datetime import date
+from typing import Optional, Dict, Any, Tuple, Callable
+
+from sqlalchemy import text
+
+import db_utils
+
+FINANCE_CACHE_TTL_SECONDS = float(os.getenv("FINANCE_CACHE_TTL_SECONDS", "3600"))
+FINANCE_CACHE_STALE_MAX_SECONDS = float(os.getenv("FINANCE_CACHE_STALE_MAX_SECONDS", "86400"))
+FINANCE_CACHE_MAX_ENTRIES = int(os.getenv("FINANCE_CACHE_MAX_ENTRIES", "64"))
+FINANCE_CACHE_INSTALL_RETRY_SECONDS = float(os.getenv("FINANCE_CACHE_INSTALL_RETRY_SECONDS", "30"))
+
+_DDL = [
+    "CREATE SEQUENCE IF NOT EXISTS expense_claims_version_seq",
+    "CREATE SEQUENCE IF NOT EXISTS expense_policies_version_seq",
+    """
+    CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+    BEGIN
+        PERFORM nextval((TG_TABLE_NAME || '_version_seq')::regclass);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    # earlier installs: per-row deferred constraint triggers plus separate TRUNCATE ones
+    "DROP TRIGGER IF EXISTS trg_expense_claims_version ON expense_claims",
+    "DROP TRIGGER IF EXISTS trg_expense_policies_version ON expense_policies",
+    "DROP TRIGGER IF EXISTS trg_expense_claims_version_truncate ON expense_claims",
+    "DROP TRIGGER IF EXISTS trg_expense_policies_version_truncate ON expense_policies",
+    """
+    CREATE TRIGGER trg_expense_claims_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON expense_claims
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version()
+    """,
+    """
+    CREATE TRIGGER trg_expense_policies_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON expense_policies
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version()
+    """,
+]
+
+# statement-level (tgtype bit 0 clear) version triggers on both tables: nothing to do
+_INSTALLED_SQL = """
+    SELECT COUNT(*) = 2 FROM pg_trigger
+    WHERE tgname IN ('trg_expense_claims_version', 'trg_expense_policies_version')
+      AND tgrelid IN ('expense_claims'::regclass, 'expense_policies'::regclass)
+      AND (tgtype & 1) = 0
+      AND to_regclass('expense_claims_version_seq') IS NOT NULL
+      AND to_regclass('expense_policies_version_seq') IS NOT NULL
+"""
+
+_VERSIONS_READY = False
+_VERSIONS_FAILED = False   # no rights to install: stays on the count watermark
+_VERSIONS_RETRY_AT = 0.0   # any other install error: try again after a backoff
+
+Key = Tuple[Optional[str], Optional[str], bool]
+
+
+# ------------------------------------------------------------------
+# WATERMARK
+# ------------------------------------------------------------------
+def ensure_data_versions() -> None:
+    global _VERSIONS_READY
+    if _VERSIONS_READY:
+        return
+    # DROP TRIGGER takes ACCESS EXCLUSIVE on expense_claims: only when needed
+    with db_utils.engine.connect() as conn:
+        installed = conn.execute(text(_INSTALLED_SQL)).scalar()
+    if not installed:
+        with db_utils.engine.begin() as conn:
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('data_version_seq_install'))"))
+            if not conn.execute(text(_INSTALLED_SQL)).scalar():
+                for stmt in _DDL:
+                    conn.execute(text(stmt))
+    _VERSIONS_READY = True
+
+
+def _is_permission_error(ex: Exception) -> bool:
+    return getattr(getattr(ex, "orig", None), "pgcode", None) == "42501"  # insufficient_privilege
+
+
+def data_watermark() -> Tuple[Any, ...]:
+    global _VERSIONS_FAILED, _VERSIONS_RETRY_AT
+    try:
+        if _VERSIONS_FAILED:
+            raise RuntimeError("no rights to install version triggers")
+        if time.time() < _VERSIONS_RETRY_AT:
+            raise RuntimeError("install failed recently")
+        ensure_data_versions()
+        sql = """
+            SELECT (SELECT MAX(id) FROM expense_claims),
+                   (SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM expense_claims_version_seq),
+                   (SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM expense_policies_version_seq)
+        """
+    except Exception as ex:
+        # fall back to a slightly costlier signature that misses status-only
+        # updates; only a permission error makes that permanent
+        if not _VERSIONS_FAILED and time.time() >= _VERSIONS_RETRY_AT:
+            if _is_permission_error(ex):
+                _VERSIONS_FAILED = True
+                print(f"[finance_cache] no rights to install version sequences ({ex}); using count watermark")
+            else:
+                _VERSIONS_RETRY_AT = time.time() + FINANCE_CACHE_INSTALL_RETRY_SECONDS
+                print(f"[finance_cache] version sequences unavailable ({ex}); "
+                      f"count watermark for {FINANCE_CACHE_INSTALL_RETRY_SECONDS:.0f}s")
+        sql = "SELECT MAX(id), COUNT(*), (SELECT COUNT(*) FROM expense_policies) FROM expense_claims"
+    with db_utils.engine.connect() as conn:
+        return tuple(conn.execute(text(sql)).first())
+
+
+# ------------------------------------------------------------------
+# CACHE
+# ------------------------------------------------------------------
+class FinanceInsightsCache:
+    def __init__(self, max_entries: int = FINANCE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Key, Dict[str, Any]]" = OrderedDict()
+        self._inflight: Dict[Key, Future] = {}
+        self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="finance-cache")
+        self.counts = {"hit": 0, "stale": 0, "miss": 0, "refreshes": 0, "errors": 0, "not_cached": 0}
+
+    @staticmethod
+    def key(start_date: Optional[date], end_date: Optional[date], include_ai: bool) -> Key:
+        return (
+            start_date.isoformat() if start_date else None,
+            end_date.isoformat() if end_date else None,
+            bool(include_ai),
+        )
+
+    def _cacheable(self, key: Key, result: Dict[str, Any]) -> bool:
+        if key[2] and (result.get("meta") or {}).get("llm_error"):
+            self.counts["not_cached"] += 1
+            return False
+        return True
+
+    def _put(self, key: Key, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _compute(self, key: Key, watermark, compute: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """Single-flight: concurrent callers for one key wait on the same future."""
+        with self._lock:
+            fut = self._inflight.get(key)
+            owner = fut is None
+            if owner:
+                fut = Future()
+                self._inflight[key] = fut
+        if not owner:
+            return fut.result()
+        try:
+            result = compute()
+            entry = {"result": result, "watermark": watermark, "computed_at": time.time()}
+            if self._cacheable(key, result):
+                self._put(key, entry)
+            fut.set_result(entry)
+            return entry
+        except Exception as ex:
+            self.counts["errors"] += 1
+            fut.set_exception(ex)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _refresh(self, key: Key, watermark, compute) -> None:
+        self.counts["refreshes"] += 1
+        try:
+            self._compute(key, watermark, compute)
+        except Exception as ex:
+            print(f"[finance_cache] background refresh failed for {key}: {ex}")
+
+    def get(self, start_date, end_date, include_ai: bool, compute: Callable[[], Dict[str, Any]]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Returns (result, cache_meta)."""
+        key = self.key(start_date, end_date, include_ai)
+        watermark = data_watermark()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        now = time.time()
+        if entry is not None:
+            age = now - entry["computed_at"]
+            if entry["watermark"] == watermark and age <= FINANCE_CACHE_TTL_SECONDS:
+                self.counts["hit"] += 1
+                return entry["result"], {"status": "hit", "age_s": round(age, 1), "computed_at": entry["computed_at"]}
+            if age <= FINANCE_CACHE_STALE_MAX_SECONDS:
+                self.counts["stale"] += 1
+                with self._lock:
+                    refreshing = key in self._inflight
+                if not refreshing:
+                    self._refresher.submit(self._refresh, key, watermark, compute)
+                return entry["result"], {
+                    "status": "stale", "age_s": round(age, 1), "computed_at": entry["computed_at"], "refreshing": True,
+                }
+        self.counts["miss"] += 1
+        entry = self._compute(key, watermark, compute)
+        return entry["result"], {"status": "miss", "age_s": 0.0, "computed_at": entry["computed_at"]}
+
+    def peek(self, start_date, end_date, include_ai: bool, watermark) -> Optional[Dict[str, Any]]:
+        """A fresh entry (same watermark, within TTL) or None; never computes."""
+        key = self.key(start_date, end_date, include_ai)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry["watermark"] != watermark:
+            return None
+        if time.time() - entry["computed_at"] > FINANCE_CACHE_TTL_SECONDS:
+            return None
+        self.counts["hit"] += 1
+        return entry
+
+    def store(self, start_date, end_date, include_ai: bool, watermark, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Record a result computed outside get() (the streaming endpoint); skipped if its LLM step failed."""
+        key = self.key(start_date, end_date, include_ai)
+        entry = {"result": result, "watermark": watermark, "computed_at": time.time()}
+        if self._cacheable(key, result):
+            self._put(key, entry)
+        return entry
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = len(self._entries)
+            inflight = len(self._inflight)
+        return {"entries": size, "inflight": inflight, **self.counts}
+
+
+finance_cache = FinanceInsightsCache()
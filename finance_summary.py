@@ -0,0 +1,421 @@
+# finance_summary.py
+"""
+Bounded-size input for the finance insights LLM call.
+
+run_finance_agent used to json.dumps every claim in the range into the prompt.
+Instead:
+
+  1. collect()    - SQL does the aggregation: totals, per category / vendor /
+                    employee, policy violations, plus a small sample of
+                    outlier claims (fraud / duplicate flags, furthest over
+                    the limit, highest z-score within the category). Row
+                    counts are capped, so the prompt size no longer follows
+                    the length of the date range. The queries run
+                    concurrently on separate pooled connections.
+  2. build_prompt() - if the rendered data fits FINANCE_PROMPT_TOKEN_BUDGET it
+                    goes out in one call; otherwise it is split into chunks
+                    that are summarised in parallel (map) and one final call
+                    sees only the key metrics + chunk notes (reduce). The
+                    final prompt is clipped to the budget as a hard ceiling.
+
+The policy limit for a claim is picked the way policy_index does it: same
+category, employee grade listed in applicable_grades, highest max_allowance
+(the old join on category alone counted a claim once per grade row).
+"""
+
+import os
+import re
+import json
+import time
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List, Tuple, Iterator
+
+import pandas as pd
+from openai import OpenAI
+
+from db import get_connection, safe_query
+
+FINANCE_TOP_N = int(os.getenv("FINANCE_TOP_N", "15"))
+FINANCE_OUTLIER_SAMPLE = int(os.getenv("FINANCE_OUTLIER_SAMPLE", "25"))
+FINANCE_PROMPT_TOKEN_BUDGET = int(os.getenv("FINANCE_PROMPT_TOKEN_BUDGET", "6000"))
+FINANCE_CHUNK_TOKEN_BUDGET = int(os.getenv("FINANCE_CHUNK_TOKEN_BUDGET", "3000"))
+FINANCE_MAP_WORKERS = int(os.getenv("FINANCE_MAP_WORKERS", "4"))
+FINANCE_COMPLETION_MAX_TOKENS = int(os.getenv("FINANCE_COMPLETION_MAX_TOKENS", "900"))
+FINANCE_LLM_MODEL = os.getenv("FINANCE_LLM_MODEL", "gpt-4o-mini")
+# one shared, bounded pool: caps how many pooled DB connections this endpoint holds at once
+FINANCE_SQL_WORKERS = int(os.getenv("FINANCE_SQL_WORKERS", "6"))
+
+_sql_pool = ThreadPoolExecutor(max_workers=FINANCE_SQL_WORKERS, thread_name_prefix="finance-sql")
+
+try:
+    import tiktoken
+    _ENC = tiktoken.get_encoding("o200k_base")
+except Exception:  # tiktoken missing or no cached encoding: ~4 chars per token
+    _ENC = None
+
+
+# ------------------------------------------------------------------
+# Token budget helpers
+# ------------------------------------------------------------------
+def estimate_tokens(text: str) -> int:
+    if _ENC is not None:
+        return len(_ENC.encode(text))
+    return (len(text) + 3) // 4
+
+
+def clip_to_budget(text: str, budget: int) -> str:
+    if estimate_tokens(text) <= budget:
+        return text
+    if _ENC is not None:
+        return _ENC.decode(_ENC.encode(text)[:budget]) + "\n…[truncated]"
+    return text[: budget * 4] + "\n…[truncated]"
+
+
+def _compact(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+# ------------------------------------------------------------------
+# SQL pre-aggregation
+# ------------------------------------------------------------------
+def _scope_cte(start_date: Optional[date], end_date: Optional[date]) -> Tuple[str, list]:
+    clauses, params = [], []
+    if start_date:
+        clauses.append("c.claim_date >= %s")
+        params.append(start_date)
+    if end_date:
+        clauses.append("c.claim_date <= %s")
+        params.append(end_date)
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    cte = f"""
+        WITH scoped AS (
+            SELECT
+                c.claim_id, c.employee_id,
+                COALESCE(NULLIF(TRIM(CONCAT(e.first_name, ' ', e.last_name)), ''), c.employee_id) AS employee_name,
+                e.department, c.claim_date, c.expense_category, c.amount::float AS amount,
+                c.vendor_name, c.status, c.auto_approved, c.is_duplicate, c.fraud_flag,
+                pol.max_allowance::float AS policy_limit
+            FROM expense_claims c
+            LEFT JOIN employees e ON e.employee_id = c.employee_id
+            LEFT JOIN LATERAL (
+                SELECT p.max_allowance
+                FROM expense_policies p
+                WHERE LOWER(p.category) = LOWER(c.expense_category)
+                  AND p.applicable_grades ILIKE '%%' || e.grade || '%%'
+                ORDER BY (e.grade = ANY(string_to_array(replace(p.applicable_grades, ' ', ''), ','))) DESC,
+                         p.max_allowance DESC
+                LIMIT 1
+            ) pol ON TRUE
+            {where}
+        )
+    """
+    return cte, params
+
+
+FINANCE_QUERIES: Dict[str, str] = {
+    "summary": """
+        SELECT
+            COUNT(*) AS total_claims,
+            COALESCE(SUM(amount), 0)::float AS total_spend,
+            COALESCE(AVG(amount), 0)::float AS avg_claim_amount,
+            COALESCE(AVG(CASE WHEN auto_approved THEN 1 ELSE 0 END), 0)::float AS auto_approval_rate,
+            COUNT(*) FILTER (WHERE amount > policy_limit) AS over_limit_claims,
+            COUNT(DISTINCT employee_id) FILTER (WHERE amount > policy_limit) AS over_limit_employees,
+            COALESCE(SUM(amount - policy_limit) FILTER (WHERE amount > policy_limit), 0)::float AS over_limit_excess,
+            COUNT(*) FILTER (WHERE fraud_flag) AS fraud_flags,
+            COUNT(*) FILTER (WHERE is_duplicate) AS duplicates
+        FROM scoped
+    """,
+    "by_category": f"""
+        SELECT expense_category,
+               COUNT(*) AS claims,
+               SUM(amount)::float AS total_spend,
+               ROUND(AVG(amount)::numeric, 2)::float AS avg_amount,
+               MAX(amount)::float AS max_amount,
+               COUNT(*) FILTER (WHERE amount > policy_limit) AS over_limit,
+               ROUND(AVG(CASE WHEN auto_approved THEN 1 ELSE 0 END)::numeric, 3)::float AS auto_rate
+        FROM scoped
+        GROUP BY expense_category
+        ORDER BY total_spend DESC
+        LIMIT {FINANCE_TOP_N}
+    """,
+    "by_vendor": f"""
+        SELECT vendor_name, COUNT(*) AS claims, SUM(amount)::float AS total_spend,
+               COUNT(DISTINCT employee_id) AS employees
+        FROM scoped
+        GROUP BY vendor_name
+        ORDER BY total_spend DESC
+        LIMIT {FINANCE_TOP_N}
+    """,
+    "by_employee": f"""
+        SELECT employee_id, employee_name, department, COUNT(*) AS claims,
+               SUM(amount)::float AS total_spend,
+               COUNT(*) FILTER (WHERE amount > policy_limit) AS over_limit
+        FROM scoped
+        GROUP BY employee_id, employee_name, department
+        ORDER BY total_spend DESC
+        LIMIT {FINANCE_TOP_N}
+    """,
+    "violations": f"""
+        SELECT expense_category, COUNT(*) AS claims, COUNT(DISTINCT employee_id) AS employees,
+               SUM(amount - policy_limit)::float AS total_excess,
+               ROUND(MAX((amount - policy_limit) / NULLIF(policy_limit, 0) * 100)::numeric, 1)::float AS max_pct_over
+        FROM scoped
+        WHERE amount > policy_limit
+        GROUP BY expense_category
+        ORDER BY total_excess DESC
+        LIMIT {FINANCE_TOP_N}
+    """,
+    # flagged claims first, then whichever is larger: % over the limit (scaled so 25% ~ 1)
+    # or the z-score within the category (scaled so 3 sigma ~ 1)
+    "outliers": f"""
+        , stats AS (
+            SELECT expense_category, AVG(amount) AS mu, STDDEV_POP(amount) AS sd
+            FROM scoped GROUP BY expense_category
+        ), scored AS (
+            SELECT s.*,
+                   (s.amount - s.policy_limit) / NULLIF(s.policy_limit, 0) * 100 AS pct_over,
+                   (s.amount - st.mu) / NULLIF(st.sd, 0) AS z_score
+            FROM scoped s JOIN stats st USING (expense_category)
+        )
+        SELECT claim_id, employee_name, claim_date, expense_category, amount, policy_limit,
+               vendor_name, status, fraud_flag, is_duplicate,
+               ROUND(pct_over::numeric, 1)::float AS pct_over,
+               ROUND(z_score::numeric, 2)::float AS z_score
+        FROM scored
+        WHERE fraud_flag OR is_duplicate OR amount > policy_limit OR z_score >= 2
+        ORDER BY (fraud_flag OR is_duplicate) DESC,
+                 GREATEST(COALESCE(pct_over / 25, 0), COALESCE(z_score / 3, 0)) DESC
+        LIMIT {FINANCE_OUTLIER_SAMPLE}
+    """,
+}
+
+
+def _fetch_df(sql: str, params: list) -> pd.DataFrame:
+    with get_connection() as conn:
+        rows = safe_query(conn, sql, params)
+    return pd.DataFrame(rows) if rows else pd.DataFrame()
+
+
+def run_query(name: str, start_date: Optional[date], end_date: Optional[date]) -> pd.DataFrame:
+    cte, params = _scope_cte(start_date, end_date)
+    return _fetch_df(cte + FINANCE_QUERIES[name], params)
+
+
+def _timed_query(name: str, start_date: Optional[date], end_date: Optional[date]) -> Tuple[pd.DataFrame, float]:
+    t0 = time.perf_counter()
+    df = run_query(name, start_date, end_date)
+    return df, round((time.perf_counter() - t0) * 1000, 1)
+
+
+def collect(start_date: Optional[date], end_date: Optional[date]) -> Dict[str, Any]:
+    """
+    All pre-aggregated frames for the range, plus per-query timings.
+    The queries are independent, so they run concurrently, each on its own
+    connection from the shared pool; wall time ~ the slowest query.
+    """
+    t0 = time.perf_counter()
+    futures = {name: _sql_pool.submit(_timed_query, name, start_date, end_date) for name in FINANCE_QUERIES}
+    frames: Dict[str, pd.DataFrame] = {}
+    timings: Dict[str, float] = {}
+    for name, fut in futures.items():
+        frames[name], timings[name] = fut.result()
+    wall = round((time.perf_counter() - t0) * 1000, 1)
+    return {
+        "frames": frames,
+        "timings_ms": timings,
+        "sql_wall_ms": wall,
+        "sql_serial_ms": round(sum(timings.values()), 1),
+    }
+
+
+# ------------------------------------------------------------------
+# Prompt sections + map/reduce
+# ------------------------------------------------------------------
+def build_sections(frames: Dict[str, pd.DataFrame], key_metrics: Dict[str, Any], insights: List[str]) -> List[Tuple[str, Any]]:
+    """Priority order: what survives clipping first comes first."""
+    summary = frames.get("summary")
+    sections: List[Tuple[str, Any]] = [
+        ("Key Metrics", key_metrics),
+        ("Insights", insights),
+    ]
+    if summary is not None and not summary.empty:
+        sections.append(("Policy / Risk Totals", summary.iloc[0].to_dict()))
+    for title, name in [
+        ("Spend by Category", "by_category"),
+        ("Policy Violations by Category", "violations"),
+        ("Top Vendors", "by_vendor"),
+        ("Top Employees by Spend", "by_employee"),
+        ("Outlier Claims (sample)", "outliers"),
+    ]:
+        df = frames.get(name)
+        if df is not None and not df.empty:
+            sections.append((title, df.to_dict(orient="records")))
+    return sections
+
+
+def render_sections(sections: List[Tuple[str, Any]]) -> str:
+    return "\n\n".join(f"{title}:\n{_compact(payload)}" for title, payload in sections)
+
+
+def _chunks(sections: List[Tuple[str, Any]], budget: int) -> List[str]:
+    """Split sections (row lists split further) into rendered chunks under `budget` tokens."""
+    chunks, current = [], ""
+    pieces: List[str] = []
+    for title, payload in sections:
+        if isinstance(payload, list) and estimate_tokens(_compact(payload)) > budget:
+            part: list = []
+            for row in payload:
+                if part and estimate_tokens(_compact(part + [row])) > budget:
+                    pieces.append(f"{title} (part):\n{_compact(part)}")
+                    part = []
+                part.append(row)
+            if part:
+                pieces.append(f"{title} (part):\n{_compact(part)}")
+        else:
+            pieces.append(f"{title}:\n{_compact(payload)}")
+    for piece in pieces:
+        piece = clip_to_budget(piece, budget)
+        if current and estimate_tokens(current + "\n\n" + piece) > budget:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+_MAP_PROMPT = (
+    "You are summarising one slice of corporate expense data for a CFO report.\n"
+    "Return at most 8 short bullet points with the concrete numbers, names and claim ids "
+    "that matter (top spenders, violations, anomalies). No preamble.\n\n"
+)
+
+
+def _map_chunk(client: OpenAI, chunk: str) -> str:
+    completion = client.chat.completions.create(
+        model=FINANCE_LLM_MODEL,
+        messages=[{"role": "user", "content": _MAP_PROMPT + chunk}],
+        max_tokens=400,
+    )
+    return completion.choices[0].message.content.strip()
+
+
+def build_prompt(sections: List[Tuple[str, Any]], client: OpenAI) -> Tuple[str, Dict[str, Any]]:
+    """Data block for the final call, within FINANCE_PROMPT_TOKEN_BUDGET; map step when needed."""
+    full = render_sections(sections)
+    meta: Dict[str, Any] = {"data_tokens": estimate_tokens(full), "budget": FINANCE_PROMPT_TOKEN_BUDGET, "map_chunks": 0}
+    if meta["data_tokens"] <= FINANCE_PROMPT_TOKEN_BUDGET:
+        return full, meta
+
+    head = render_sections(sections[:2])  # key metrics + deterministic insights stay verbatim
+    chunks = _chunks(sections[2:], FINANCE_CHUNK_TOKEN_BUDGET)
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=FINANCE_MAP_WORKERS) as pool:
+        notes = list(pool.map(lambda ch: _map_chunk(client, ch), chunks))
+    meta["map_chunks"] = len(chunks)
+    meta["map_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    reduced = head + "\n\nFindings from detailed data:\n" + "\n".join(notes)
+    reduced = clip_to_budget(reduced, FINANCE_PROMPT_TOKEN_BUDGET)
+    meta["final_tokens"] = estimate_tokens(reduced)
+    return reduced, meta
+
+
+def _final_messages(system_prompt: str, data_block: str) -> List[Dict[str, str]]:
+    prompt = (
+        "You are a corporate finance analytics assistant.\n"
+        "Based on the following pre-aggregated data, generate a concise summary for a CFO dashboard.\n"
+        "Analyse the data and generate potential actions and Risks. "
+        "Claim-level recommendations must reference claim ids from the outlier sample.\n"
+        "Write executive_summary.Summary first.\n\n"
+        f"{data_block}"
+    )
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def complete(system_prompt: str, data_block: str, client: OpenAI) -> str:
+    completion = client.chat.completions.create(
+        model=FINANCE_LLM_MODEL,
+        messages=_final_messages(system_prompt, data_block),
+        response_format={"type": "json_object"},
+        max_tokens=FINANCE_COMPLETION_MAX_TOKENS,
+    )
+    return completion.choices[0].message.content.strip()
+
+
+def complete_stream(system_prompt: str, data_block: str, client: OpenAI) -> Iterator[str]:
+    """Same call as complete(), yielding content deltas as they arrive."""
+    stream = client.chat.completions.create(
+        model=FINANCE_LLM_MODEL,
+        messages=_final_messages(system_prompt, data_block),
+        response_format={"type": "json_object"},
+        max_tokens=FINANCE_COMPLETION_MAX_TOKENS,
+        stream=True,
+    )
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+_HIGH_SURROGATE = re.compile(r"\\u[dD][89abAB][0-9a-fA-F]{2}")
+_LOW_SURROGATE = re.compile(r"\\u[dD][c-fC-F][0-9a-fA-F]{2}")
+
+
+class JsonStringFieldStream:
+    """
+    Pulls the value of one string field out of a JSON document that arrives in
+    pieces, e.g. "Summary" from {"executive_summary": {"Summary": "..."}}.
+    feed() returns the newly decoded text (escapes resolved), or "".
+    """
+
+    def __init__(self, field: str):
+        self._pattern = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self._buf = ""
+        self._start: Optional[int] = None
+        self._emitted = 0
+        self._done = False
+
+    def feed(self, delta: str) -> str:
+        if self._done:
+            return ""
+        self._buf += delta
+        if self._start is None:
+            m = self._pattern.search(self._buf)
+            if not m:
+                return ""
+            self._start = m.end()
+        raw = self._buf[self._start:]
+        i, safe_end = 0, len(raw)
+        while i < len(raw):
+            ch = raw[i]
+            if ch == "\\":
+                step = 6 if raw[i + 1:i + 2] == "u" else 2
+                if i + step > len(raw):  # escape not complete yet
+                    safe_end = i
+                    break
+                if step == 6 and _HIGH_SURROGATE.match(raw, i):
+                    # its low half is the next escape; decoding it alone yields a lone surrogate
+                    if i + 12 > len(raw):
+                        safe_end = i
+                        break
+                    if _LOW_SURROGATE.match(raw, i + 6):
+                        i += 12
+                        continue
+                i += step
+                continue
+            if ch == '"':
+                safe_end = i
+                self._done = True
+                break
+            i += 1
+        try:
+            text = json.loads('"' + raw[:safe_end] + '"')
+        except ValueError:
+            return ""
+        out = text[self._emitted:]
+        self._emitted = len(text)
+        return out
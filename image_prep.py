@@ -0,0 +1,228 @@
+# image_prep.py
+"""
+Shrinks receipt images before they are base64-encoded for the vision model.
+
+Pipeline: EXIF-rotate -> auto-crop flat borders -> downscale to IMAGE_MAX_EDGE
+-> optional grayscale -> re-encode as JPEG/WEBP, stepping quality down until
+the result fits IMAGE_MAX_BYTES. If anything fails, or the re-encoded image is
+not smaller, the original bytes are sent with their real MIME type.
+
+Run `python image_prep.py [dir]` to see bytes saved over a folder of images
+(default input/images); add `--accuracy` to also compare LLM extractions, or
+`--ocr` for an offline legibility check with a local OCR engine
+(rapidocr_onnxruntime, report only).
+"""
+
+import io
+import os
+import re
+import sys
+import mimetypes
+import threading
+from pathlib import Path
+from typing import Tuple, Dict, Any
+
+try:
+    from PIL import Image, ImageChops, ImageOps
+    PIL_READY = True
+except Exception:  # Pillow missing => raw passthrough
+    PIL_READY = False
+
+# =========================================================
+# CONFIG
+# =========================================================
+IMAGE_PREP_ENABLED = os.getenv("IMAGE_PREP_ENABLED", "true").lower() == "true"
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1600"))
+IMAGE_GRAYSCALE = os.getenv("IMAGE_GRAYSCALE", "true").lower() == "true"
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()  # JPEG | WEBP
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+IMAGE_MIN_QUALITY = int(os.getenv("IMAGE_MIN_QUALITY", "50"))
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(400 * 1024)))
+IMAGE_CROP_TOLERANCE = int(os.getenv("IMAGE_CROP_TOLERANCE", "18"))
+
+_FORMAT_MIME = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+_stats_lock = threading.Lock()
+_stats = {"images": 0, "bytes_in": 0, "bytes_out": 0, "passthrough": 0}
+
+
+def settings_signature() -> str:
+    """Part of the extraction cache key, so changing prep settings doesn't reuse stale results."""
+    if not (IMAGE_PREP_ENABLED and PIL_READY):
+        return "raw"
+    return f"prep:{IMAGE_MAX_EDGE}:{int(IMAGE_GRAYSCALE)}:{IMAGE_FORMAT}:{IMAGE_QUALITY}:{IMAGE_MAX_BYTES}:{IMAGE_CROP_TOLERANCE}"
+
+
+def guess_mime(path: str) -> str:
+    mime, _ = mimetypes.guess_type(path)
+    return mime if mime and mime.startswith("image/") else "application/octet-stream"
+
+
+# =========================================================
+# STAGES
+# =========================================================
+def _autocrop(img: "Image.Image", tolerance: int = IMAGE_CROP_TOLERANCE, pad: int = 8) -> "Image.Image":
+    """Trim uniform borders (scanner bed, table top) using the top-left pixel as background."""
+    rgb = img.convert("RGB")
+    bg = Image.new("RGB", rgb.size, rgb.getpixel((0, 0)))
+    diff = ImageChops.difference(rgb, bg).convert("L")
+    mask = diff.point(lambda v: 255 if v > tolerance else 0)
+    bbox = mask.getbbox()
+    if not bbox:
+        return img
+    left, top, right, bottom = bbox
+    left, top = max(0, left - pad), max(0, top - pad)
+    right, bottom = min(img.width, right + pad), min(img.height, bottom + pad)
+    # ignore crops that would keep almost everything or throw away most of the page
+    area = (right - left) * (bottom - top)
+    if area >= 0.98 * img.width * img.height or area < 0.2 * img.width * img.height:
+        return img
+    return img.crop((left, top, right, bottom))
+
+
+def _downscale(img: "Image.Image", max_edge: int = IMAGE_MAX_EDGE) -> "Image.Image":
+    if max_edge > 0 and max(img.size) > max_edge:
+        img = img.copy()
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    return img
+
+
+def _encode(img: "Image.Image", fmt: str, quality: int, max_bytes: int) -> bytes:
+    if fmt == "JPEG" and img.mode not in ("L", "RGB"):
+        img = img.convert("RGB")
+    q = quality
+    while True:
+        buf = io.BytesIO()
+        img.save(buf, format=fmt, quality=q, optimize=True)
+        data = buf.getvalue()
+        if len(data) <= max_bytes or q <= IMAGE_MIN_QUALITY:
+            return data
+        q = max(IMAGE_MIN_QUALITY, q - 10)
+
+
+def prepare_image(path: str) -> Tuple[bytes, str, Dict[str, Any]]:
+    """Returns (bytes, mime, info) for the model payload."""
+    with open(path, "rb") as f:
+        original = f.read()
+
+    info: Dict[str, Any] = {"original_bytes": len(original), "prepared": False}
+    out_bytes, out_mime = original, guess_mime(path)
+
+    if IMAGE_PREP_ENABLED and PIL_READY:
+        try:
+            fmt = IMAGE_FORMAT if IMAGE_FORMAT in _FORMAT_MIME else "JPEG"
+            with Image.open(io.BytesIO(original)) as im:
+                img = ImageOps.exif_transpose(im)
+                info["original_size"] = list(img.size)
+                img = _autocrop(img)
+                img = _downscale(img)
+                if IMAGE_GRAYSCALE:
+                    img = img.convert("L")
+                data = _encode(img, fmt, IMAGE_QUALITY, IMAGE_MAX_BYTES)
+                info["final_size"] = list(img.size)
+            if len(data) < len(original):
+                out_bytes, out_mime = data, _FORMAT_MIME[fmt]
+                info["prepared"] = True
+        except Exception as ex:
+            print(f"[image_prep] passthrough for {os.path.basename(path)}: {ex}")
+
+    info["final_bytes"] = len(out_bytes)
+    info["mime"] = out_mime
+    with _stats_lock:
+        _stats["images"] += 1
+        _stats["bytes_in"] += len(original)
+        _stats["bytes_out"] += len(out_bytes)
+        if not info["prepared"]:
+            _stats["passthrough"] += 1
+    return out_bytes, out_mime, info
+
+
+def stats() -> Dict[str, Any]:
+    with _stats_lock:
+        out = dict(_stats)
+    out["bytes_saved"] = out["bytes_in"] - out["bytes_out"]
+    out["ratio"] = round(out["bytes_out"] / out["bytes_in"], 4) if out["bytes_in"] else None
+    out["enabled"] = bool(IMAGE_PREP_ENABLED and PIL_READY)
+    out["settings"] = settings_signature()
+    return out
+
+
+# =========================================================
+# CORPUS REPORT
+# =========================================================
+_OCR_NUMBER = re.compile(r"\d[\d,]*(?:\.\d+)?")
+
+
+def _ocr_tokens(engine, data: bytes) -> set:
+    """Numbers (amounts, dates, invoice/GST digits) the OCR reads; word splits don't matter."""
+    result, _ = engine(data)
+    text = " ".join(r[1] for r in (result or []))
+    return {n.replace(",", "") for n in _OCR_NUMBER.findall(text) if len(n.replace(",", "")) >= 3}
+
+
+def _filename_amount(p: Path):
+    """Corpus files named like aditya_sharma_g3_10000.png carry the expected amount."""
+    m = re.search(r"_(\d{3,6})$", p.stem)
+    return m.group(1) if m else None
+
+
+def _corpus_report(root: str, accuracy: bool = False, ocr: bool = False) -> None:
+    exts = {".png", ".jpg", ".jpeg", ".webp", ".tiff", ".bmp"}
+    files = sorted(p for p in Path(root).rglob("*") if p.suffix.lower() in exts)
+    total_in = total_out = 0
+    fields = ("total_amount", "invoice_number", "date", "currency", "category")
+    matches = compared = 0
+    tok_raw = tok_kept = 0
+    amount_files = amount_raw = amount_prep = 0
+
+    if accuracy:
+        # toggle the copy agent.py imported, not this __main__ module
+        import agent as _agent
+        import image_prep as _prep
+    if ocr:
+        from rapidocr_onnxruntime import RapidOCR
+        engine = RapidOCR()
+
+    for p in files:
+        data, mime, info = prepare_image(str(p))
+        total_in += info["original_bytes"]
+        total_out += info["final_bytes"]
+        line = f"{str(p):70s} {info['original_bytes']:>9,d} -> {info['final_bytes']:>9,d} B  {mime}"
+
+        if accuracy:
+            _prep.IMAGE_PREP_ENABLED = False
+            raw = _agent.extract_json_from_image(str(p), None)
+            _prep.IMAGE_PREP_ENABLED = True
+            prepped = _agent.extract_json_from_image(str(p), None)
+            same = [f for f in fields if str(raw.get(f)) == str(prepped.get(f))]
+            matches += len(same)
+            compared += len(fields)
+            line += f"  fields equal {len(same)}/{len(fields)}"
+        if ocr:
+            raw_toks = _ocr_tokens(engine, p.read_bytes())
+            prep_toks = _ocr_tokens(engine, data)
+            tok_raw += len(raw_toks)
+            tok_kept += len(raw_toks & prep_toks)
+            line += f"  ocr numbers kept {len(raw_toks & prep_toks)}/{len(raw_toks)}"
+            expected = _filename_amount(p)
+            if expected:
+                digits = lambda toks: {t.split(".")[0] for t in toks}
+                amount_files += 1
+                amount_raw += expected in digits(raw_toks)
+                amount_prep += expected in digits(prep_toks)
+        print(line)
+
+    if files:
+        print(f"\n{len(files)} images: {total_in:,d} -> {total_out:,d} bytes "
+              f"({100.0 * (1 - total_out / total_in):.1f}% smaller)")
+    if accuracy and compared:
+        print(f"extraction agreement (prep vs raw): {matches}/{compared} = {100.0 * matches / compared:.1f}%")
+    if ocr and tok_raw:
+        print(f"ocr numbers read on raw also read on prepped: {tok_kept}/{tok_raw} = {100.0 * tok_kept / tok_raw:.1f}%")
+    if ocr and amount_files:
+        print(f"filename amount found by ocr: raw {amount_raw}/{amount_files}, prepped {amount_prep}/{amount_files}")
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    _corpus_report(args[0] if args else "input/images", accuracy="--accuracy" in sys.argv, ocr="--ocr" in sys.argv)
@@ -0,0 +1,348 @@
+# jobs.py
+"""
+Durable extraction job queue.
+
+Jobs are rows in the Postgres table `extraction_jobs`, so they survive an API
+restart. A small pool of asyncio workers inside the API process claims queued
+jobs with FOR UPDATE SKIP LOCKED (safe with several uvicorn workers), runs the
+async extractor and writes the result back. Clients poll GET /api/jobs/{id}.
+
+Each API process has a boot id, stamped on the jobs it claims (`owner`), and
+holds a session advisory lock on it over a dedicated connection for as long as
+it runs. A 'running' job whose owner no longer holds that lock belongs to a
+process that died or restarted; it is requeued at startup and by a periodic
+sweep, without waiting for EXTRACT_JOB_STALE_SECONDS.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import threading
+from typing import Optional, Dict, Any, List
+
+from sqlalchemy import text
+
+import db_utils
+import agent as _agent
+
+# ------------------------------------------------------------------
+# CONFIG
+# ------------------------------------------------------------------
+EXTRACT_JOB_WORKERS = int(os.getenv("EXTRACT_JOB_WORKERS", "4"))
+EXTRACT_JOB_MAX_ATTEMPTS = int(os.getenv("EXTRACT_JOB_MAX_ATTEMPTS", "3"))
+EXTRACT_JOB_POLL_SECONDS = float(os.getenv("EXTRACT_JOB_POLL_SECONDS", "1.0"))
+# a 'running' job without a recorded owner (claimed by an older build) is assumed
+# orphaned once it has not been touched for this long
+EXTRACT_JOB_STALE_SECONDS = int(os.getenv("EXTRACT_JOB_STALE_SECONDS", "600"))
+EXTRACT_JOB_SWEEP_SECONDS = float(os.getenv("EXTRACT_JOB_SWEEP_SECONDS", "30"))
+
+_TABLE_READY = False
+
+BOOT_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+_OWNER_LOCK_CLASS = "extraction_jobs"  # first key of the two-key advisory lock
+_owner_conn = None
+_owner_lock = threading.Lock()
+
+
+# ------------------------------------------------------------------
+# SCHEMA
+# ------------------------------------------------------------------
+def ensure_jobs_table() -> None:
+    global _TABLE_READY
+    if _TABLE_READY:
+        return
+    with db_utils.engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS extraction_jobs (
+                job_id       varchar(40) PRIMARY KEY,
+                job_type     varchar(30) NOT NULL DEFAULT 'extract',
+                status       varchar(20) NOT NULL DEFAULT 'queued',
+                progress     varchar(64),
+                params       jsonb NOT NULL,
+                result       jsonb,
+                error        text,
+                attempts     integer NOT NULL DEFAULT 0,
+                created_at   timestamp without time zone NOT NULL DEFAULT now(),
+                started_at   timestamp without time zone,
+                finished_at  timestamp without time zone,
+                updated_at   timestamp without time zone NOT NULL DEFAULT now()
+            )
+        """))
+        conn.execute(text("ALTER TABLE extraction_jobs ADD COLUMN IF NOT EXISTS owner varchar(120)"))
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS ix_extraction_jobs_status_created
+            ON extraction_jobs (status, created_at)
+        """))
+    _TABLE_READY = True
+
+
+# ------------------------------------------------------------------
+# OWNER LIVENESS
+# ------------------------------------------------------------------
+def hold_owner_lock() -> None:
+    """Take (or re-take after a dropped connection) the advisory lock that says BOOT_ID is alive."""
+    global _owner_conn
+    with _owner_lock:
+        if _owner_conn is not None:
+            try:
+                _owner_conn.execute(text("SELECT 1"))
+                return
+            except Exception:
+                try:
+                    _owner_conn.close()
+                except Exception:
+                    pass
+                _owner_conn = None
+        # autocommit: the connection is held for the process lifetime, never idle in a transaction
+        conn = db_utils.engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        conn.execute(
+            text("SELECT pg_advisory_lock(hashtext(:cls), hashtext(:owner))"),
+            {"cls": _OWNER_LOCK_CLASS, "owner": BOOT_ID},
+        )
+        _owner_conn = conn
+
+
+def release_owner_lock() -> None:
+    global _owner_conn
+    with _owner_lock:
+        if _owner_conn is not None:
+            try:
+                _owner_conn.close()  # closing the session releases the lock
+            except Exception:
+                pass
+            _owner_conn = None
+
+
+# ------------------------------------------------------------------
+# QUEUE OPS
+# ------------------------------------------------------------------
+def enqueue_extract_job(
+    file_path: str,
+    emp_id: Optional[str],
+    json_out_dir: str = "./output/langchain_json",
+    save_json_file: bool = True,
+) -> str:
+    ensure_jobs_table()
+    job_id = f"JOB-{uuid.uuid4().hex[:12].upper()}"
+    params = {
+        "file_path": file_path,
+        "employee_id_hint": emp_id,
+        "json_out_dir": json_out_dir,
+        "save_json_file": bool(save_json_file),
+    }
+    with db_utils.engine.begin() as conn:
+        conn.execute(
+            text("""
+                INSERT INTO extraction_jobs (job_id, job_type, status, progress, params)
+                VALUES (:job_id, 'extract', 'queued', 'queued', CAST(:params AS jsonb))
+            """),
+            {"job_id": job_id, "params": json.dumps(params)},
+        )
+    return job_id
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    ensure_jobs_table()
+    with db_utils.engine.connect() as conn:
+        row = conn.execute(
+            text("""
+                SELECT job_id, job_type, status, progress, params, result, error, attempts,
+                       created_at, started_at, finished_at, updated_at
+                FROM extraction_jobs
+                WHERE job_id = :job_id
+            """),
+            {"job_id": job_id},
+        ).mappings().first()
+        if not row:
+            return None
+        job = dict(row)
+        if job["status"] == "queued":
+            job["queue_position"] = conn.execute(
+                text("""
+                    SELECT COUNT(*) FROM extraction_jobs
+                    WHERE status = 'queued' AND created_at <= :created_at
+                """),
+                {"created_at": job["created_at"]},
+            ).scalar()
+    return job
+
+
+def get_queue_stats() -> Dict[str, int]:
+    ensure_jobs_table()
+    with db_utils.engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT status, COUNT(*) AS n FROM extraction_jobs GROUP BY status
+        """)).mappings().all()
+    return {r["status"]: int(r["n"]) for r in rows}
+
+
+def _claim_next_job() -> Optional[Dict[str, Any]]:
+    with db_utils.engine.begin() as conn:
+        row = conn.execute(
+            text("""
+                UPDATE extraction_jobs
+                SET status = 'running', progress = 'extracting',
+                    attempts = attempts + 1, owner = :owner,
+                    started_at = now(), updated_at = now()
+                WHERE job_id = (
+                    SELECT job_id FROM extraction_jobs
+                    WHERE status = 'queued'
+                    ORDER BY created_at
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING job_id, params, attempts
+            """),
+            {"owner": BOOT_ID},
+        ).mappings().first()
+    return dict(row) if row else None
+
+
+def _finish_job(job_id: str, result: Dict[str, Any]) -> None:
+    with db_utils.engine.begin() as conn:
+        conn.execute(
+            text("""
+                UPDATE extraction_jobs
+                SET status = 'done', progress = 'done', error = NULL,
+                    result = CAST(:result AS jsonb),
+                    finished_at = now(), updated_at = now()
+                WHERE job_id = :job_id
+            """),
+            {"job_id": job_id, "result": json.dumps(result, default=str)},
+        )
+
+
+def _fail_job(job_id: str, error: str, attempts: int) -> None:
+    retry = attempts < EXTRACT_JOB_MAX_ATTEMPTS
+    with db_utils.engine.begin() as conn:
+        conn.execute(
+            text("""
+                UPDATE extraction_jobs
+                SET status = :status, progress = :progress, error = :error,
+                    finished_at = CASE WHEN :retry THEN NULL ELSE now() END,
+                    updated_at = now()
+                WHERE job_id = :job_id
+            """),
+            {
+                "job_id": job_id,
+                "status": "queued" if retry else "failed",
+                "progress": f"retrying ({attempts}/{EXTRACT_JOB_MAX_ATTEMPTS})" if retry else "failed",
+                "error": error,
+                "retry": retry,
+            },
+        )
+
+
+def requeue_stale_jobs() -> int:
+    """Put 'running' jobs orphaned by a crashed/restarted process back on the queue."""
+    ensure_jobs_table()
+    with db_utils.engine.begin() as conn:
+        res = conn.execute(
+            text("""
+                UPDATE extraction_jobs j
+                SET status = 'queued', progress = 'requeued: worker gone', owner = NULL, updated_at = now()
+                WHERE j.status = 'running'
+                  AND CASE
+                      WHEN j.owner IS NULL THEN j.updated_at < now() - make_interval(secs => :stale)
+                      ELSE j.owner <> :me AND NOT EXISTS (
+                          SELECT 1 FROM pg_locks l
+                          WHERE l.locktype = 'advisory' AND l.objsubid = 2 AND l.granted
+                            AND l.classid = hashtext(:cls)::oid
+                            AND l.objid = hashtext(j.owner)::oid
+                      )
+                  END
+            """),
+            {"stale": EXTRACT_JOB_STALE_SECONDS, "me": BOOT_ID, "cls": _OWNER_LOCK_CLASS},
+        )
+    return res.rowcount or 0
+
+
+# ------------------------------------------------------------------
+# WORKER POOL
+# ------------------------------------------------------------------
+_wakeup: Optional[asyncio.Event] = None
+
+
+def wake_workers() -> None:
+    """Nudge idle workers after an enqueue; must be called on the event loop thread."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def _run_job(job: Dict[str, Any]) -> None:
+    job_id = job["job_id"]
+    params = job["params"] if isinstance(job["params"], dict) else json.loads(job["params"])
+    try:
+        state = await _agent.aextract_node(dict(params))
+        extraction = state.get("extraction") or {}
+        result = {
+            "process_id": state.get("process_id"),
+            "extraction": {
+                "payload": _agent.payload_to_json_ready(extraction.get("payload", {})),
+                "ocr_engine": extraction.get("ocr_engine"),
+                "raw_text_preview": extraction.get("raw_text_preview"),
+            },
+        }
+        await _agent.run_blocking(_finish_job, job_id, result)
+    except Exception as ex:
+        print(f"[jobs] {job_id} failed (attempt {job['attempts']}): {ex}")
+        await _agent.run_blocking(_fail_job, job_id, f"{type(ex).__name__}: {ex}", int(job["attempts"]))
+
+
+async def _worker_loop(worker_no: int) -> None:
+    last_sweep = time.monotonic()
+    while True:
+        # worker 0 also recovers jobs orphaned by other processes that died mid-run
+        if worker_no == 0 and time.monotonic() - last_sweep > EXTRACT_JOB_SWEEP_SECONDS:
+            last_sweep = time.monotonic()
+            try:
+                await _agent.run_blocking(hold_owner_lock)  # re-take it if our connection dropped
+                await _agent.run_blocking(requeue_stale_jobs)
+            except Exception as ex:
+                print(f"[jobs] stale sweep error: {ex}")
+
+        try:
+            job = await _agent.run_blocking(_claim_next_job)
+        except Exception as ex:
+            print(f"[jobs] worker {worker_no} claim error: {ex}")
+            job = None
+
+        if job:
+            await _run_job(job)
+            continue
+
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=EXTRACT_JOB_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+class JobWorkerPool:
+    def __init__(self, workers: int = EXTRACT_JOB_WORKERS):
+        self.workers = max(1, int(workers))
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        global _wakeup
+        _wakeup = asyncio.Event()
+        await _agent.run_blocking(ensure_jobs_table)
+        await _agent.run_blocking(hold_owner_lock)  # before the first claim
+        requeued = await _agent.run_blocking(requeue_stale_jobs)
+        if requeued:
+            print(f"[jobs] requeued {requeued} orphaned job(s)")
+        self._tasks = [asyncio.create_task(_worker_loop(i)) for i in range(self.workers)]
+        print(f"[jobs] started {self.workers} extraction worker(s)")
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await _agent.run_blocking(release_owner_lock)
+
+
+worker_pool = JobWorkerPool()
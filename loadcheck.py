@@ -0,0 +1,183 @@
+# loadcheck.py
+"""
+Latency check for the /claims/* analytics routes while receipt extractions
+are in flight.
+
+Runs app.py in-process under uvicorn (one worker, as deployed) with the
+vision LLM replaced by a stub that takes LOADCHECK_LLM_SECONDS, then fires
+/claims/* requests with httpx and reports p50/p95/p99 for:
+
+  idle      analytics requests only
+  inflight  the same, while N /api/Agent?phase=extract calls run concurrently
+  legacy    as inflight, but the extraction runs the pre-async way
+            (sync extract_node on the event loop), for comparison
+
+Everything except the LLM is real: image preparation, the blocking pool and
+the database reads. Needs the API's database settings and input/images.
+
+    python loadcheck.py [extractions] [analytics_requests]
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+from pathlib import Path
+from typing import List, Dict, Any
+
+os.environ.setdefault("EXTRACTION_CACHE_ENABLED", "false")  # every extraction does the work
+os.environ.setdefault("OPENAI_API_KEY", "sk-loadcheck")
+
+import httpx
+import uvicorn
+from langchain_core.messages import AIMessage
+
+import app as _app
+import agent as _agent
+
+LOADCHECK_LLM_SECONDS = float(os.getenv("LOADCHECK_LLM_SECONDS", "2.0"))
+LOADCHECK_PORT = int(os.getenv("LOADCHECK_PORT", "8765"))
+LOADCHECK_CONCURRENCY = int(os.getenv("LOADCHECK_CONCURRENCY", "8"))
+IMAGES_DIR = Path(os.getenv("LOADCHECK_IMAGES", "./input/images"))
+
+ANALYTICS = [
+    ("/claims/summary", {"start_date": "2024-01-01", "end_date": "2026-12-31"}),
+    ("/claims/monthly_trend", {"start_date": "2024-01-01", "end_date": "2026-12-31"}),
+    ("/claims/top_vendors", {"start_date": "2024-01-01", "end_date": "2026-12-31"}),
+    ("/claims/list", {"start_date": "2024-01-01", "end_date": "2026-12-31", "limit": 50}),
+]
+
+_STUB_REPLY = json.dumps({
+    "invoice_number": "LC-0001", "date": "2025-01-15", "currency": "INR", "total_amount": 1250.0,
+    "category": "Food", "seller": {"name": "Loadcheck Cafe", "location": "Pune"}, "items": [],
+})
+
+
+class _StubLLM:
+    """Stands in for agent.llm_json: same latency profile, no network."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    def invoke(self, messages):
+        time.sleep(self.seconds)
+        return AIMessage(content=_STUB_REPLY)
+
+    async def ainvoke(self, messages):
+        await asyncio.sleep(self.seconds)
+        return AIMessage(content=_STUB_REPLY)
+
+
+async def _legacy_extract_node(state: Dict[str, Any]) -> Dict[str, Any]:
+    # what agent_router did before: the sync node, on the event loop
+    return _agent.extract_node(state)
+
+
+# ------------------------------------------------------------------
+# Drivers
+# ------------------------------------------------------------------
+def _pct(sorted_ms: List[float], p: float) -> float:
+    return sorted_ms[min(len(sorted_ms) - 1, int(len(sorted_ms) * p))]
+
+
+async def _analytics(client: httpx.AsyncClient, total: int) -> List[float]:
+    latencies: List[float] = []
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            path, params = ANALYTICS[i % len(ANALYTICS)]
+            t0 = time.perf_counter()
+            r = await client.get(path, params=params)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            r.raise_for_status()
+
+    await asyncio.gather(*[worker() for _ in range(LOADCHECK_CONCURRENCY)])
+    return latencies
+
+
+async def _extractions(client: httpx.AsyncClient, n: int, images: List[Path], stop: asyncio.Event) -> int:
+    done = 0
+
+    async def worker(k: int):
+        nonlocal done
+        i = k
+        while not stop.is_set():
+            img = images[i % len(images)]
+            r = await client.post("/api/Agent", params={
+                "image_name": str(img), "phase": "extract", "save_json_file": "false",
+            })
+            r.raise_for_status()
+            done += 1
+            i += n
+
+    await asyncio.gather(*[worker(k) for k in range(n)])
+    return done
+
+
+async def _scenario(name: str, extractions: int, analytics_requests: int, images: List[Path]) -> Dict[str, Any]:
+    base = f"http://127.0.0.1:{LOADCHECK_PORT}"
+    async with httpx.AsyncClient(base_url=base, timeout=120) as client:
+        stop = asyncio.Event()
+        ext_task = None
+        if extractions:
+            ext_task = asyncio.create_task(_extractions(client, extractions, images, stop))
+            await asyncio.sleep(LOADCHECK_LLM_SECONDS / 2)  # let them get in flight
+        t0 = time.perf_counter()
+        lat = sorted(await _analytics(client, analytics_requests))
+        wall = time.perf_counter() - t0
+        stop.set()
+        extracted = await ext_task if ext_task else 0
+    return {
+        "scenario": name,
+        "requests": len(lat),
+        "p50_ms": round(_pct(lat, 0.50), 1),
+        "p95_ms": round(_pct(lat, 0.95), 1),
+        "p99_ms": round(_pct(lat, 0.99), 1),
+        "max_ms": round(lat[-1], 1),
+        "rps": round(len(lat) / wall, 1),
+        "extractions_done": extracted,
+    }
+
+
+def _serve() -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(_app.app, host="127.0.0.1", port=LOADCHECK_PORT, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def main(extractions: int = 8, analytics_requests: int = 2000) -> None:
+    images = sorted(p for p in IMAGES_DIR.iterdir() if p.suffix.lower() in _agent.SUPPORTED_IMAGES)
+    if not images:
+        sys.exit(f"no images under {IMAGES_DIR}")
+    _agent.llm_json = _StubLLM(LOADCHECK_LLM_SECONDS)
+    server = _serve()
+    try:
+        asyncio.run(_scenario("warmup", 0, 40, images))
+        rows = [asyncio.run(_scenario("idle", 0, analytics_requests, images)),
+                asyncio.run(_scenario("inflight", extractions, analytics_requests, images))]
+        async_extract_node = _agent.aextract_node
+        _agent.aextract_node = _legacy_extract_node
+        try:
+            # each request here waits behind whole extractions; a short run makes the point
+            rows.append(asyncio.run(_scenario("legacy", extractions, min(analytics_requests, 40), images)))
+        finally:
+            _agent.aextract_node = async_extract_node
+    finally:
+        server.should_exit = True
+
+    print(f"LLM stub {LOADCHECK_LLM_SECONDS}s, {extractions} extractions in flight, "
+          f"{LOADCHECK_CONCURRENCY} concurrent analytics clients")
+    cols = ["scenario", "requests", "p50_ms", "p95_ms", "p99_ms", "max_ms", "rps", "extractions_done"]
+    print("  ".join(f"{c:>16}" for c in cols))
+    for r in rows:
+        print("  ".join(f"{r[c]:>16}" for c in cols))
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*(args + [8, 2000][len(args):]))
@@ -0,0 +1,207 @@
+# message_templates.py
+"""
+Memoised phrasing for validation messages.
+
+The LLM-written explanation only depends on (rule_band, tag, category, grade,
+currency); the numbers and the employee name are the sole per-claim parts.
+So instead of a per-claim rephrasing call, the LLM is asked once per key for
+a *template* with placeholders:
+
+    {employee} {grade} {category} {currency} {spent} {allowed} {percent}
+
+which is cached (LRU + TTL) and filled in locally. A key that has not been
+seen costs one LLM call; every later claim with the same key renders in
+microseconds. Concurrent misses on the same key share that one call.
+"""
+
+import os
+import json
+import time
+import threading
+from string import Formatter
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+from langchain_core.messages import HumanMessage
+
+MESSAGE_TEMPLATES_ENABLED = os.getenv("MESSAGE_TEMPLATES_ENABLED", "true").lower() == "true"
+MESSAGE_TEMPLATE_TTL_SECONDS = float(os.getenv("MESSAGE_TEMPLATE_TTL_SECONDS", "86400"))
+MESSAGE_TEMPLATE_MAX = int(os.getenv("MESSAGE_TEMPLATE_MAX", "512"))
+
+PLACEHOLDERS = {"employee", "grade", "category", "currency", "spent", "allowed", "percent"}
+
+Key = Tuple[str, str, str, str, str]
+
+
+# ------------------------------------------------------------------
+# LRU + TTL
+# ------------------------------------------------------------------
+class TemplateCache:
+    def __init__(self, max_items: int = MESSAGE_TEMPLATE_MAX, ttl_seconds: float = MESSAGE_TEMPLATE_TTL_SECONDS):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[Key, Tuple[float, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def get(self, key: Key) -> Optional[str]:
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, template = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._items[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return template
+
+    def put(self, key: Key, template: str) -> None:
+        with self._lock:
+            self._items[key] = (time.monotonic(), template)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = len(self._items)
+        total = self.hits + self.misses
+        return {
+            "size": size,
+            "max_items": self.max_items,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+        }
+
+
+# ------------------------------------------------------------------
+# Template helpers
+# ------------------------------------------------------------------
+def key_for(base: Dict[str, Any]) -> Key:
+    m = base.get("metrics") or {}
+    # the band alone does not fix the outcome: a claim a hair over the limit is
+    # still "within_limit" after rounding but Pending, not Auto Approved
+    return (
+        str(base.get("rule_band") or "no_policy"),
+        str(base.get("tag") or ""),
+        str(m.get("category") or "").lower(),
+        str(m.get("grade") or ""),
+        str(m.get("currency") or "INR").upper(),
+    )
+
+
+def is_valid_template(template: Any) -> bool:
+    """Only the known placeholders, no format specs / attribute access, and mentions the spend."""
+    if not isinstance(template, str) or not template.strip():
+        return False
+    try:
+        fields = [(name, spec, conv) for _, name, spec, conv in Formatter().parse(template) if name is not None]
+    except ValueError:
+        return False
+    names = {f[0] for f in fields}
+    if not names <= PLACEHOLDERS or any(spec or conv for _, spec, conv in fields):
+        return False
+    return "spent" in names
+
+
+def _values(base: Dict[str, Any], employee_row: Optional[Dict[str, Any]]) -> Dict[str, str]:
+    m = base.get("metrics") or {}
+    emp = employee_row or {}
+    name = " ".join(p for p in [emp.get("first_name"), emp.get("last_name")] if p) or "Employee"
+    allowed = m.get("allowed_amount")
+    pdiff = m.get("percent_diff")
+    return {
+        "employee": name,
+        "grade": str(m.get("grade") or "—"),
+        "category": str(m.get("category") or "expense"),
+        "currency": str(m.get("currency") or "INR"),
+        "spent": f"{float(m.get('spent_amount') or 0.0):,.2f}",
+        "allowed": f"{float(allowed):,.2f}" if allowed is not None else "N/A",
+        "percent": f"{float(pdiff):.2f}" if pdiff is not None else "N/A",
+    }
+
+
+def _template_request(key: Key, base: Dict[str, Any]) -> list:
+    band, tag, category, grade, currency = key
+    prompt = (
+        "You write reusable message templates for expense validation decisions.\n"
+        "Produce ONLY a JSON object like:\n"
+        "{ \"template\": \"<one or two sentences explaining the reason and next step>\" }\n"
+        "Use these placeholders verbatim where the values belong (no others, no format specs): "
+        "{employee} {grade} {category} {currency} {spent} {allowed} {percent}.\n"
+        "The template MUST include {spent}. Do not write any concrete amounts or names.\n\n"
+        f"RULE_BAND: {band}\nOUTCOME: {tag}\nCATEGORY: {category}\nGRADE: {grade}\nCURRENCY: {currency}\n"
+        f"DECISION_ALREADY_MADE: {json.dumps({'tag': base.get('tag'), 'decision': base.get('decision')})}\n"
+        f"RULE_MESSAGE_EXAMPLE: {base.get('message')}\n"
+    )
+    return [HumanMessage(content=[{"type": "text", "text": prompt}])]
+
+
+# ------------------------------------------------------------------
+# Renderer
+# ------------------------------------------------------------------
+class MessageRenderer:
+    def __init__(self, cache: Optional[TemplateCache] = None):
+        self.cache = cache or TemplateCache()
+        self._key_locks: Dict[Key, threading.Lock] = {}
+        self._guard = threading.Lock()
+        self.llm_calls = 0
+        self.rejected_templates = 0
+
+    def render(self, base: Dict[str, Any], employee_row: Optional[Dict[str, Any]]) -> Optional[str]:
+        """Cached phrasing filled with this claim's numbers, or None on a miss."""
+        template = self.cache.get(key_for(base))
+        if template is None:
+            return None
+        return template.format(**_values(base, employee_row))
+
+    def _lock_for(self, key: Key) -> threading.Lock:
+        with self._guard:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def fetch(self, llm, base: Dict[str, Any], employee_row: Optional[Dict[str, Any]], parse) -> Optional[str]:
+        """
+        Blocking: make sure a template exists for this key (one LLM call per key,
+        shared by concurrent callers) and return the rendered message.
+        `parse` turns the raw completion text into a dict (agent._parse_llm_json).
+        """
+        key = key_for(base)
+        with self._lock_for(key):
+            template = self.cache.get(key)
+            if template is None:
+                self.llm_calls += 1
+                resp = llm.invoke(_template_request(key, base))
+                raw = resp.content if isinstance(resp.content, str) else json.dumps(resp.content)
+                parsed = parse(raw)
+                candidate = parsed.get("template") if isinstance(parsed, dict) else None
+                if not is_valid_template(candidate):
+                    self.rejected_templates += 1
+                    return None
+                template = candidate.strip()
+                self.cache.put(key, template)
+        return template.format(**_values(base, employee_row))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": MESSAGE_TEMPLATES_ENABLED,
+            **self.cache.stats(),
+            "llm_calls": self.llm_calls,
+            "rejected_templates": self.rejected_templates,
+        }
+
+
+message_renderer = MessageRenderer()
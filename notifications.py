@@ -0,0 +1,98 @@
+# notifications.py
+"""
+Decision notifications, sent off the request path.
+
+Callers (the approval pages, POST /api/claims/decisions:batch) hand over the
+rows returned by db_utils.bulk_update_claim_decisions; notify_decisions only
+INSERTs them into email_outbox (one statement) and the outbox sender mails them.
+
+Digest mode (default): each decision becomes an email_outbox row keyed by
+recipient with not_before = now + NOTIFY_DIGEST_WINDOW_SECONDS. The outbox
+sender sends ONE email listing every claim of a recipient once their oldest
+pending item is due (or OUTBOX_DIGEST_MAX_ITEMS pile up). A window that
+collects a single decision still gets the normal per-claim email. Pending
+items live in the database, so a crash or restart does not drop them.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+
+import utils as mail_utils
+import outbox as _outbox
+
+NOTIFY_DIGEST_ENABLED = os.getenv("NOTIFY_DIGEST_ENABLED", "true").lower() == "true"
+NOTIFY_DIGEST_WINDOW_SECONDS = float(os.getenv("NOTIFY_DIGEST_WINDOW_SECONDS", "60"))
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="decision-notify")
+
+
+def _draft_single(r: Dict[str, Any]):
+    return mail_utils.draft_employee_update_on_action(
+        claim_id=r["claim_id"],
+        employee_name=r.get("employee_name"),
+        employee_id=r.get("employee_id") or "—",
+        actor_role=r.get("actor_role") or "Reviewer",
+        decision=r.get("status") or "",
+        comment=r.get("comment"),
+    )
+
+
+def _send_single(r: Dict[str, Any], to_addr: str) -> bool:
+    sub, body = _draft_single(r)
+    return mail_utils.send_email(to_addr, sub, body)
+
+
+def _send_decision_emails(rows: List[Dict[str, Any]], recipient: Optional[str]) -> Dict[str, int]:
+    sent = failed = 0
+    for r in rows:
+        to_addr = recipient or r.get("employee_email")
+        if not to_addr:
+            continue
+        if _send_single(r, to_addr):
+            sent += 1
+        else:
+            failed += 1
+    return {"sent": sent, "failed": failed}
+
+
+# ------------------------------------------------------------------
+# Digest items (buffered in email_outbox)
+# ------------------------------------------------------------------
+_DIGEST_FIELDS = ("claim_id", "employee_id", "employee_name", "actor_role", "status", "comment", "amount", "currency")
+
+
+def _digest_item(r: Dict[str, Any], to_addr: str) -> Dict[str, Any]:
+    sub, body = _draft_single(r)
+    payload = {k: r.get(k) for k in _DIGEST_FIELDS}
+    if payload["amount"] is not None:
+        payload["amount"] = float(payload["amount"])
+    return {"recipient": to_addr, "digest_key": to_addr.lower(), "subject": sub, "body": body, "payload": payload}
+
+
+def notify_decisions(rows: List[Dict[str, Any]], actor_role: str, recipient: Optional[str] = None) -> int:
+    """
+    Queue notifications for decided claims; returns how many were queued.
+    `recipient` overrides the employee's own address (the pages use their
+    RECIPIENT_OVERRIDE). The rows are INSERTed into email_outbox before this
+    returns, in one statement; a failure is raised to the caller, whose
+    decisions are already committed and who decides how to report it.
+    """
+    rows = [{**r, "actor_role": r.get("actor_role") or actor_role} for r in rows]
+    items = [_digest_item(r, recipient or r["employee_email"]) for r in rows if recipient or r.get("employee_email")]
+    if NOTIFY_DIGEST_ENABLED:
+        return _outbox.enqueue_digest_items(items, NOTIFY_DIGEST_WINDOW_SECONDS)
+    if mail_utils.EMAIL_OUTBOX_ENABLED:
+        return _outbox.enqueue_emails(items)
+    # no outbox: SMTP straight from a worker thread, nothing durable to wait for
+    _executor.submit(_send_decision_emails, rows, recipient)
+    return len(items)
+
+
+def stats() -> Dict[str, Any]:
+    out: Dict[str, Any] = {"enabled": NOTIFY_DIGEST_ENABLED, "window_seconds": NOTIFY_DIGEST_WINDOW_SECONDS}
+    try:
+        out["pending"] = _outbox.get_pending_digests()
+    except Exception as ex:
+        out["pending_error"] = str(ex)
+    return out
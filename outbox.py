@@ -0,0 +1,454 @@
+# outbox.py
+"""
+Durable SMTP outbox.
+
+utils.send_email() only INSERTs into `email_outbox` and returns. A background
+sender thread (started lazily in whichever process enqueues: the API or a
+Streamlit page) claims batches with FOR UPDATE SKIP LOCKED, sends them over one
+persistent authenticated SMTP connection (reconnecting when the server drops
+it), and retries failures with exponential backoff.
+
+Digest rows (enqueue_digest_items) carry a `digest_key` and a `not_before`
+time. They wait in the table until the oldest item of their key reaches
+not_before (or OUTBOX_DIGEST_MAX_ITEMS pile up); the sender then claims every
+queued row of that key together and sends them as one digest email. Nothing
+is held in process memory, so a crash or restart loses no pending items.
+
+Local testing without Gmail, e.g. with aiosmtpd:
+    python -m aiosmtpd -n -l localhost:8025
+    SMTP_SERVER=localhost SMTP_PORT=8025 SMTP_STARTTLS=false SMTP_AUTH=false
+"""
+
+import os
+import json
+import time
+import smtplib
+import threading
+from collections import deque
+from email.utils import formataddr
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from typing import Optional, Dict, Any, List
+
+from sqlalchemy import text
+
+import db_utils
+import utils as mail_utils
+
+# ------------------------------------------------------------------
+# CONFIG
+# ------------------------------------------------------------------
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() == "true"
+SMTP_AUTH = os.getenv("SMTP_AUTH", "true").lower() == "true"
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "20"))
+SMTP_IDLE_SECONDS = float(os.getenv("SMTP_IDLE_SECONDS", "60"))  # close idle connection
+OUTBOX_BATCH = int(os.getenv("OUTBOX_BATCH", "50"))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "2"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", "30"))
+OUTBOX_RETRY_MAX_SECONDS = float(os.getenv("OUTBOX_RETRY_MAX_SECONDS", "3600"))
+OUTBOX_STALE_SECONDS = int(os.getenv("OUTBOX_STALE_SECONDS", "300"))
+OUTBOX_DIGEST_GROUPS = int(os.getenv("OUTBOX_DIGEST_GROUPS", "20"))  # digest keys claimed per batch
+OUTBOX_DIGEST_MAX_ITEMS = int(os.getenv("OUTBOX_DIGEST_MAX_ITEMS", os.getenv("NOTIFY_DIGEST_MAX_ITEMS", "500")))  # send early at this many
+
+_TABLE_READY = False
+
+
+# ------------------------------------------------------------------
+# SCHEMA
+# ------------------------------------------------------------------
+def ensure_outbox_table() -> None:
+    global _TABLE_READY
+    if _TABLE_READY:
+        return
+    with db_utils.engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS email_outbox (
+                id               bigserial PRIMARY KEY,
+                recipient        varchar(320) NOT NULL,
+                subject          text NOT NULL,
+                body             text NOT NULL,
+                from_name        varchar(200),
+                status           varchar(20) NOT NULL DEFAULT 'queued',
+                attempts         integer NOT NULL DEFAULT 0,
+                last_error       text,
+                created_at       timestamp without time zone NOT NULL DEFAULT now(),
+                next_attempt_at  timestamp without time zone NOT NULL DEFAULT now(),
+                locked_at        timestamp without time zone,
+                sent_at          timestamp without time zone
+            )
+        """))
+        # digest columns, added in place on existing tables
+        conn.execute(text("""
+            ALTER TABLE email_outbox
+                ADD COLUMN IF NOT EXISTS digest_key  varchar(320),
+                ADD COLUMN IF NOT EXISTS not_before  timestamp without time zone,
+                ADD COLUMN IF NOT EXISTS payload     jsonb
+        """))
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS ix_email_outbox_due
+            ON email_outbox (next_attempt_at) WHERE status = 'queued'
+        """))
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS ix_email_outbox_digest
+            ON email_outbox (digest_key, not_before) WHERE status = 'queued' AND digest_key IS NOT NULL
+        """))
+    _TABLE_READY = True
+
+
+# ------------------------------------------------------------------
+# QUEUE OPS
+# ------------------------------------------------------------------
+def enqueue_email(recipient: str, subject: str, body: str, from_name: Optional[str] = None) -> int:
+    ensure_outbox_table()
+    with db_utils.engine.begin() as conn:
+        msg_id = conn.execute(
+            text("""
+                INSERT INTO email_outbox (recipient, subject, body, from_name)
+                VALUES (:recipient, :subject, :body, :from_name)
+                RETURNING id
+            """),
+            {"recipient": recipient, "subject": subject, "body": body, "from_name": from_name},
+        ).scalar()
+    sender.wake()
+    return int(msg_id)
+
+
+def enqueue_emails(items: List[Dict[str, Any]]) -> int:
+    """Queue several plain emails (recipient, subject, body[, from_name]) in one INSERT."""
+    if not items:
+        return 0
+    ensure_outbox_table()
+    with db_utils.engine.begin() as conn:
+        conn.execute(
+            text("""
+                INSERT INTO email_outbox (recipient, subject, body, from_name)
+                VALUES (:recipient, :subject, :body, :from_name)
+            """),
+            [{"recipient": i["recipient"], "subject": i["subject"], "body": i["body"],
+              "from_name": i.get("from_name")} for i in items],
+        )
+    sender.wake()
+    return len(items)
+
+
+def enqueue_digest_items(items: List[Dict[str, Any]], window_seconds: float) -> int:
+    """
+    Queue digest items in one transaction. Each item has recipient, digest_key,
+    subject/body (the standalone email, used when the window collects only that
+    item) and payload (what the digest drafter lists).
+    """
+    if not items:
+        return 0
+    ensure_outbox_table()
+    with db_utils.engine.begin() as conn:
+        conn.execute(
+            text("""
+                INSERT INTO email_outbox (recipient, subject, body, from_name, digest_key, not_before, payload)
+                VALUES (:recipient, :subject, :body, :from_name, :digest_key,
+                        now() + make_interval(secs => :window), CAST(:payload AS jsonb))
+            """),
+            [
+                {
+                    "recipient": i["recipient"], "subject": i["subject"], "body": i["body"],
+                    "from_name": i.get("from_name"), "digest_key": i["digest_key"],
+                    "window": window_seconds, "payload": json.dumps(i.get("payload") or {}, default=str),
+                }
+                for i in items
+            ],
+        )
+    sender.start()  # no wake: nothing is due before the window ends
+    return len(items)
+
+
+def _claim_batch(limit: int) -> List[Dict[str, Any]]:
+    with db_utils.engine.begin() as conn:
+        # rows stuck in 'sending' belong to a process that died mid-batch
+        conn.execute(
+            text("""
+                UPDATE email_outbox SET status = 'queued', locked_at = NULL
+                WHERE status = 'sending' AND locked_at < now() - make_interval(secs => :stale)
+            """),
+            {"stale": OUTBOX_STALE_SECONDS},
+        )
+        rows = conn.execute(
+            text("""
+                UPDATE email_outbox
+                SET status = 'sending', attempts = attempts + 1, locked_at = now()
+                WHERE id IN (
+                    SELECT id FROM email_outbox
+                    WHERE status = 'queued' AND next_attempt_at <= now() AND digest_key IS NULL
+                    ORDER BY id
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT :lim
+                )
+                RETURNING id, recipient, subject, body, from_name, attempts, digest_key, payload
+            """),
+            {"lim": limit},
+        ).mappings().all()
+        # whole digest groups whose oldest item is due; the xact lock on the key
+        # keeps two senders from each taking part of the same group
+        groups = conn.execute(
+            text("""
+                UPDATE email_outbox
+                SET status = 'sending', attempts = attempts + 1, locked_at = now()
+                WHERE id IN (
+                    SELECT id FROM email_outbox
+                    WHERE status = 'queued' AND next_attempt_at <= now()
+                      AND digest_key IN (
+                          SELECT digest_key FROM email_outbox
+                          WHERE status = 'queued' AND digest_key IS NOT NULL AND next_attempt_at <= now()
+                          GROUP BY digest_key
+                          HAVING MIN(not_before) <= now() OR COUNT(*) >= :max_items
+                          ORDER BY MIN(id)
+                          LIMIT :groups
+                      )
+                      AND pg_try_advisory_xact_lock(hashtext('email_digest:' || digest_key))
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, recipient, subject, body, from_name, attempts, digest_key, payload
+            """),
+            {"groups": OUTBOX_DIGEST_GROUPS, "max_items": OUTBOX_DIGEST_MAX_ITEMS},
+        ).mappings().all()
+    return [dict(r) for r in rows] + sorted((dict(r) for r in groups), key=lambda r: r["id"])
+
+
+def _group_batch(batch: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """One list per email to send: plain rows alone, digest rows by key."""
+    out: List[List[Dict[str, Any]]] = []
+    by_key: Dict[str, List[Dict[str, Any]]] = {}
+    for msg in batch:
+        if msg.get("digest_key") is None:
+            out.append([msg])
+        elif msg["digest_key"] in by_key:
+            by_key[msg["digest_key"]].append(msg)
+        else:
+            by_key[msg["digest_key"]] = [msg]
+            out.append(by_key[msg["digest_key"]])
+    return out
+
+
+def _mark_sent(ids: List[int]) -> None:
+    if not ids:
+        return
+    with db_utils.engine.begin() as conn:
+        conn.execute(
+            text("""
+                UPDATE email_outbox
+                SET status = 'sent', sent_at = now(), locked_at = NULL, last_error = NULL
+                WHERE id = ANY(:ids)
+            """),
+            {"ids": ids},
+        )
+
+
+def _mark_failed(msg: Dict[str, Any], error: str, permanent: bool = False) -> None:
+    give_up = permanent or msg["attempts"] >= OUTBOX_MAX_ATTEMPTS
+    delay = min(OUTBOX_RETRY_MAX_SECONDS, OUTBOX_RETRY_BASE_SECONDS * (2 ** (msg["attempts"] - 1)))
+    with db_utils.engine.begin() as conn:
+        conn.execute(
+            text("""
+                UPDATE email_outbox
+                SET status = :status, last_error = :err, locked_at = NULL,
+                    next_attempt_at = now() + make_interval(secs => :delay)
+                WHERE id = :id
+            """),
+            {"id": msg["id"], "status": "failed" if give_up else "queued", "err": error[:2000], "delay": delay},
+        )
+
+
+def get_pending_digests() -> Dict[str, int]:
+    ensure_outbox_table()
+    with db_utils.engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT digest_key, COUNT(*) AS n FROM email_outbox
+            WHERE status = 'queued' AND digest_key IS NOT NULL
+            GROUP BY digest_key
+        """)).mappings().all()
+    return {r["digest_key"]: int(r["n"]) for r in rows}
+
+
+def get_queue_depth() -> Dict[str, int]:
+    ensure_outbox_table()
+    with db_utils.engine.connect() as conn:
+        rows = conn.execute(text("SELECT status, COUNT(*) AS n FROM email_outbox GROUP BY status")).mappings().all()
+    return {r["status"]: int(r["n"]) for r in rows}
+
+
+# ------------------------------------------------------------------
+# SMTP SESSION (persistent, reconnecting)
+# ------------------------------------------------------------------
+class SmtpSession:
+    def __init__(self):
+        self._server: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+        self.connects = 0
+
+    def _open(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(mail_utils.SMTP_SERVER, mail_utils.SMTP_PORT, timeout=SMTP_TIMEOUT)
+        if SMTP_STARTTLS:
+            server.starttls()
+        if SMTP_AUTH:
+            server.login(mail_utils.EMAIL_USER, mail_utils.EMAIL_PASS)
+        self.connects += 1
+        return server
+
+    def get(self) -> smtplib.SMTP:
+        if self._server is not None:
+            stale = time.monotonic() - self._last_used > SMTP_IDLE_SECONDS
+            alive = False
+            if not stale:
+                try:
+                    alive = self._server.noop()[0] == 250
+                except Exception:
+                    alive = False
+            if not alive:
+                self.close()
+        if self._server is None:
+            self._server = self._open()
+        self._last_used = time.monotonic()
+        return self._server
+
+    def close(self) -> None:
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+            self._server = None
+
+    def idle_close(self) -> None:
+        if self._server is not None and time.monotonic() - self._last_used > SMTP_IDLE_SECONDS:
+            self.close()
+
+
+def _build_message(msg: Dict[str, Any]) -> MIMEMultipart:
+    m = MIMEMultipart()
+    m["From"] = formataddr((msg.get("from_name") or mail_utils.FROM_NAME, mail_utils.EMAIL_USER))
+    m["To"] = msg["recipient"]
+    m["Subject"] = msg["subject"]
+    m.attach(MIMEText(msg["body"], "plain"))
+    return m
+
+
+def _digest_message(group: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """A digest group as one message; a group of one keeps its own email."""
+    if len(group) == 1:
+        return group[0]
+    items = [g.get("payload") or {} for g in group]
+    one_employee = len({i.get("employee_id") for i in items}) == 1
+    sub, body = mail_utils.draft_decision_digest(
+        recipient_name=items[0].get("employee_name") if one_employee else None,
+        items=items,
+    )
+    return {**group[0], "subject": sub, "body": body}
+
+
+# ------------------------------------------------------------------
+# BACKGROUND SENDER
+# ------------------------------------------------------------------
+class OutboxSender:
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.session = SmtpSession()
+        self.sent_total = 0
+        self.failed_total = 0
+        self.digests_sent = 0
+        self.items_coalesced = 0
+        self._sent_times: deque = deque(maxlen=10000)
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="email-outbox", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+        self.session.close()
+
+    def wake(self) -> None:
+        self.start()
+        self._wake.set()
+
+    def _send_batch(self, batch: List[Dict[str, Any]]) -> None:
+        sent_ids: List[int] = []
+        sent = 0
+        groups = _group_batch(batch)
+        for group in groups:
+            try:
+                msg = _digest_message(group)
+                try:
+                    self.session.get().send_message(_build_message(msg))
+                except (smtplib.SMTPServerDisconnected, ConnectionError):
+                    # server dropped the connection mid-batch: reconnect once and retry this message
+                    self.session.close()
+                    self.session.get().send_message(_build_message(msg))
+                sent_ids.extend(g["id"] for g in group)
+                sent += 1
+                self._sent_times.append(time.time())
+                if len(group) > 1:
+                    self.digests_sent += 1
+                    self.items_coalesced += len(group)
+            except smtplib.SMTPRecipientsRefused as ex:
+                self.failed_total += 1
+                for g in group:
+                    _mark_failed(g, f"recipient refused: {ex}", permanent=True)
+            except Exception as ex:
+                self.failed_total += 1
+                self.session.close()
+                for g in group:
+                    _mark_failed(g, f"{type(ex).__name__}: {ex}")
+        _mark_sent(sent_ids)
+        self.sent_total += sent
+        if sent:
+            print(f"[outbox] sent {sent}/{len(groups)} message(s) for {len(sent_ids)} row(s)")
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                ensure_outbox_table()
+                batch = _claim_batch(OUTBOX_BATCH)
+            except Exception as ex:
+                print(f"[outbox] claim error: {ex}")
+                batch = []
+            if batch:
+                self._send_batch(batch)
+                continue
+            self.session.idle_close()
+            self._wake.wait(timeout=OUTBOX_POLL_SECONDS)
+            self._wake.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        last_min = sum(1 for t in self._sent_times if now - t <= 60)
+        return {
+            "running": bool(self._thread and self._thread.is_alive()),
+            "sent_total": self.sent_total,
+            "failed_attempts_total": self.failed_total,
+            "sent_last_minute": last_min,
+            "send_rate_per_sec": round(last_min / 60.0, 3),
+            "smtp_connects": self.session.connects,
+            "digests_sent": self.digests_sent,
+            "items_coalesced": self.items_coalesced,
+        }
+
+
+sender = OutboxSender()
+
+
+def stats() -> Dict[str, Any]:
+    out = sender.stats()
+    try:
+        out["queue"] = get_queue_depth()
+    except Exception as ex:
+        out["queue_error"] = str(ex)
+    return out
@@ -9,6 +9,7 @@ from sqlalchemy import text
 import db_utils  # core DB utilities (provides engine, loaders, etc.)
 import agent as _agent  # for load_employee_by_email(...)
 import utils as mail_utils  # SMTP + email templates from utils.py
+import notifications
 import db_utils
 import importlib
 import dashboard  as _dashboard
@@ -134,100 +135,35 @@ with Dashboard:
 
 
 # -------------------------------------------------
-# Finance DB Update Helpers (fallback + wrappers)
+# Finance DB Update Helpers
 # -------------------------------------------------
-def _finance_update_claim_fallback(claim_id: str, decision: str, comment: str, approver_id: str):
-    """
-    Fallback direct-SQL updater if db_utils.finance_update_claim_decision(...) is not available.
-    Safest path: update only status.
-    If your schema has finance_comment & finance_approver_id, switch to the commented SQL below.
-    """
-    sql_basic = text("""
-        UPDATE expense_claims
-        SET status = :status
-        WHERE claim_id = :claim_id
-    """)
-    # If schema supports finance comment & approver:
-    # sql_with_comment = text("""
-    #     UPDATE expense_claims
-    #     SET status = :status,
-    #         finance_comment = :comment,
-    #         finance_approver_id = :fid
-    #     WHERE claim_id = :claim_id
-    # """)
-
-    with db_utils.engine.begin() as conn:
-        conn.execute(sql_basic, {
-            "status": "Approved" if decision == "Approve" else "Rejected",
-            "claim_id": claim_id,
-            # "comment": comment,
-            # "fid": approver_id,
-        })
-
-
-def _fetch_claim_row(claim_id: str) -> dict | None:
-    """
-    Minimal fetch to obtain some context for the email body.
-    Adjust column names if your schema differs.
-    """
-    try:
-        with db_utils.engine.connect() as conn:
-            q = text("""
-                SELECT ec.claim_id, ec.employee_id, ec.expense_category AS category,
-                       ec.amount, ec.currency, ec.vendor_name, ec.claim_date
-                FROM expense_claims ec
-                WHERE ec.claim_id = :cid
-                LIMIT 1
-            """)
-            df = pd.read_sql_query(q, conn, params={"cid": claim_id})
-        if not df.empty:
-            return df.to_dict(orient="records")[0]
-    except Exception:
-        pass
-    return None
-
-
 def _apply_finance_decisions(rows_to_apply: list[dict], approver_id: str):
     """
     Apply Approve/Reject for finance in bulk:
-    1) Update DB using db_utils.finance_update_claim_decision or fallback SQL.
-    2) Send email to the HARD-CODED recipient about the decision (not to the employee).
+    1) One UPDATE ... FROM (VALUES ...) via db_utils.bulk_update_claim_decisions.
+    2) Emails to the HARD-CODED recipient (not to the employee) are queued in the background.
     """
-    updater = getattr(db_utils, "finance_update_claim_decision", None)
-    successes, failures = [], []
-
-    for r in rows_to_apply:
-        claim_id = str(r.get("claim_id", "")).strip()
-        decision = str(r.get("Decision", "")).strip()     # "Approve"|"Reject"
-        comment  = str(r.get("Finance Comment", "")).strip()
-        if not claim_id or decision not in {"Approve", "Reject"}:
-            continue
+    decisions = [
+        {
+            "claim_id": str(r.get("claim_id", "")).strip(),
+            "decision": str(r.get("Decision", "")).strip(),     # "Approve"|"Reject"
+            "comment": str(r.get("Finance Comment", "")).strip(),
+        }
+        for r in rows_to_apply
+    ]
+    try:
+        res = db_utils.bulk_update_claim_decisions(decisions, actor_role="Finance", approver_id=approver_id)
+    except Exception as ex:
+        return [], [(d["claim_id"], str(ex)) for d in decisions if d["claim_id"]]
 
+    if res["rows"]:
         try:
-            if callable(updater):
-                # def finance_update_claim_decision(claim_id, decision, comment, approver_id) -> None
-                updater(claim_id, decision, comment, approver_id)
-            else:
-                _finance_update_claim_fallback(claim_id, decision, comment, approver_id)
-            successes.append(claim_id)
-
-            # --- Email notify (HARD-CODED recipient) ---
-            # We still fetch claim for context in the email body, but recipient is fixed.
-            claim = _fetch_claim_row(claim_id)
-            emp_id = claim.get("employee_id") if claim else None
-            sub, body = mail_utils.draft_employee_update_on_action(
-                claim_id=claim_id,
-                employee_name=None,               # optional
-                employee_id=emp_id or "—",
-                actor_role="Finance",
-                decision="Approved" if decision == "Approve" else "Rejected",
-                comment=comment,
-            )
-            mail_utils.send_email(RECIPIENT_OVERRIDE, sub, body)
-
+            notifications.notify_decisions(res["rows"], actor_role="Finance", recipient=RECIPIENT_OVERRIDE)
         except Exception as ex:
-            failures.append((claim_id, str(ex)))
+            st.warning(f"Decisions saved, but the email notifications could not be queued: {ex}")
 
+    successes = [r["claim_id"] for r in res["rows"]]
+    failures = [(cid, "claim not found") for cid in res["missing"]]
     return successes, failures
 
 
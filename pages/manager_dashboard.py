@@ -2,11 +2,13 @@
 import os
 import re
 import json
+import time
 from pathlib import Path
 from datetime import date, datetime
 import requests
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
+from database import get_engine
 import streamlit as st
 import agent as _agent  # must expose load_employee_by_email(...)
 
@@ -17,6 +19,7 @@ import db_utils
 
 # Email utils (uses SMTP creds from utils.py)
 import utils as mail_utils
+import notifications
 
 # -------------------------------------------------
 # PAGE CONFIG (must be first Streamlit call)
@@ -28,6 +31,8 @@ st.set_page_config(page_title="Manager Dashboard", layout="wide")
 # -------------------------------------------------
 BASE_API = "http://localhost:8000"
 AGENT_ENDPOINT = f"{BASE_API}/api/Agent"
+JOBS_ENDPOINT = f"{BASE_API}/api/jobs"
+EXTRACT_POLL_MAX_SECONDS = 60
 
 OUTPUT_DIR = "output/langchain_json"
 Path(OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
@@ -111,6 +116,18 @@ def to_iso(d: date | str | None) -> str | None:
         return d  # assume already ISO
     return d.isoformat()
 
+def poll_extract_job(job_id: str, max_wait: float) -> dict:
+    """Poll GET /api/jobs/{id} until done/failed or max_wait elapses; returns the last job snapshot."""
+    deadline = time.monotonic() + max_wait
+    with st.spinner("Extracting invoice..."):
+        while True:
+            r = requests.get(f"{JOBS_ENDPOINT}/{job_id}", timeout=10)
+            r.raise_for_status()
+            job = r.json() or {}
+            if job.get("status") in {"done", "failed"} or time.monotonic() >= deadline:
+                return job
+            time.sleep(1.0)
+
 def deep_get(d, path, default=None):
     """Safely get a nested key by dotted path."""
     cur = d or {}
@@ -416,6 +433,7 @@ def extractor_node_ui(emp_id: str, output_dir: str, input_dir: Path):
 
     if reset_clicked:
         st.session_state.ui_step = "idle"
+        st.session_state.extract_job_id = None
         st.session_state.extraction_resp = None
         st.session_state.extracted_payload = None
         st.session_state.uploaded_image_path = None
@@ -437,29 +455,50 @@ def extractor_node_ui(emp_id: str, output_dir: str, input_dir: Path):
             f.write(uploaded_file.getbuffer())
 
         try:
-            params = {"image_name": str(file_path), "emp_id": emp_id}
-            body = {"phase": "extract", "json_out_dir": output_dir, "save_json_file": True}
+            body = {"image_name": str(file_path), "emp_id": emp_id, "json_out_dir": output_dir, "save_json_file": True}
 
-            r = requests.post(AGENT_ENDPOINT, params=params, json=body, timeout=120)
-            if r.status_code != 200:
+            # enqueue only; the API returns a job id right away and extracts in the background
+            r = requests.post(f"{JOBS_ENDPOINT}/extract", json=body, timeout=15)
+            if r.status_code not in (200, 202):
                 st.error(f"API error {r.status_code}: {r.text}")
                 return
 
-            resp = r.json() or {}
-            payload = deep_get(resp, "extraction.payload", {}) or {}
-
+            st.session_state.extract_job_id = (r.json() or {}).get("job_id")
             st.session_state.uploaded_image_path = str(file_path)
-            st.session_state.extraction_resp = resp
-            st.session_state.extracted_payload = payload
-            st.session_state.ui_step = "form"
-
-            st.success("Extraction complete ✅")
-            st.write("**Saved at:**", str(file_path))
+            st.session_state.ui_step = "extracting"
 
         except requests.exceptions.RequestException as e:
             st.error(f"Connection error: {e}")
             return
 
+    if st.session_state.ui_step == "extracting":
+        job_id = st.session_state.get("extract_job_id")
+        try:
+            job = poll_extract_job(job_id, EXTRACT_POLL_MAX_SECONDS)
+        except requests.exceptions.RequestException as e:
+            st.error(f"Connection error while checking job {job_id}: {e}")
+            st.button("Check status", key="check_job_btn")
+            return
+
+        if job.get("status") == "done":
+            resp = job.get("result") or {}
+            st.session_state.extraction_resp = resp
+            st.session_state.extracted_payload = deep_get(resp, "extraction.payload", {}) or {}
+            st.session_state.ui_step = "form"
+            st.success("Extraction complete ✅")
+            st.write("**Saved at:**", st.session_state.uploaded_image_path)
+        elif job.get("status") == "failed":
+            st.session_state.ui_step = "idle"
+            st.error(f"Extraction failed: {job.get('error')}")
+            return
+        else:
+            st.info(
+                f"Still processing (job **{job_id}**, status: {job.get('progress') or job.get('status')}). "
+                "Your upload is saved and queued — check back in a moment."
+            )
+            st.button("Check status", key="check_job_btn")
+            return
+
     if st.session_state.ui_step != "form":
         st.info("Upload a file and click **Click to Review** to continue.")
         return
@@ -518,7 +557,8 @@ def extractor_node_ui(emp_id: str, output_dir: str, input_dir: Path):
             summary = log_validation_result(
                 claim_id=claim_id,
                 employee_id=payload_out.get("employee_id") or emp_id,
-                validation_obj=tag_status,
+                # full validation dict (carries message_ref for the background LLM message)
+                validation_obj={**(validation_json.get("validation") or {}), "status": tag_status},
             )
         except Exception as log_ex:
             summary = {"claim_id": claim_id, "status_val": "LogError", "auto_approved": False, "log_error": str(log_ex)}
@@ -561,9 +601,9 @@ def extractor_node_ui(emp_id: str, output_dir: str, input_dir: Path):
             )
             sent = mail_utils.send_email(RECIPIENT_OVERRIDE, subject, body)
             if sent:
-                st.success(f"📧 Acknowledgement sent to {RECIPIENT_OVERRIDE}")
+                st.success(f"📧 Acknowledgement queued for {RECIPIENT_OVERRIDE}")
             else:
-                st.warning(f"Could not send email to {RECIPIENT_OVERRIDE}. Check SMTP credentials/connectivity.")
+                st.warning(f"Could not queue email for {RECIPIENT_OVERRIDE}. Check DB/SMTP connectivity.")
         except Exception as e:
             st.warning(f"Email step failed: {e}")
 
@@ -571,102 +611,37 @@ def extractor_node_ui(emp_id: str, output_dir: str, input_dir: Path):
 # Manager Approval helpers (DB + email)
 # -------------------------------------------------
 def _get_engine():
-    # Reuse a single engine per run
-    if "_manager_engine" not in st.session_state:
-        db_url = os.environ.get("DATABASE_URL") or st.secrets.get("DATABASE_URL", "")
-        if not db_url:
-            raise RuntimeError("DATABASE_URL not configured in env or st.secrets")
-        st.session_state._manager_engine = create_engine(db_url, future=True)
-    return st.session_state._manager_engine
-
-def _update_claim_decision_fallback(claim_id: str, decision: str, comment: str, approver_id: str):
-    """
-    Fallback direct-SQL updater if db_utils.manager_update_claim_decision is not available.
-    Safest path: update only status. (Uncomment richer version if your schema has columns)
-    """
-    engine = _get_engine()
-    sql_basic = text("""
-        UPDATE expense_claims
-        SET status = :status
-        WHERE claim_id = :claim_id
-    """)
-    # If you have manager_comment / manager_id columns, switch to:
-    # sql_with_comment = text("""
-    #     UPDATE expense_claims
-    #     SET status = :status,
-    #         manager_comment = :comment,
-    #         manager_id = :mgr_id
-    #     WHERE claim_id = :claim_id
-    # """)
-    with engine.begin() as conn:
-        conn.execute(sql_basic, {
-            "status": "Approved" if decision == "Approve" else "Rejected",
-            "claim_id": claim_id,
-            # "comment": comment,
-            # "mgr_id": approver_id,
-        })
-
-def _fetch_claim_row(claim_id: str) -> dict | None:
-    """Fetch a minimal claim row for context (optional)."""
-    try:
-        engine = _get_engine()
-        q = text("""
-            SELECT ec.claim_id, ec.employee_id, ec.expense_category AS category,
-                   ec.amount, ec.currency, ec.vendor_name, ec.claim_date
-            FROM expense_claims ec
-            WHERE ec.claim_id = :cid
-            LIMIT 1
-        """)
-        with engine.connect() as conn:
-            df = pd.read_sql_query(q, conn, params={"cid": claim_id})
-        if not df.empty:
-            return df.to_dict(orient="records")[0]
-    except Exception:
-        pass
-    return None
+    # Process-wide pool from database.py (was one engine per Streamlit session)
+    return get_engine()
 
 def _apply_manager_decisions(rows_to_apply: list[dict], approver_id: str):
     """
     rows_to_apply: list of dicts containing claim_id, Decision, Manager Comment
-    1) Update DB via db_utils.manager_update_claim_decision if present, else fallback SQL
-    2) Send email to HARD-CODED recipient informing decision
+    1) One bulk UPDATE via db_utils.bulk_update_claim_decisions
+    2) Emails to the HARD-CODED recipient are queued in the background
     """
-    # Prefer db_utils.manager_update_claim_decision if present
-    import db_utils as _dbu
-    updater = getattr(_dbu, "manager_update_claim_decision", None)
-
-    successes, failures = [], []
-    for r in rows_to_apply:
-        claim_id = str(r.get("claim_id", "")).strip()
-        decision = str(r.get("Decision", "")).strip()       # "Approve" | "Reject"
-        comment  = str(r.get("Manager Comment", "")).strip()
-        if not claim_id or decision not in {"Approve", "Reject"}:
-            continue
-        try:
-            if callable(updater):
-                updater(claim_id, decision, comment, approver_id)
-            else:
-                _update_claim_decision_fallback(claim_id, decision, comment, approver_id)
-            successes.append(claim_id)
-
-            # --- Email notify to HARD-CODED recipient ---
-            claim = _fetch_claim_row(claim_id)
-            employee_name = None
-            emp_id_for_email = None
-            if claim:
-                emp_id_for_email = claim.get("employee_id")
-            sub, body = mail_utils.draft_employee_update_on_action(
-                claim_id=claim_id,
-                employee_name=employee_name,  # unknown here; optional
-                employee_id=emp_id_for_email or "—",
-                actor_role="Manager",
-                decision="Approved" if decision == "Approve" else "Rejected",
-                comment=comment,
-            )
-            mail_utils.send_email(RECIPIENT_OVERRIDE, sub, body)
+    decisions = [
+        {
+            "claim_id": str(r.get("claim_id", "")).strip(),
+            "decision": str(r.get("Decision", "")).strip(),       # "Approve" | "Reject"
+            "comment": str(r.get("Manager Comment", "")).strip(),
+        }
+        for r in rows_to_apply
+    ]
+    try:
+        res = db_utils.bulk_update_claim_decisions(decisions, actor_role="Manager", approver_id=approver_id)
+    except Exception as ex:
+        return [], [(d["claim_id"], str(ex)) for d in decisions if d["claim_id"]]
 
+    # --- Email notify to HARD-CODED recipient (queued in the outbox, sent off the request path) ---
+    if res["rows"]:
+        try:
+            notifications.notify_decisions(res["rows"], actor_role="Manager", recipient=RECIPIENT_OVERRIDE)
         except Exception as ex:
-            failures.append((claim_id, str(ex)))
+            st.warning(f"Decisions saved, but the email notifications could not be queued: {ex}")
+
+    successes = [r["claim_id"] for r in res["rows"]]
+    failures = [(cid, "claim not found") for cid in res["missing"]]
     return successes, failures
 
 
@@ -816,6 +791,7 @@ st.subheader(f"Welcome, {emp_name_display}! 👋")
 # Init per-page state for extractor UI
 for key, default in {
     "ui_step": "idle",
+    "extract_job_id": None,
     "extraction_resp": None,
     "extracted_payload": None,
     "uploaded_image_path": None,
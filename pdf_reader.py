@@ -0,0 +1,196 @@
+# pdf_reader.py
+"""
+Page-bounded PDF text reader for the extraction prompt.
+
+Pages are pulled one at a time from fitz instead of concatenating the whole
+document. Headers/footers (same line at the same place on most pages read) are
+kept once, T&C and policy blocks are skipped, and reading stops as soon as
+an invoice number and a grand total / amount due have both been seen, or when
+PDF_MAX_PAGES / PDF_MAX_CHARS is hit.
+"""
+
+import os
+import re
+import threading
+from typing import Iterator, Tuple, Dict, Any, Set, List
+
+import fitz  # PyMuPDF
+
+# =========================================================
+# CONFIG
+# =========================================================
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "6"))
+PDF_MAX_CHARS = int(os.getenv("PDF_MAX_CHARS", "12000"))
+PDF_EARLY_STOP = os.getenv("PDF_EARLY_STOP", "true").lower() == "true"
+CHARS_PER_TOKEN = 4  # rough, good enough for reporting
+
+_BOILERPLATE_START = re.compile(
+    r"^\s*(terms\s*(?:&|and)\s*conditions|cancellation\s*policy|house\s*rules|"
+    r"important\s*information|privacy\s*policy|disclaimer)\b",
+    re.I,
+)
+_BOILERPLATE_LINE = re.compile(
+    r"(computer[\s-]*generated|does\s*not\s*require\s*(?:a\s*)?signature|"
+    r"^\s*page\s*\d+\s*(?:of\s*\d+)?\s*$|thank\s*you\s*for\s*(?:your\s*)?(?:booking|choosing|visiting))",
+    re.I,
+)
+_INVOICE_NO = re.compile(r"(invoice|bill|receipt|folio)\s*(no\.?|number|#)|\bNo\d{5,}\b|\bHT-\d+", re.I)
+# only final-amount labels may end the read early: a bare "Total" is also
+# "Total nights: 3" or a page's "Sub Total", with the real total pages later
+_TOTAL = re.compile(
+    r"(?<![A-Za-z])(?<!sub\s)(?<!sub-)"
+    r"(grand\s*total|total\s*(?:amount\s*)?(?:payable|due)|amount\s*(?:due|payable)|balance\s*due|net\s*payable)"
+    r"\b[^\n]*\d",
+    re.I,
+)
+
+_stats_lock = threading.Lock()
+_stats = {"documents": 0, "pages_read": 0, "pages_skipped": 0, "chars_kept": 0, "tokens_saved_est": 0}
+
+
+def settings_signature() -> str:
+    """Part of the extraction cache key for PDFs; different caps mean a different prompt."""
+    return f"pdf3:{PDF_MAX_PAGES}:{PDF_MAX_CHARS}:{int(PDF_EARLY_STOP)}"
+
+
+def iter_pdf_pages(pdf_path: str, max_pages: int = PDF_MAX_PAGES) -> Iterator[Tuple[int, int, str]]:
+    """Yields (page_no, page_count, text) lazily; the document stays open only while iterating."""
+    with fitz.open(pdf_path) as doc:
+        n = doc.page_count
+        for i in range(min(n, max_pages) if max_pages > 0 else n):
+            yield i, n, doc.load_page(i).get_text("text")
+
+
+_EDGE_LINES = 3  # header/footer candidates: this many lines from the top / bottom of a page
+_HAS_AMOUNT = re.compile(r"\d[\d,]*\.\d{2}\b|\b\d{1,3}(?:,\d{2,3})+\b")
+_BLOCK_END = re.compile(r"invoice|bill|folio|receipt|total|amount|charge|tax|gst", re.I)
+
+
+def _edge_keys(i: int, n: int, key: str) -> Set[Tuple[str, int, str]]:
+    keys = set()
+    if i < _EDGE_LINES:
+        keys.add(("top", i, key))
+    if n - 1 - i < _EDGE_LINES:
+        keys.add(("bottom", n - 1 - i, key))
+    return keys
+
+
+def _page_lines(text: str, have_total: bool) -> Tuple[List[str], bool]:
+    """
+    Non-empty lines minus boilerplate. A T&C / policy heading skips its block,
+    which ends at the next line that carries an amount together with an
+    invoice label; once the totals have been seen the rest of the page goes.
+    Returns (lines, have_total).
+    """
+    kept: List[str] = []
+    in_block = False
+    for line in text.splitlines():
+        s = line.strip()
+        if not s:
+            continue
+        if _BOILERPLATE_START.match(s):
+            if have_total:
+                break
+            in_block = True
+            continue
+        if in_block:
+            if not (_HAS_AMOUNT.search(s) and _BLOCK_END.search(s)):
+                continue
+            in_block = False
+        if _BOILERPLATE_LINE.search(s):
+            continue
+        kept.append(s)
+        have_total = have_total or bool(_TOTAL.search(s))
+    return kept, have_total
+
+
+def _drop_repeated_edges(pages: List[List[str]]) -> List[str]:
+    """
+    A top/bottom line is a header/footer when the same text sits at the same
+    offset from the same edge on most of the pages read; it is kept on the
+    first of them. Lines with an amount are never dropped, so per-page rows
+    such as "Room Charge 4,500.00" survive however often they repeat.
+    """
+    counts: Dict[Tuple[str, int, str], int] = {}
+    page_keys = []
+    for lines in pages:
+        keys = [_edge_keys(i, len(lines), s.lower()) for i, s in enumerate(lines)]
+        page_keys.append(keys)
+        for k in set().union(*keys) if keys else ():
+            counts[k] = counts.get(k, 0) + 1
+    repeated = {k for k, c in counts.items() if c >= 2 and c * 2 > len(pages)}
+
+    out, emitted = [], set()
+    for lines, keys in zip(pages, page_keys):
+        kept = []
+        for s, edges in zip(lines, keys):
+            hits = edges & repeated
+            if hits and len(s) < 120 and not _HAS_AMOUNT.search(s):
+                if hits & emitted:
+                    continue
+                emitted |= hits
+            kept.append(s)
+        out.append("\n".join(kept))
+    return out
+
+
+def read_pdf_bounded(
+    pdf_path: str,
+    max_pages: int = PDF_MAX_PAGES,
+    max_chars: int = PDF_MAX_CHARS,
+    early_stop: bool = PDF_EARLY_STOP,
+) -> Tuple[str, Dict[str, Any]]:
+    """Returns (prompt_text, report)."""
+    pages: List[List[str]] = []
+    raw_chars, line_chars = 0, 0
+    pages_read, page_count, stop_reason = 0, 0, "end_of_document"
+    have_invoice = have_total = False
+
+    for page_no, page_count, text in iter_pdf_pages(pdf_path, max_pages):
+        pages_read += 1
+        raw_chars += len(text)
+        lines, have_total = _page_lines(text, have_total)
+        pages.append(lines)
+        line_chars += sum(len(s) + 1 for s in lines)
+
+        have_invoice = have_invoice or any(_INVOICE_NO.search(s) for s in lines)
+        if line_chars > max_chars:
+            stop_reason = "char_cap"
+            break
+        if early_stop and have_invoice and have_total:
+            stop_reason = "found_totals"
+            break
+    else:
+        if page_count > pages_read:
+            stop_reason = "page_cap"
+
+    # headers/footers are judged over every page read, then the cap applies
+    prompt = "\n".join(p for p in _drop_repeated_edges(pages) if p).strip()[:max_chars]
+    kept_chars = len(prompt)
+
+    # pages we never opened are estimated from the ones we did
+    skipped = max(0, page_count - pages_read)
+    est_full_chars = raw_chars + (raw_chars / pages_read * skipped if pages_read else 0)
+    report = {
+        "pages_total": page_count,
+        "pages_read": pages_read,
+        "stop_reason": stop_reason,
+        "raw_chars": raw_chars,
+        "kept_chars": kept_chars,
+        "tokens_full_est": int(est_full_chars // CHARS_PER_TOKEN),
+        "tokens_kept_est": kept_chars // CHARS_PER_TOKEN,
+    }
+    report["tokens_saved_est"] = report["tokens_full_est"] - report["tokens_kept_est"]
+
+    with _stats_lock:
+        _stats["documents"] += 1
+        _stats["pages_read"] += pages_read
+        _stats["pages_skipped"] += skipped
+        _stats["chars_kept"] += kept_chars
+        _stats["tokens_saved_est"] += report["tokens_saved_est"]
+    return prompt, report
+
+
+def stats() -> Dict[str, Any]:
+    with _stats_lock:
+        return dict(_stats)
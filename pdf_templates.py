@@ -0,0 +1,376 @@
+# pdf_templates.py
+"""
+Deterministic template tier for machine-generated PDF invoices.
+
+Each vendor layout (Agoda, Booking.com, our hotel folios, restaurant bills) is a
+small set of label regexes. `parse_pdf_text` detects the layout, pulls the
+fields and scores itself; agent.extract_json_from_pdf only calls the LLM when
+no template matches or the score is below PDF_TEMPLATE_MIN_CONFIDENCE.
+
+Value shapes (e.g. Agoda invoice numbers look like `No` + 7 digits) are learned
+from the LLM outputs already stored in output/langchain_json, so a template
+that grabs the wrong token is scored down instead of silently trusted.
+"""
+
+import os
+import re
+import json
+import datetime as dt
+from pathlib import Path
+from typing import Optional, Dict, Any, List
+
+# =========================================================
+# CONFIG
+# =========================================================
+PDF_TEMPLATES_ENABLED = os.getenv("PDF_TEMPLATES_ENABLED", "true").lower() == "true"
+PDF_TEMPLATE_MIN_CONFIDENCE = float(os.getenv("PDF_TEMPLATE_MIN_CONFIDENCE", "0.85"))
+PDF_TEMPLATE_PROFILE_DIR = os.getenv("PDF_TEMPLATE_PROFILE_DIR", "./output/langchain_json")
+
+_AMOUNT = r"([0-9][0-9,]*(?:\.[0-9]{1,2})?)"
+_DATE = (
+    r"(\d{4}-\d{2}-\d{2}"
+    r"|\d{1,2}[/.-]\d{1,2}[/.-]\d{4}"
+    r"|\d{1,2}\s+[A-Za-z]{3,9},?\s+\d{4}"
+    r"|[A-Za-z]{3,9}\s+\d{1,2},\s*\d{4})"
+)
+_CURRENCY = r"\b(INR|USD|EUR|GBP|AED|SGD)\b|(₹|Rs\.?)"
+_CUR_PREFIX = r"(?:INR|Rs\.?|₹)?"
+
+# "total" labels. Grand-total style labels win over a bare "Total"; a bare
+# "Total" never matches inside "Subtotal" / "Sub Total" / "Sub-Total" or as
+# the label of a count or a tax line ("Total nights", "Total Tax").
+_GRAND_TOTAL = (
+    r"(?:grand\s*total|final\s*amount|net\s*(?:amount|payable)|total\s*(?:amount\s*)?(?:payable|due)"
+    r"|amount\s*(?:payable|due)|total\s*amount\s*paid|amount\s*paid)"
+)
+_PLAIN_TOTAL = (
+    r"(?<![A-Za-z])(?<!sub\s)(?<!sub-)total"
+    r"(?!\s*(?:tax|gst|discount|nights?|items?|qty|quantity|rooms?|guests?)\b)"
+    r"(?:\s*(?:amount|charge|price))?"
+)
+
+
+# headings printed above/below the vendor name on GST bills; never a seller
+_GENERIC_HEADING = (
+    r"(?:(?:tax\s*|gst\s*|retail\s*|proforma\s*)?invoice|bill(?:\s*of\s*supply)?|cash\s*(?:bill|memo)"
+    r"|(?:payment\s*)?receipt|estimate|(?:original|duplicate|triplicate)(?:\s*(?:for\s*recipient|copy))?"
+    r"|(?:customer|merchant)\s*copy|copy|thank\s*you)"
+)
+_SELLER_LINE = rf"(?!{_GENERIC_HEADING}\s*$)([A-Z][A-Za-z&' ]{{2,40}}?)"
+_GENERIC_SELLER = re.compile(rf"^\s*{_GENERIC_HEADING}\s*$|\b(?:invoice|gstin|receipt)\b", re.I)
+
+
+def _total_patterns() -> List[str]:
+    return [
+        rf"{_GRAND_TOTAL}\s*[:\-]?\s*{_CUR_PREFIX}\s*{_AMOUNT}",
+        rf"{_PLAIN_TOTAL}\s*[:\-]?\s*{_CUR_PREFIX}\s*{_AMOUNT}",
+    ]
+
+
+
+class PdfTemplate:
+    def __init__(
+        self,
+        name: str,
+        vendor: str,
+        category: str,
+        detect: List[str],
+        fields: Dict[str, List[str]],
+        required: List[str],
+        last_match: tuple = ("total_amount",),
+    ):
+        self.name = name
+        self.vendor = vendor
+        self.category = category
+        self.detect = [re.compile(p, re.I) for p in detect]
+        self.fields = {k: [re.compile(p, re.I | re.M) for p in pats] for k, pats in fields.items()}
+        self.required = required
+        self.last_match = set(last_match)  # totals: the final figure on the bill wins
+
+    def matches(self, text: str) -> bool:
+        return all(p.search(text) for p in self.detect)
+
+    def extract(self, text: str) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        for field, patterns in self.fields.items():
+            for pat in patterns:
+                if field in self.last_match:
+                    found = list(pat.finditer(text))
+                    m = found[-1] if found else None
+                else:
+                    m = pat.search(text)
+                if m:
+                    out[field] = next(g for g in m.groups() if g is not None).strip()
+                    break
+        return out
+
+
+# ---------------------------------------------------------
+# Layouts
+# ---------------------------------------------------------
+_HOTEL_STAY = {
+    "check_in": [rf"check[\s-]*in(?:\s*date)?\s*[:\-]?\s*{_DATE}"],
+    "check_out": [rf"check[\s-]*out(?:\s*date)?\s*[:\-]?\s*{_DATE}"],
+}
+
+TEMPLATES: List[PdfTemplate] = [
+    PdfTemplate(
+        name="agoda",
+        vendor="agoda",
+        category="Hotel",
+        detect=[r"\bagoda\b"],
+        fields={
+            "invoice_number": [r"invoice\s*(?:no\.?|number)\s*[:#]?\s*(No\d{5,})", r"\b(No\d{6,})\b"],
+            "date": [rf"invoice\s*date\s*[:\-]?\s*{_DATE}", rf"\bdate\s*[:\-]?\s*{_DATE}"],
+            "booking_number": [r"booking\s*(?:id|no\.?|number)\s*[:#]?\s*(\d{6,})"],
+            "hotel_name": [r"(?:hotel|property)\s*(?:name)?\s*[:\-]\s*(.+)$"],
+            "location": [r"(?:hotel\s*)?address\s*[:\-]\s*(.+)$"],
+            "total_amount": _total_patterns(),
+            **_HOTEL_STAY,
+        },
+        required=["invoice_number", "date", "total_amount", "booking_number"],
+    ),
+    PdfTemplate(
+        name="booking.com",
+        vendor="Booking.com",
+        category="Hotel",
+        detect=[r"booking\.com"],
+        fields={
+            "invoice_number": [r"invoice\s*(?:no\.?|number)\s*[:#]?\s*(No\d{5,})", r"invoice\s*(?:no\.?|number)\s*[:#]?\s*([A-Z0-9\-/]{5,})"],
+            "date": [rf"invoice\s*date\s*[:\-]?\s*{_DATE}", rf"\bdate\s*[:\-]?\s*{_DATE}"],
+            "booking_number": [r"(?:booking|confirmation)\s*(?:id|no\.?|number)\s*[:#]?\s*(\d{6,})"],
+            "hotel_name": [r"property\s*(?:name)?\s*[:\-]\s*(.+)$"],
+            "location": [r"property\s*address\s*[:\-]\s*(.+)$", r"\baddress\s*[:\-]\s*(.+)$"],
+            "total_amount": _total_patterns(),
+            **_HOTEL_STAY,
+        },
+        required=["invoice_number", "date", "total_amount", "booking_number"],
+    ),
+    PdfTemplate(
+        name="hotel_folio",
+        vendor="",
+        category="Hotel",
+        detect=[r"\bHT-\d{3,}-\d{2,}\b", r"check[\s-]*in"],
+        fields={
+            "invoice_number": [r"\b(HT-\d{3,}-\d{2,})\b"],
+            "date": [rf"(?:invoice\s*)?date\s*[:\-]?\s*{_DATE}"],
+            "hotel_name": [r"^\s*([A-Z][A-Za-z&' ]+(?:Hotel|Resort|Inn|Suites|Residency|Lodge|Palace))\s*$"],
+            "location": [r"\baddress\s*[:\-]\s*(.+)$", r"^\s*([A-Z][a-z]+,\s*India)\s*$"],
+            "total_amount": _total_patterns(),
+            **_HOTEL_STAY,
+        },
+        required=["invoice_number", "date", "total_amount"],
+    ),
+    PdfTemplate(
+        name="restaurant_bill",
+        vendor="",
+        category="Food",
+        detect=[r"\bGSTIN\b", r"(?:SGST|state\s*gst|CGST|central\s*gst)"],
+        fields={
+            "invoice_number": [r"(?:bill|invoice|receipt)\s*(?:no\.?|number)\s*[:#]?\s*([0-9A-Z][0-9A-Z/\-]{2,})"],
+            "date": [rf"\bdate\s*[:\-]?\s*{_DATE}", rf"^{_DATE}"],
+            # the name line right above the address / GSTIN first, else the first non-heading line
+            "seller_name": [
+                rf"^\s*{_SELLER_LINE}\s*\n[^\n]*(?:\d+[^\n]*(?:Lane|Road|Street|Nagar|Marg)|\bGSTIN\b)",
+                rf"^\s*{_SELLER_LINE}\s*$",
+            ],
+            "location": [r"^\s*(\d+[^\n]*(?:Lane|Road|Street|Nagar|Marg)[^\n]*)$"],
+            "total_amount": _total_patterns(),
+        },
+        required=["invoice_number", "date", "total_amount", "seller_name"],
+    ),
+]
+
+
+# =========================================================
+# VALUE SHAPES LEARNED FROM STORED EXTRACTIONS
+# =========================================================
+def _shape_of(value: Any) -> Optional[str]:
+    """'No2025364' -> 'A2D7', 'HT-2903-002' -> 'A2-D4-D3'."""
+    if value is None:
+        return None
+    s = str(value).strip()
+    if not s:
+        return None
+    parts = []
+    for m in re.finditer(r"[A-Za-z]+|\d+|.", s):
+        tok = m.group(0)
+        if tok.isdigit():
+            parts.append(f"D{len(tok)}")
+        elif tok.isalpha():
+            parts.append(f"A{len(tok)}")
+        else:
+            parts.append(tok)
+    return "".join(parts)
+
+
+def _profile_vendor(j: Dict[str, Any]) -> Optional[str]:
+    src = str(j.get("_source_file") or "").lower()
+    seller = j.get("seller")
+    seller_name = seller.get("name") if isinstance(seller, dict) else seller
+    names = f"{j.get('vendor') or ''} {seller_name or ''}".lower()
+    for tpl in TEMPLATES:
+        if tpl.vendor and (src.startswith(tpl.name) or tpl.name in names):
+            return tpl.name
+    if str(j.get("invoice_number") or "").startswith("HT-"):
+        return "hotel_folio"
+    if isinstance(seller, dict) and seller.get("gstin"):
+        return "restaurant_bill"
+    return None
+
+
+def learn_profiles(json_dir: str = PDF_TEMPLATE_PROFILE_DIR) -> Dict[str, Dict[str, set]]:
+    """Per template: the set of value shapes seen for invoice_number / booking_number."""
+    profiles: Dict[str, Dict[str, set]] = {}
+    root = Path(json_dir)
+    if not root.exists():
+        return profiles
+    for f in root.glob("*.json"):
+        try:
+            j = json.loads(f.read_text(encoding="utf-8"))
+        except Exception:
+            continue
+        name = _profile_vendor(j)
+        if not name:
+            continue
+        prof = profiles.setdefault(name, {})
+        booking = j.get("booking_number") or (j.get("booking_details") or {}).get("booking_number")
+        for field, val in (("invoice_number", j.get("invoice_number")), ("booking_number", booking)):
+            shape = _shape_of(val)
+            if shape:
+                prof.setdefault(field, set()).add(shape)
+    return profiles
+
+
+_PROFILES: Optional[Dict[str, Dict[str, set]]] = None
+
+
+def get_profiles(refresh: bool = False) -> Dict[str, Dict[str, set]]:
+    global _PROFILES
+    if _PROFILES is None or refresh:
+        _PROFILES = learn_profiles()
+    return _PROFILES
+
+
+# =========================================================
+# PARSING
+# =========================================================
+_MONTH_FORMATS = ("%d %b %Y", "%d %B %Y", "%b %d, %Y", "%B %d, %Y", "%d %b, %Y", "%d %B, %Y")
+
+
+def _iso_date(s: Optional[str]) -> Optional[str]:
+    if not s:
+        return None
+    s = re.sub(r"\s+", " ", s.strip())
+    for fmt in ("%Y-%m-%d", "%d-%m-%Y", "%d/%m/%Y", "%d.%m.%Y") + _MONTH_FORMATS:
+        try:
+            return dt.datetime.strptime(s, fmt).date().isoformat()
+        except Exception:
+            pass
+    return None
+
+
+def _amount(s: Optional[str]) -> Optional[float]:
+    if not s:
+        return None
+    try:
+        return float(s.replace(",", ""))
+    except Exception:
+        return None
+
+
+def _currency(text: str) -> Optional[str]:
+    m = re.search(_CURRENCY, text)
+    if not m:
+        return None
+    return m.group(1).upper() if m.group(1) else "INR"
+
+
+_SUBTOTAL_LINE = re.compile(rf"(?<![A-Za-z])sub[\s-]*total[^\n]*?{_AMOUNT}\s*$", re.I | re.M)
+_TAX_LINE = re.compile(
+    rf"^[^\n]*\b(?:CGST|SGST|UTGST|IGST|GST|VAT|service\s*charge|luxury\s*tax|tax(?:es)?)\b[^\n]*?{_AMOUNT}\s*$",
+    re.I | re.M,
+)
+_TOTAL_TAX_LINE = re.compile(rf"total\s*tax(?:es)?[^\n]*?{_AMOUNT}\s*$", re.I | re.M)
+_ANY_TOTAL_LINE = re.compile(rf"(?:{_GRAND_TOTAL}|{_PLAIN_TOTAL})\s*[:\-]?\s*{_CUR_PREFIX}\s*{_AMOUNT}", re.I | re.M)
+
+
+def _labelled_amounts(text: str) -> Dict[str, Any]:
+    """Sub-total, tax and total figures printed on the bill, for cross-checking the total."""
+    subtotals = [_amount(m.group(1)) for m in _SUBTOTAL_LINE.finditer(text)]
+    taxes = [
+        _amount(m.group(1)) for m in _TAX_LINE.finditer(text)
+        if "total" not in m.group(0).lower()
+    ]
+    if not taxes:
+        taxes = [_amount(m.group(1)) for m in _TOTAL_TAX_LINE.finditer(text)]
+    totals = [_amount(m.group(1)) for m in _ANY_TOTAL_LINE.finditer(text)]
+    return {
+        "subtotal": subtotals[-1] if subtotals else None,
+        "taxes": round(sum(t for t in taxes if t), 2) if taxes else None,
+        "labelled": [a for a in subtotals + totals if a],
+    }
+
+
+def _score(tpl: PdfTemplate, data: Dict[str, Any], text: str = "") -> float:
+    found = sum(1 for f in tpl.required if data.get(f) not in (None, "", 0.0))
+    score = found / len(tpl.required)
+    prof = get_profiles().get(tpl.name, {})
+    for field, shapes in prof.items():
+        val = data.get(field)
+        if val and _shape_of(val) not in shapes:
+            score -= 0.25  # looks unlike anything we've seen for this vendor
+    if data.get("check_in") and data.get("check_out") and data["check_out"] < data["check_in"]:
+        score -= 0.5
+    seller = data.get("seller_name")
+    if "seller_name" in tpl.required and seller and (_GENERIC_SELLER.search(seller) or len(seller.strip()) < 3):
+        score -= 0.5  # "TAX INVOICE", "DUPLICATE COPY" ...: a heading, not the vendor
+    total = data.get("total_amount")
+    if text and isinstance(total, float):
+        amounts = _labelled_amounts(text)
+        if any(a > total + 0.01 for a in amounts["labelled"]):
+            score -= 0.5  # a sub-total or another total is bigger: we probably grabbed a component
+        sub, taxes = amounts["subtotal"], amounts["taxes"]
+        if sub is not None and taxes is not None and abs(sub + taxes - total) > max(1.0, 0.01 * total):
+            score -= 0.3  # items + taxes do not add up to the total
+    return max(0.0, round(score, 3))
+
+
+def parse_pdf_text(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Returns an extraction dict shaped like the LLM output plus `_template` and
+    `_template_confidence`, or None when no layout matches.
+    """
+    if not PDF_TEMPLATES_ENABLED or not text:
+        return None
+    for tpl in TEMPLATES:
+        if not tpl.matches(text):
+            continue
+        raw = tpl.extract(text)
+        data: Dict[str, Any] = {
+            "invoice_number": raw.get("invoice_number"),
+            "date": _iso_date(raw.get("date")),
+            "currency": _currency(text) or "INR",
+            "total_amount": _amount(raw.get("total_amount")),
+            "category": tpl.category,
+            "seller": {
+                "name": tpl.vendor or raw.get("seller_name") or raw.get("hotel_name"),
+                "location": raw.get("location"),
+            },
+            "items": [],
+            "_items_extracted": False,  # templates read header fields only; line items stay empty
+        }
+        for k in ("hotel_name", "booking_number"):
+            if raw.get(k):
+                data[k] = raw[k]
+        for k in ("check_in", "check_out"):
+            if raw.get(k):
+                data[k] = _iso_date(raw[k])
+        data["_template"] = tpl.name
+        data["_template_confidence"] = _score(tpl, {**raw, **data}, text)
+        return data
+    return None
+
+
+def accept(data: Optional[Dict[str, Any]]) -> bool:
+    return bool(data) and data.get("_template_confidence", 0.0) >= PDF_TEMPLATE_MIN_CONFIDENCE
@@ -0,0 +1,265 @@
+# pipeline.py
+"""
+Pipelined full mode for a batch of receipts.
+
+    files -> [extract] -> q1 -> [validate] -> q2 -> [persist] -> results
+
+Each stage has its own worker count and the queues between them are bounded,
+so while file N is being validated / saved the extractor is already on file
+N+1 (and a slow downstream stage applies back-pressure instead of letting
+extractions pile up in memory).
+
+  extract  : agent.aextract_node          (LLM-bound)
+  validate : agent.avalidate_node         (policy index + rules, DB lookup)
+  persist  : save_expense_claim + log_validation_result (+ ack email via the
+             outbox), i.e. what the upload pages do after phase=full
+
+Every run returns per-stage metrics (busy time, latency, utilisation,
+time blocked on the next queue) and queue-depth samples; the stage with the
+highest utilisation is reported as the bottleneck.
+"""
+
+import os
+import time
+import asyncio
+from typing import Optional, Dict, Any, List
+
+import db_utils
+import utils as mail_utils
+import agent as _agent
+
+PIPELINE_EXTRACT_WORKERS = int(os.getenv("PIPELINE_EXTRACT_WORKERS", "4"))
+PIPELINE_VALIDATE_WORKERS = int(os.getenv("PIPELINE_VALIDATE_WORKERS", "2"))
+PIPELINE_PERSIST_WORKERS = int(os.getenv("PIPELINE_PERSIST_WORKERS", "2"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
+
+_DONE = object()
+
+
+# ------------------------------------------------------------------
+# Metrics
+# ------------------------------------------------------------------
+class StageMetrics:
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.errors = 0
+        self.busy = 0.0          # seconds spent doing work, summed over workers
+        self.blocked = 0.0       # seconds spent waiting to hand off to a full queue
+        self.latencies: List[float] = []
+
+    def record(self, seconds: float, ok: bool) -> None:
+        self.items += 1
+        self.busy += seconds
+        self.latencies.append(seconds)
+        if not ok:
+            self.errors += 1
+
+    def summary(self, wall: float) -> Dict[str, Any]:
+        lat = sorted(self.latencies)
+        p95 = lat[min(len(lat) - 1, int(len(lat) * 0.95))] if lat else None
+        return {
+            "workers": self.workers,
+            "items": self.items,
+            "errors": self.errors,
+            "busy_s": round(self.busy, 3),
+            "blocked_on_output_s": round(self.blocked, 3),
+            "avg_ms": round(self.busy / self.items * 1000, 1) if self.items else None,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "utilisation": round(self.busy / (self.workers * wall), 3) if wall > 0 else None,
+        }
+
+
+class QueueSampler:
+    """Samples queue depths every `interval` seconds while the pipeline runs."""
+
+    def __init__(self, queues: Dict[str, asyncio.Queue], interval: float = 0.05):
+        self.queues = queues
+        self.interval = interval
+        self.samples: Dict[str, List[int]] = {k: [] for k in queues}
+
+    async def run(self) -> None:
+        while True:
+            for k, q in self.queues.items():
+                self.samples[k].append(q.qsize())
+            await asyncio.sleep(self.interval)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            k: {
+                "maxsize": self.queues[k].maxsize,
+                "max_depth": max(v) if v else 0,
+                "avg_depth": round(sum(v) / len(v), 2) if v else 0.0,
+            }
+            for k, v in self.samples.items()
+        }
+
+
+# ------------------------------------------------------------------
+# Stage bodies
+# ------------------------------------------------------------------
+async def _extract(item: Dict[str, Any]) -> None:
+    state = {
+        "file_path": item["file"],
+        "employee_id_hint": item["emp_id"],
+        "json_out_dir": item["json_out_dir"],
+        "save_json_file": item["save_json_file"],
+    }
+    item["state"] = await _agent.aextract_node(state)
+
+
+async def _validate(item: Dict[str, Any]) -> None:
+    state = await _agent.avalidate_node(item["state"])
+    item["state"] = state
+    item["process_id"] = state.get("process_id")
+    item["tag"] = state.get("tag")
+    item["decision"] = state.get("decision")
+
+
+def _persist_blocking(item: Dict[str, Any], notify: bool) -> None:
+    state = item["state"]
+    extraction = state.get("extraction") or {}
+    payload_out = _agent.payload_to_json_ready(extraction.get("payload", {}))
+    validation = state.get("validation") or {}
+    tag = state.get("tag") or "Pending"
+
+    claim_id = db_utils.save_expense_claim(payload_out, tag)
+    item["claim_id"] = claim_id
+    db_utils.log_validation_result(
+        claim_id=claim_id,
+        employee_id=payload_out.get("employee_id"),
+        validation_obj={**validation, "status": tag},
+    )
+    if not notify:
+        return
+    emp = (db_utils.get_employee_details(payload_out.get("employee_id")) or [{}])[0]
+    if not emp.get("email"):
+        return
+    subject, body = mail_utils.draft_employee_ack_on_upload(
+        claim_id=claim_id,
+        employee_name=emp.get("first_name"),
+        employee_id=payload_out.get("employee_id") or "—",
+        category=(payload_out.get("category") or "other").title(),
+        amount=payload_out.get("total_amount", 0.0),
+        currency=payload_out.get("currency", "INR"),
+        vendor=payload_out.get("vendor"),
+        expense_date=payload_out.get("expense_date"),
+        tag=tag,
+        decision=state.get("decision"),
+        comments=validation.get("message"),
+    )
+    mail_utils.send_email(emp["email"], subject, body)
+
+
+# ------------------------------------------------------------------
+# Runner
+# ------------------------------------------------------------------
+async def _stage_worker(stage_fn, metrics: StageMetrics, inbox: asyncio.Queue, outbox: Optional[asyncio.Queue]):
+    while True:
+        item = await inbox.get()
+        if item is _DONE:
+            inbox.task_done()
+            return
+        if not item.get("error"):
+            t0 = time.perf_counter()
+            try:
+                await stage_fn(item)
+                ok = True
+            except Exception as ex:
+                item["error"] = f"{metrics.name}: {type(ex).__name__}: {ex}"
+                ok = False
+            elapsed = time.perf_counter() - t0
+            item.setdefault("stage_ms", {})[metrics.name] = round(elapsed * 1000, 1)
+            metrics.record(elapsed, ok)
+        if outbox is not None:
+            t_put = time.perf_counter()
+            await outbox.put(item)
+            metrics.blocked += time.perf_counter() - t_put
+        inbox.task_done()
+
+
+async def _feed(items: List[Dict[str, Any]], q: asyncio.Queue, n_consumers: int) -> None:
+    for it in items:
+        await q.put(it)
+    for _ in range(n_consumers):
+        await q.put(_DONE)
+
+
+async def _stage(stage_fn, metrics: StageMetrics, inbox: asyncio.Queue, outbox: Optional[asyncio.Queue], next_workers: int):
+    await asyncio.gather(*[_stage_worker(stage_fn, metrics, inbox, outbox) for _ in range(metrics.workers)])
+    if outbox is not None:
+        for _ in range(next_workers):
+            await outbox.put(_DONE)
+
+
+last_run: Dict[str, Any] = {}
+
+
+async def run_pipeline(
+    files: List[str],
+    emp_id: Optional[str] = None,
+    json_out_dir: str = "./output/langchain_json",
+    save_json_file: bool = True,
+    persist: bool = True,
+    notify: bool = False,
+) -> Dict[str, Any]:
+    """Extract -> validate -> persist a batch with the three stages overlapped."""
+    items = [
+        {"index": i, "file": f, "emp_id": emp_id, "json_out_dir": json_out_dir, "save_json_file": save_json_file}
+        for i, f in enumerate(files)
+    ]
+    m_extract = StageMetrics("extract", PIPELINE_EXTRACT_WORKERS)
+    m_validate = StageMetrics("validate", PIPELINE_VALIDATE_WORKERS)
+    m_persist = StageMetrics("persist", PIPELINE_PERSIST_WORKERS if persist else 1)
+
+    q_in: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    q_extracted: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    q_validated: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    sampler = QueueSampler({"input": q_in, "extracted": q_extracted, "validated": q_validated})
+
+    async def _persist(item: Dict[str, Any]) -> None:
+        if persist:
+            await _agent.run_blocking(_persist_blocking, item, notify)
+
+    t0 = time.perf_counter()
+    sampler_task = asyncio.create_task(sampler.run())
+    try:
+        await asyncio.gather(
+            _feed(items, q_in, m_extract.workers),
+            _stage(_extract, m_extract, q_in, q_extracted, m_validate.workers),
+            _stage(_validate, m_validate, q_extracted, q_validated, m_persist.workers),
+            _stage(_persist, m_persist, q_validated, None, 0),
+        )
+    finally:
+        sampler_task.cancel()
+    wall = time.perf_counter() - t0
+
+    stages = {m.name: m.summary(wall) for m in (m_extract, m_validate, m_persist)}
+    bottleneck = max(stages, key=lambda k: stages[k]["utilisation"] or 0.0)
+    metrics = {
+        "files": len(files),
+        "wall_s": round(wall, 3),
+        "throughput_per_min": round(len(files) / wall * 60, 2) if wall > 0 else None,
+        "stages": stages,
+        "queues": sampler.summary(),
+        "bottleneck": bottleneck,
+    }
+    last_run.clear()
+    last_run.update(metrics)
+
+    results = []
+    for it in items:
+        extraction = (it.get("state") or {}).get("extraction") or {}
+        results.append({
+            "file": it["file"],
+            "process_id": it.get("process_id"),
+            "claim_id": it.get("claim_id"),
+            "tag": it.get("tag"),
+            "decision": it.get("decision"),
+            "validation": (it.get("state") or {}).get("validation"),
+            "ocr_engine": extraction.get("ocr_engine"),
+            "stage_ms": it.get("stage_ms", {}),
+            "error": it.get("error"),
+        })
+    return {"results": results, "metrics": metrics}
@@ -0,0 +1,190 @@
+# policy_index.py
+"""
+In-memory index over expense_policies for the validation hot path.
+
+lookup(grade, category) returns the same row agent._pick_policy_for would pick
+from db_utils.load_policies_df(grade):
+  1. a policy for the category whose applicable_grades list contains the
+     grade exactly (highest max_allowance first, as the SQL ordered them);
+  2. otherwise a policy for the category whose applicable_grades merely
+     contains the grade text (the old ILIKE '%grade%' fallback).
+(1) is precompiled into a dict keyed by (grade, lower(category)); (2) is
+computed on first use per key and memoised, so steady-state lookups are O(1)
+with no DB round-trip.
+
+Freshness: a trigger on expense_policies issues NOTIFY expense_policies_changed
+and a listener thread (one dedicated, non-pooled connection) drops the index.
+As a safety net the index is also rebuilt after POLICY_INDEX_MAX_AGE_SECONDS.
+"""
+
+import os
+import time
+import select
+import threading
+from typing import Optional, Dict, Any, List, Tuple
+
+from sqlalchemy import text, create_engine
+from sqlalchemy.pool import NullPool
+
+import db_utils
+
+POLICY_INDEX_MAX_AGE_SECONDS = float(os.getenv("POLICY_INDEX_MAX_AGE_SECONDS", "900"))
+POLICY_INDEX_LISTEN = os.getenv("POLICY_INDEX_LISTEN", "true").lower() == "true"
+_CHANNEL = "expense_policies_changed"
+
+_NOTIFY_DDL = [
+    f"""
+    CREATE OR REPLACE FUNCTION expense_policies_notify() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('{_CHANNEL}', TG_OP);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS trg_expense_policies_notify ON expense_policies",
+    """
+    CREATE TRIGGER trg_expense_policies_notify
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON expense_policies
+    FOR EACH STATEMENT EXECUTE FUNCTION expense_policies_notify()
+    """,
+]
+
+
+def _grades_of(applicable_grades: Any) -> List[str]:
+    return [g.strip() for g in str(applicable_grades or "").split(",")]
+
+
+class PolicyIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._policies: List[Dict[str, Any]] = []
+        self._exact: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._fallback: Dict[Tuple[str, str], Optional[Dict[str, Any]]] = {}
+        self._built_at = 0.0
+        self.version = 0
+        self.builds = 0
+        self.hits = 0
+        self._listener: Optional[threading.Thread] = None
+
+    # ---------- build ----------
+    def _load(self) -> List[Dict[str, Any]]:
+        with db_utils.engine.connect() as conn:
+            rows = conn.execute(text("""
+                SELECT * FROM expense_policies
+                ORDER BY category ASC, max_allowance DESC
+            """)).mappings().all()
+        return [dict(r) for r in rows]
+
+    def rebuild(self) -> None:
+        policies = self._load()
+        exact: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        for pol in policies:
+            cat = (pol.get("category") or "").lower()
+            if not cat:
+                continue
+            for g in _grades_of(pol.get("applicable_grades")):
+                exact.setdefault((g, cat), pol)  # first = highest max_allowance
+        with self._lock:
+            self._policies = policies
+            self._exact = exact
+            self._fallback = {}
+            self._built_at = time.monotonic()
+            self.version += 1
+            self.builds += 1
+        print(f"[policy_index] built v{self.version}: {len(policies)} policies, {len(exact)} (grade, category) keys")
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._built_at = 0.0
+
+    def _ensure_fresh(self) -> None:
+        if POLICY_INDEX_LISTEN and self._listener is None:
+            self._start_listener()
+        if not self._built_at or time.monotonic() - self._built_at > POLICY_INDEX_MAX_AGE_SECONDS:
+            self.rebuild()
+
+    # ---------- lookup ----------
+    def lookup(self, grade: Optional[str], category: Optional[str]) -> Optional[Dict[str, Any]]:
+        if not grade or not category:
+            return None
+        self._ensure_fresh()
+        key = (str(grade), str(category).lower())
+        with self._lock:
+            hit = self._exact.get(key)
+            if hit is not None:
+                self.hits += 1
+                return hit
+            if key in self._fallback:
+                self.hits += 1
+                return self._fallback[key]
+            g_low = key[0].lower()
+            pol = next(
+                (p for p in self._policies
+                 if (p.get("category") or "").lower() == key[1]
+                 and g_low in str(p.get("applicable_grades") or "").lower()),
+                None,
+            )
+            self._fallback[key] = pol
+            return pol
+
+    def lookup_for_employee(self, employee_row: Optional[Dict[str, Any]], category: Optional[str]) -> Optional[Dict[str, Any]]:
+        return self.lookup((employee_row or {}).get("grade"), category)
+
+    # ---------- LISTEN/NOTIFY ----------
+    def _start_listener(self) -> None:
+        with self._lock:
+            if self._listener is not None:
+                return
+            self._listener = threading.Thread(target=self._listen_loop, name="policy-index-listen", daemon=True)
+        try:
+            with db_utils.engine.begin() as conn:
+                for stmt in _NOTIFY_DDL:
+                    conn.execute(text(stmt))
+        except Exception as ex:
+            print(f"[policy_index] notify trigger not installed ({ex}); relying on max-age refresh")
+        self._listener.start()
+
+    def _listen_loop(self) -> None:
+        # dedicated connection outside the shared pool; it sits in LISTEN forever
+        listen_engine = create_engine(db_utils.DATABASE_URL, poolclass=NullPool)
+        while True:
+            conn = None
+            try:
+                conn = listen_engine.raw_connection()
+                conn.set_isolation_level(0)  # autocommit, required for LISTEN
+                cur = conn.cursor()
+                cur.execute(f"LISTEN {_CHANNEL};")
+                # anything may have changed while we were not listening
+                self.invalidate()
+                while True:
+                    if select.select([conn.dbapi_connection], [], [], 60) == ([], [], []):
+                        continue
+                    conn.dbapi_connection.poll()
+                    if conn.dbapi_connection.notifies:
+                        conn.dbapi_connection.notifies.clear()
+                        self.invalidate()
+            except Exception as ex:
+                print(f"[policy_index] listener error: {ex}; retrying in 10s")
+                time.sleep(10)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "version": self.version,
+                "builds": self.builds,
+                "policies": len(self._policies),
+                "exact_keys": len(self._exact),
+                "fallback_keys": len(self._fallback),
+                "hits": self.hits,
+                "age_seconds": round(time.monotonic() - self._built_at, 1) if self._built_at else None,
+                "listening": bool(self._listener and self._listener.is_alive()),
+            }
+
+
+policy_index = PolicyIndex()
@@ -0,0 +1,217 @@
+# policy_sim.py
+"""
+Policy what-if simulator.
+
+simulate() replays the validation rules over every claim in a date range
+twice: once with the current policies and the standard 10% / 25% bands, and
+once with candidate policy rows and/or band thresholds. It returns both
+outcomes and the shift in auto-approval rate, manager / finance workload and
+rejected spend.
+
+Claims come from a cached in-memory snapshot (ClaimsSnapshot) holding only the
+columns the rules need, sorted by claim_date so a date range is two binary
+searches. The snapshot is reloaded when the claims table changes (the
+MAX(id) + claims version part of finance_cache.data_watermark(), so in-place
+edits to amount / category / date count too; checked at most every
+SIM_SNAPSHOT_CHECK_SECONDS) and its per-claim policy limits are re-resolved
+when policy_index rebuilds. Reloads and re-resolves build new arrays and swap
+them in; refresh() hands each simulation one consistent view.
+"""
+
+import os
+import time
+import threading
+from datetime import date
+from typing import Optional, Dict, Any, List, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+import db_utils
+import revalidation
+import finance_cache
+from policy_index import policy_index
+
+SIM_SNAPSHOT_CHECK_SECONDS = float(os.getenv("SIM_SNAPSHOT_CHECK_SECONDS", "30"))
+
+_TAGS = ["Auto Approved", "Pending", "Finance Pending", "Rejected"]
+
+
+# ------------------------------------------------------------------
+# Cached claims snapshot
+# ------------------------------------------------------------------
+class ClaimsSnapshot:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.frame: Optional[pd.DataFrame] = None
+        self.pairs: Optional[pd.DataFrame] = None   # distinct (grade, category_key) + current max_allowance
+        self.pair_codes: Optional[np.ndarray] = None
+        self.dates: Optional[np.ndarray] = None
+        self.amount: Optional[np.ndarray] = None
+        self._watermark: Optional[Tuple[Any, Any]] = None
+        self._policy_version = -1
+        self._checked_at = 0.0
+        self.loads = 0
+
+    def _current_watermark(self) -> Tuple[Any, ...]:
+        # (MAX(id), claims version); the policies part is policy_index's business
+        return finance_cache.data_watermark()[:2]
+
+    def _load(self, watermark) -> None:
+        sql = text("""
+            SELECT c.claim_date, c.expense_category, c.amount::float8 AS amount, e.grade
+            FROM expense_claims c
+            LEFT JOIN employees e ON e.employee_id = c.employee_id
+            ORDER BY c.claim_date
+        """)
+        with db_utils.engine.connect() as conn:
+            df = pd.read_sql(sql, conn)
+        df["grade"] = df["grade"].fillna("")  # claim without an employee row => no policy
+        df["category_key"] = df["expense_category"].astype(str).str.lower()
+        codes, uniques = pd.factorize(df["grade"] + "\x1f" + df["category_key"])
+        pairs = pd.DataFrame([u.split("\x1f", 1) for u in uniques], columns=["grade", "category_key"])
+        # one representative spelling per pair for the policy lookup
+        pairs["category"] = df.groupby(codes)["expense_category"].first().reindex(range(len(pairs))).to_numpy()
+        self.frame = df
+        self.pairs = pairs
+        self.pair_codes = codes
+        self.dates = pd.to_datetime(df["claim_date"]).to_numpy(dtype="datetime64[D]")
+        self.amount = np.nan_to_num(df["amount"].to_numpy(dtype="float64"), nan=0.0)
+        self._watermark = watermark
+        self._policy_version = -1
+        self.loads += 1
+        print(f"[policy_sim] snapshot loaded: {len(df):,} claims, {len(pairs)} (grade, category) pairs")
+
+    def _resolve_limits(self) -> None:
+        limits = []
+        for grade, cat in zip(self.pairs["grade"], self.pairs["category"]):
+            pol = policy_index.lookup(grade, cat) if grade else None
+            limits.append(float(pol["max_allowance"]) if pol and pol.get("max_allowance") is not None else np.nan)
+        # a new frame, swapped in: simulations in flight keep reading the old one
+        self.pairs = self.pairs.assign(max_allowance=limits)
+        # read after the loop: lookup() may have rebuilt the index
+        self._policy_version = policy_index.version
+
+    def refresh(self, force: bool = False) -> Tuple[pd.DataFrame, np.ndarray, np.ndarray, np.ndarray]:
+        """Reload / re-resolve if needed; returns (pairs, pair_codes, dates, amount) from one generation."""
+        with self._lock:
+            now = time.monotonic()
+            if force or self.frame is None or now - self._checked_at > SIM_SNAPSHOT_CHECK_SECONDS:
+                wm = self._current_watermark()
+                self._checked_at = now
+                if force or self.frame is None or wm != self._watermark:
+                    self._load(wm)
+            if self._policy_version != policy_index.version or "max_allowance" not in self.pairs:
+                self._resolve_limits()
+            return self.pairs, self.pair_codes, self.dates, self.amount
+
+    def window(self, start_date: Optional[date], end_date: Optional[date], dates: Optional[np.ndarray] = None) -> slice:
+        dates = self.dates if dates is None else dates
+        lo = 0 if start_date is None else int(np.searchsorted(dates, np.datetime64(start_date, "D"), "left"))
+        hi = len(dates) if end_date is None else int(np.searchsorted(dates, np.datetime64(end_date, "D"), "right"))
+        return slice(lo, hi)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "claims": 0 if self.frame is None else int(len(self.frame)),
+            "pairs": 0 if self.pairs is None else int(len(self.pairs)),
+            "loads": self.loads,
+            "policy_version": self._policy_version,
+        }
+
+
+snapshot = ClaimsSnapshot()
+
+
+# ------------------------------------------------------------------
+# Simulation
+# ------------------------------------------------------------------
+def _candidate_limits(pairs: pd.DataFrame, candidates: List[Dict[str, Any]]) -> np.ndarray:
+    """Current per-pair limits with candidate rows applied (grades may be a comma list)."""
+    limits = pairs["max_allowance"].to_numpy(dtype="float64").copy()
+    index = {(g, c): i for i, (g, c) in enumerate(zip(pairs["grade"], pairs["category_key"]))}
+    for cand in candidates or []:
+        cat = str(cand.get("category") or "").lower()
+        grades = cand.get("applicable_grades") or cand.get("grade") or ""
+        for g in [x.strip() for x in str(grades).split(",") if x.strip()]:
+            i = index.get((g, cat))
+            if i is not None:
+                mx = cand.get("max_allowance")
+                limits[i] = np.nan if mx is None else float(mx)
+    return limits
+
+
+def _outcome(amount: np.ndarray, tags: np.ndarray) -> Dict[str, Any]:
+    n = int(len(tags))
+    out: Dict[str, Any] = {"claims": n}
+    for t in _TAGS:
+        mask = tags == t
+        out[t] = {"count": int(mask.sum()), "amount": round(float(amount[mask].sum()), 2)}
+    out["auto_approval_rate"] = round(out["Auto Approved"]["count"] / n * 100.0, 2) if n else 0.0
+    out["manager_workload"] = out["Pending"]["count"]
+    out["finance_workload"] = out["Finance Pending"]["count"]
+    out["rejected_spend"] = out["Rejected"]["amount"]
+    return out
+
+
+def simulate(
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    candidates: Optional[List[Dict[str, Any]]] = None,
+    manager_band: float = revalidation.MANAGER_BAND,
+    finance_band: float = revalidation.FINANCE_BAND,
+) -> Dict[str, Any]:
+    """
+    candidates: rows like {"category": "Hotel", "applicable_grades": "G2", "max_allowance": 9000}.
+    Bands are percentages over the limit (defaults are the live 10 / 25).
+    """
+    t0 = time.perf_counter()
+    pairs, pair_codes, dates, all_amounts = snapshot.refresh()
+    t_snap = time.perf_counter()
+
+    win = snapshot.window(start_date, end_date, dates)
+    codes = pair_codes[win]
+    amount = all_amounts[win]
+
+    base_limits = pairs["max_allowance"].to_numpy(dtype="float64")
+    cand_limits = _candidate_limits(pairs, candidates or [])
+
+    base = revalidation.evaluate_frame(pd.DataFrame({"amount": amount, "max_allowance": base_limits[codes]}))
+    cand = revalidation.evaluate_frame(
+        pd.DataFrame({"amount": amount, "max_allowance": cand_limits[codes]}),
+        manager_band=manager_band,
+        finance_band=finance_band,
+    )
+    b_tags = base["tag"].to_numpy()
+    c_tags = cand["tag"].to_numpy()
+
+    before = _outcome(amount, b_tags)
+    after = _outcome(amount, c_tags)
+    moved = b_tags != c_tags
+    transitions = (
+        pd.DataFrame({"from_tag": b_tags[moved], "to_tag": c_tags[moved]})
+        .value_counts().reset_index(name="claims").to_dict("records")
+    )
+    t_done = time.perf_counter()
+
+    return {
+        "range": {"start_date": start_date, "end_date": end_date},
+        "bands": {"manager": manager_band, "finance": finance_band},
+        "baseline": before,
+        "scenario": after,
+        "delta": {
+            "auto_approval_rate": round(after["auto_approval_rate"] - before["auto_approval_rate"], 2),
+            "manager_workload": after["manager_workload"] - before["manager_workload"],
+            "finance_workload": after["finance_workload"] - before["finance_workload"],
+            "rejected_count": after["Rejected"]["count"] - before["Rejected"]["count"],
+            "rejected_spend": round(after["rejected_spend"] - before["rejected_spend"], 2),
+        },
+        "claims_changed": int(moved.sum()),
+        "transitions": transitions,
+        "snapshot": snapshot.stats(),
+        "timings_ms": {
+            "snapshot": round((t_snap - t0) * 1000, 1),
+            "simulate": round((t_done - t_snap) * 1000, 1),
+        },
+    }
@@ -4,9 +4,12 @@ Database query layer for Agent Max Finance System.
 Each function returns Python-native data (list[dict]) using safe_query().
 """
 
+import json
+import base64
 from datetime import date
-from typing import Optional
+from typing import Optional, List
 from db import get_connection, safe_query
+import rollups as _rollups
 
 
 # -------------------------------------------------------
@@ -117,29 +120,144 @@ def get_pending_claims(start_date: date, end_date: date):
 
 
 # -------------------------------------------------------
-# Full claims list
+# Full claims list (keyset-paginated)
 # -------------------------------------------------------
-def get_claims_list(start_date: date, end_date: date, status: Optional[str] = None,
-                    employee_id: Optional[str] = None, limit: int = 500):
-    base_sql = """
+def ensure_claims_list_index():
+    """
+    (claim_date, claim_id) index so each /claims/list page is one index range
+    scan. Called from the API startup hook, never from a request: built
+    CONCURRENTLY so claim writers are not blocked while it builds, which needs
+    autocommit (no surrounding transaction). A session advisory lock keeps
+    several API workers from building it at once; an INVALID leftover from an
+    interrupted build is dropped and rebuilt.
+    """
+    with get_connection() as conn:
+        dbapi = conn.dbapi_connection
+        dbapi.autocommit = True
+        try:
+            with dbapi.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(hashtext('ix_claim_date_claim_id'))")
+                if not cur.fetchone()[0]:
+                    return  # another worker is building it
+                try:
+                    cur.execute("""
+                        SELECT i.indisvalid FROM pg_index i
+                        WHERE i.indexrelid = to_regclass('ix_claim_date_claim_id')
+                    """)
+                    row = cur.fetchone()
+                    if row and not row[0]:
+                        cur.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_claim_date_claim_id")
+                    cur.execute(
+                        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_claim_date_claim_id "
+                        "ON expense_claims (claim_date, claim_id)"
+                    )
+                finally:
+                    cur.execute("SELECT pg_advisory_unlock(hashtext('ix_claim_date_claim_id'))")
+        finally:
+            dbapi.autocommit = False
+
+
+def encode_claims_cursor(claim_date, claim_id) -> str:
+    raw = json.dumps({"d": str(claim_date), "c": claim_id}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_claims_cursor(cursor: str):
+    """Returns (claim_date, claim_id); raises ValueError on a malformed cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        obj = json.loads(raw)
+        return date.fromisoformat(obj["d"]), str(obj["c"])
+    except Exception as e:
+        raise ValueError(f"invalid cursor: {cursor!r}") from e
+
+
+def _like_pattern(needle: str) -> str:
+    escaped = needle.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _claims_filter_sql(start_date, end_date, statuses, employee_id, category, currency, vendor_like):
+    sql = " WHERE c.claim_date BETWEEN %s AND %s"
+    params = [start_date, end_date]
+    if statuses:
+        sql += " AND c.status = ANY(%s)"
+        params.append(list(statuses))
+    if employee_id:
+        sql += " AND c.employee_id = %s"
+        params.append(employee_id)
+    if category:
+        sql += " AND c.expense_category = %s"
+        params.append(category)
+    if currency:
+        sql += " AND c.currency = %s"
+        params.append(currency)
+    if vendor_like:
+        sql += " AND c.vendor_name ILIKE %s"
+        params.append(vendor_like)
+    return sql, params
+
+
+def get_claims_list(start_date: date, end_date: date, status: Optional[List[str]] = None,
+                    employee_id: Optional[str] = None, limit: int = 500,
+                    category: Optional[str] = None, currency: Optional[str] = None,
+                    vendor: Optional[str] = None, cursor: Optional[str] = None):
+    """
+    One page of claims, newest first, ordered by (claim_date, claim_id) DESC.
+    `cursor` is the opaque next_cursor of the previous page; every page is an
+    index range scan of `limit` rows however deep it is. Totals are computed
+    for the first page only (cursor=None).
+    """
+    if isinstance(status, str):
+        status = [status]
+    vendor_like = _like_pattern(vendor) if vendor and vendor.strip() else None
+    where_sql, params = _claims_filter_sql(start_date, end_date, status, employee_id, category, currency, vendor_like)
+
+    page_sql = """
         SELECT c.id, c.claim_id, c.employee_id,
                (e.first_name || ' ' || e.last_name) AS employee_name,
                c.claim_date, c.expense_category, c.amount::float, c.currency, c.vendor_name,
                c.payment_mode, c.status, c.auto_approved, c.is_duplicate, c.fraud_flag, c.details
         FROM expense_claims c
         LEFT JOIN employees e ON c.employee_id = e.employee_id
-        WHERE c.claim_date BETWEEN %s AND %s
+    """ + where_sql
+    page_params = list(params)
+    if cursor:
+        after_date, after_id = decode_claims_cursor(cursor)
+        page_sql += " AND (c.claim_date, c.claim_id) < (%s, %s)"
+        page_params += [after_date, after_id]
+    page_sql += " ORDER BY c.claim_date DESC, c.claim_id DESC LIMIT %s;"
+    page_params.append(limit + 1)
+
+    rows = _read(page_sql, tuple(page_params))
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_claims_cursor(rows[-1]["claim_date"], rows[-1]["claim_id"])
+
+    page = {"items": rows, "next_cursor": next_cursor}
+    if cursor is None:
+        page.update(count_claims(start_date, end_date, status, employee_id, category, currency, vendor_like))
+    return page
+
+
+def count_claims(start_date, end_date, statuses, employee_id, category, currency, vendor_like) -> dict:
     """
-    params = [start_date, end_date]
-    if status:
-        base_sql += " AND c.status = %s"
-        params.append(status)
-    if employee_id:
-        base_sql += " AND c.employee_id = %s"
-        params.append(employee_id)
-    base_sql += " ORDER BY c.claim_date DESC LIMIT %s;"
-    params.append(limit)
-    return _read(base_sql, tuple(params))
+    Exact counts from the rollups when the filters are ones the rollup keys
+    cover (date, status, category, vendor); otherwise the planner's row
+    estimate, which costs no scan.
+    """
+    if not employee_id and not currency:
+        try:
+            counts = _rollups.get_claim_counts(start_date, end_date, statuses, category, vendor_like)
+            return {"total": counts["total"], "total_exact": True, "total_source": "rollup",
+                    "by_category": counts["by_category"]}
+        except Exception as e:
+            print(f"[queries] rollup count unavailable ({e}); using planner estimate")
+    where_sql, params = _claims_filter_sql(start_date, end_date, statuses, employee_id, category, currency, vendor_like)
+    plan = _read("EXPLAIN (FORMAT JSON) SELECT 1 FROM expense_claims c" + where_sql, tuple(params))
+    est = int(plan[0]["QUERY PLAN"][0]["Plan"]["Plan Rows"]) if plan else 0
+    return {"total": est, "total_exact": False, "total_source": "estimate"}
 
 
 # -------------------------------------------------------
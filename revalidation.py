@@ -0,0 +1,277 @@
+# revalidation.py
+"""
+Vectorised re-validation of stored claims.
+
+evaluate_frame() is the column-wise twin of agent._enforce_validation_rules +
+ValidationAgent._band_from_metrics: given one row per claim (amount, currency,
+category, grade, max_allowance) it produces allowed_amount, percent_diff,
+rule_band, tag and decision with pandas/NumPy operations. The result matches
+the scalar path row for row, including the round(percent_diff, 2) used for
+banding (see _round2 / _band_limit); verify_against_scalar() checks that on a
+sample.
+
+revalidate_claims() loads the Pending / Finance Pending backlog, joins each
+(grade, category) pair through policy_index, re-bands it and writes changed
+statuses back with one UPDATE ... FROM unnest() per chunk.
+"""
+
+import os
+import math
+import time
+from datetime import date
+from typing import Optional, Dict, Any, List, Iterable
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+import db_utils
+from policy_index import policy_index
+
+REVALIDATE_CHUNK = int(os.getenv("REVALIDATE_CHUNK", "5000"))
+REVALIDATE_STATUSES = ("Pending", "Finance Pending")
+
+MANAGER_BAND = 10.0   # % over the limit still routed to the manager
+FINANCE_BAND = 25.0   # % over the limit still routed to finance; above => Rejected
+
+_TAG_DECISION = {
+    "Auto Approved": "Approved",
+    "Pending": "Send to Manager",
+    "Finance Pending": "Send to Finance Team",
+    "Rejected": "Reject",
+}
+
+
+# ------------------------------------------------------------------
+# Exact round(x, 2) semantics, vectorised
+# ------------------------------------------------------------------
+def _band_limit(bound: float) -> float:
+    """Largest float x with round(x, 2) <= bound, so `x <= limit` == `round(x, 2) <= bound`."""
+    x = bound + 0.005
+    while round(x, 2) > bound:
+        x = math.nextafter(x, -math.inf)
+    while round(math.nextafter(x, math.inf), 2) <= bound:
+        x = math.nextafter(x, math.inf)
+    return x
+
+
+def _round2(values: np.ndarray) -> np.ndarray:
+    """np.round(x, 2), with Python's correctly-rounded round() for near-ties."""
+    out = np.round(values, 2)
+    frac = np.abs(np.modf(values * 100.0)[0])
+    near_tie = np.isfinite(values) & (np.abs(frac - 0.5) < 1e-6)
+    if near_tie.any():
+        idx = np.flatnonzero(near_tie)
+        out[idx] = [round(float(v), 2) for v in values[idx]]
+    return out
+
+
+# ------------------------------------------------------------------
+# Core evaluation
+# ------------------------------------------------------------------
+def evaluate_frame(
+    df: pd.DataFrame,
+    manager_band: float = MANAGER_BAND,
+    finance_band: float = FINANCE_BAND,
+) -> pd.DataFrame:
+    """
+    df columns: amount, max_allowance (NaN = no policy); optional currency.
+    Returns a frame (same index) with allowed_amount, percent_diff, rule_band, tag, decision.
+    """
+    if hasattr(df, "to_pandas"):  # pyarrow.Table
+        df = df.to_pandas()
+
+    spent = pd.to_numeric(df["amount"], errors="coerce").fillna(0.0).to_numpy(dtype="float64")
+    allowance = pd.to_numeric(df["max_allowance"], errors="coerce").to_numpy(dtype="float64")
+
+    has_limit = np.isfinite(allowance) & (allowance > 0)
+    safe_allow = np.where(has_limit, allowance, 1.0)
+    within = has_limit & (spent <= safe_allow)
+    raw_pct = np.where(within, 0.0, (spent - safe_allow) / safe_allow * 100.0)
+    pct = np.where(has_limit, _round2(raw_pct), np.nan)
+
+    mgr_lim = _band_limit(manager_band)
+    fin_lim = _band_limit(finance_band)
+    zero_lim = _band_limit(0.0)
+
+    tag = np.select(
+        [~has_limit, within, raw_pct <= mgr_lim, raw_pct <= fin_lim],
+        ["Finance Pending", "Auto Approved", "Pending", "Finance Pending"],
+        default="Rejected",
+    )
+    rule_band = np.select(
+        [~has_limit, raw_pct <= zero_lim, raw_pct <= mgr_lim, raw_pct <= fin_lim],
+        ["no_policy", "within_limit", "over_by_0_to_10", "over_by_10_to_25"],
+        default="over_by_25_plus",
+    )
+
+    out = pd.DataFrame(index=df.index)
+    out["allowed_amount"] = np.where(has_limit, allowance, np.nan)
+    out["spent_amount"] = spent
+    out["percent_diff"] = pct
+    out["rule_band"] = rule_band
+    out["tag"] = tag
+    out["decision"] = pd.Series(tag, index=df.index).map(_TAG_DECISION)
+    return out
+
+
+def verify_against_scalar(df: pd.DataFrame, sample: int = 2000) -> int:
+    """Re-run a sample through the scalar validator; returns the number of mismatches."""
+    import agent  # heavy import (LLM client); only needed for the check
+
+    vec = evaluate_frame(df)
+    rows = df.sample(min(sample, len(df)), random_state=0) if len(df) > sample else df
+    bad = 0
+    for idx, r in rows.iterrows():
+        allowance = r.get("max_allowance")
+        policy = None if pd.isna(allowance) else {"max_allowance": float(allowance)}
+        amount = r.get("amount")
+        payload = {
+            "category": r.get("expense_category"),
+            "total_amount": None if pd.isna(amount) else float(amount),
+            "currency": r.get("currency"),
+        }
+        base = agent._enforce_validation_rules({"grade": r.get("grade")}, policy, payload)
+        band = agent.ValidationAgent._band_from_metrics(base.get("metrics"))
+        v = vec.loc[idx]
+        exp_pct = base["metrics"]["percent_diff"]
+        same_pct = (exp_pct is None and pd.isna(v["percent_diff"])) or exp_pct == v["percent_diff"]
+        if base["tag"] != v["tag"] or base["decision"] != v["decision"] or band != v["rule_band"] or not same_pct:
+            bad += 1
+            if bad <= 5:
+                print(f"[revalidation] mismatch at {idx}: scalar={base['tag']}/{band}/{exp_pct} "
+                      f"vector={v['tag']}/{v['rule_band']}/{v['percent_diff']}")
+    return bad
+
+
+# ------------------------------------------------------------------
+# Load / join / write back
+# ------------------------------------------------------------------
+def load_claims_frame(
+    statuses: Optional[Iterable[str]] = REVALIDATE_STATUSES,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+) -> pd.DataFrame:
+    clauses = ["1=1"]
+    params: Dict[str, Any] = {}
+    if statuses:
+        clauses.append("c.status = ANY(:statuses)")
+        params["statuses"] = list(statuses)
+    if start_date:
+        clauses.append("c.claim_date >= :start_date")
+        params["start_date"] = start_date
+    if end_date:
+        clauses.append("c.claim_date <= :end_date")
+        params["end_date"] = end_date
+    sql = text(f"""
+        SELECT c.claim_id, c.claim_date, c.employee_id, c.expense_category,
+               c.amount::float8 AS amount, c.currency, c.status, e.grade
+        FROM expense_claims c
+        LEFT JOIN employees e ON e.employee_id = c.employee_id
+        WHERE {' AND '.join(clauses)}
+    """)
+    with db_utils.engine.connect() as conn:
+        return pd.read_sql(sql, conn, params=params)
+
+
+def attach_policies(df: pd.DataFrame, overrides: Optional[Dict[tuple, Optional[float]]] = None) -> pd.DataFrame:
+    """
+    Adds max_allowance by resolving each distinct (grade, category) through the
+    policy index (same pick as the live validator). `overrides` maps
+    (grade, lower(category)) -> max_allowance for what-if runs.
+    """
+    pairs = df[["grade", "expense_category"]].drop_duplicates()
+    limits = []
+    for grade, cat in pairs.itertuples(index=False):
+        key = (grade, str(cat).lower() if cat is not None else None)
+        if overrides and key in overrides:
+            limits.append(overrides[key])
+            continue
+        pol = policy_index.lookup(grade, cat) if isinstance(grade, str) else None
+        limits.append(float(pol["max_allowance"]) if pol and pol.get("max_allowance") is not None else np.nan)
+    pairs = pairs.assign(max_allowance=limits)
+    return df.merge(pairs, on=["grade", "expense_category"], how="left")
+
+
+def _write_back(changed: pd.DataFrame) -> int:
+    sql = text("""
+        UPDATE expense_claims AS c
+        SET status = v.status,
+            auto_approved = (v.status = 'Auto Approved')
+        FROM unnest(CAST(:ids AS text[]), CAST(:statuses AS text[])) AS v(claim_id, status)
+        WHERE c.claim_id = v.claim_id AND c.status IS DISTINCT FROM v.status
+    """)
+    updated = 0
+    for start in range(0, len(changed), REVALIDATE_CHUNK):
+        part = changed.iloc[start:start + REVALIDATE_CHUNK]
+        with db_utils.engine.begin() as conn:
+            res = conn.execute(sql, {"ids": part["claim_id"].tolist(), "statuses": part["tag"].tolist()})
+            updated += res.rowcount or 0
+    return updated
+
+
+def revalidate_claims(
+    statuses: Optional[Iterable[str]] = REVALIDATE_STATUSES,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    dry_run: bool = True,
+) -> Dict[str, Any]:
+    """Re-band stored claims against the current policies; writes back unless dry_run."""
+    t0 = time.perf_counter()
+    policy_index.rebuild()  # re-banding is usually run right after a policy edit
+    claims = load_claims_frame(statuses, start_date, end_date)
+    t_load = time.perf_counter()
+    claims = attach_policies(claims)
+    result = pd.concat([claims, evaluate_frame(claims)], axis=1)
+    t_eval = time.perf_counter()
+
+    changed = result[result["status"] != result["tag"]]
+    transitions = (
+        changed.groupby(["status", "tag"]).size().reset_index(name="claims")
+        .rename(columns={"status": "from_status", "tag": "to_status"})
+        .to_dict("records")
+    )
+    updated = 0 if dry_run or changed.empty else _write_back(changed[["claim_id", "tag"]])
+    t_done = time.perf_counter()
+
+    return {
+        "dry_run": dry_run,
+        "scanned": int(len(result)),
+        "changed": int(len(changed)),
+        "updated": int(updated),
+        "transitions": transitions,
+        "timings_ms": {
+            "load": round((t_load - t0) * 1000, 1),
+            "evaluate": round((t_eval - t_load) * 1000, 1),
+            "write": round((t_done - t_eval) * 1000, 1),
+        },
+    }
+
+
+# ------------------------------------------------------------------
+# Synthetic benchmark + equivalence check:  python revalidation.py [rows]
+# ------------------------------------------------------------------
+if __name__ == "__main__":
+    import sys
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 300_000
+    rng = np.random.default_rng(7)
+    allowance = rng.choice([0.0, np.nan, 1500.0, 3000.0, 7500.0, 9999.99], size=n)
+    amount = np.round(rng.uniform(0, 15000, size=n), 2)
+    # force exact band edges into the sample
+    edges = np.array([1.0, 1.1, 1.25, 1.10004, 1.10005, 1.25005, 1.00004, 1.00005])
+    amount[: len(edges) * 10] = np.round(np.repeat(edges, 10) * 3000.0, 2)
+    allowance[: len(edges) * 10] = 3000.0
+    frame = pd.DataFrame({
+        "amount": amount,
+        "max_allowance": allowance,
+        "currency": "INR",
+        "expense_category": "Hotel",
+        "grade": "G2",
+    })
+    t = time.perf_counter()
+    res = evaluate_frame(frame)
+    print(f"evaluated {n:,} claims in {(time.perf_counter() - t) * 1000:.1f} ms")
+    print(res["tag"].value_counts().to_string())
+    mismatches = verify_against_scalar(frame, sample=min(n, 20000))
+    print(f"scalar mismatches: {mismatches}")
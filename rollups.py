@@ -0,0 +1,318 @@
+# rollups.py
+"""
+Incrementally maintained KPI rollups for the /claims/* analytics routes.
+
+claims_daily_rollup holds one row per (day, category, department, vendor,
+status) and claims_employee_rollup one row per employee. An AFTER trigger on
+expense_claims applies +1/-1 deltas inside the writer's transaction (the
+employee row only when employee or amount changed), so every
+writer (save_expense_claim, update_claim_status, manager/finance decisions,
+the dashboard pages' direct UPDATEs) keeps them current without extra code.
+The analytics reads below scan the rollups, whose size grows with days x
+distinct keys rather than with the number of claims.
+
+Department is looked up from employees when the delta is applied; after
+moving employees between departments run rebuild_rollups() once.
+"""
+
+from typing import Optional, Dict, Any, List
+from datetime import date
+
+from sqlalchemy import text
+
+import db_utils
+
+_ROLLUPS_READY = False
+
+# NULL-able source columns are stored as '' in the rollup keys
+_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS claims_daily_rollup (
+        day                 date         NOT NULL,
+        category            varchar(100) NOT NULL,
+        department          varchar(120) NOT NULL,
+        vendor              varchar(255) NOT NULL,
+        status              varchar(30)  NOT NULL,
+        claim_count         bigint       NOT NULL DEFAULT 0,
+        total_amount        numeric(16,2) NOT NULL DEFAULT 0,
+        auto_approved_count bigint       NOT NULL DEFAULT 0,
+        fraud_count         bigint       NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, category, department, vendor, status)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS claims_employee_rollup (
+        employee_id  varchar(32)   PRIMARY KEY,
+        claim_count  bigint        NOT NULL DEFAULT 0,
+        total_amount numeric(16,2) NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE OR REPLACE FUNCTION claims_rollup_delta(
+        p_day date, p_category text, p_employee text, p_vendor text, p_status text,
+        p_amount numeric, p_auto boolean, p_fraud boolean, p_sign integer
+    ) RETURNS void AS $$
+    DECLARE
+        v_dept text;
+    BEGIN
+        SELECT department INTO v_dept FROM employees WHERE employee_id = p_employee;
+
+        INSERT INTO claims_daily_rollup AS r
+            (day, category, department, vendor, status,
+             claim_count, total_amount, auto_approved_count, fraud_count)
+        VALUES (
+            p_day, COALESCE(p_category, ''), COALESCE(v_dept, ''), COALESCE(p_vendor, ''), COALESCE(p_status, ''),
+            p_sign, p_sign * COALESCE(p_amount, 0),
+            CASE WHEN p_auto THEN p_sign ELSE 0 END,
+            CASE WHEN p_fraud THEN p_sign ELSE 0 END
+        )
+        ON CONFLICT (day, category, department, vendor, status) DO UPDATE SET
+            claim_count         = r.claim_count + EXCLUDED.claim_count,
+            total_amount        = r.total_amount + EXCLUDED.total_amount,
+            auto_approved_count = r.auto_approved_count + EXCLUDED.auto_approved_count,
+            fraud_count         = r.fraud_count + EXCLUDED.fraud_count;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION claims_employee_delta(p_employee text, p_amount numeric, p_sign integer)
+    RETURNS void AS $$
+    BEGIN
+        INSERT INTO claims_employee_rollup AS e (employee_id, claim_count, total_amount)
+        VALUES (p_employee, p_sign, p_sign * COALESCE(p_amount, 0))
+        ON CONFLICT (employee_id) DO UPDATE SET
+            claim_count  = e.claim_count + EXCLUDED.claim_count,
+            total_amount = e.total_amount + EXCLUDED.total_amount;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION claims_rollup_trigger() RETURNS trigger AS $$
+    DECLARE
+        v_employee_changed boolean := TG_OP <> 'UPDATE' OR
+            (OLD.employee_id, OLD.amount) IS DISTINCT FROM (NEW.employee_id, NEW.amount);
+    BEGIN
+        IF TG_OP = 'UPDATE' AND
+           (OLD.claim_date, OLD.expense_category, OLD.employee_id, OLD.vendor_name, OLD.status,
+            OLD.amount, OLD.auto_approved, OLD.fraud_flag)
+           IS NOT DISTINCT FROM
+           (NEW.claim_date, NEW.expense_category, NEW.employee_id, NEW.vendor_name, NEW.status,
+            NEW.amount, NEW.auto_approved, NEW.fraud_flag) THEN
+            RETURN NULL;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM claims_rollup_delta(OLD.claim_date, OLD.expense_category, OLD.employee_id, OLD.vendor_name,
+                                        OLD.status, OLD.amount, OLD.auto_approved, OLD.fraud_flag, -1);
+            -- a status-only change (every approval) leaves the per-employee row alone
+            IF v_employee_changed THEN
+                PERFORM claims_employee_delta(OLD.employee_id, OLD.amount, -1);
+            END IF;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM claims_rollup_delta(NEW.claim_date, NEW.expense_category, NEW.employee_id, NEW.vendor_name,
+                                        NEW.status, NEW.amount, NEW.auto_approved, NEW.fraud_flag, 1);
+            IF v_employee_changed THEN
+                PERFORM claims_employee_delta(NEW.employee_id, NEW.amount, 1);
+            END IF;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+    """,
+]
+
+# DROP TRIGGER takes ACCESS EXCLUSIVE on expense_claims: only run when it is missing
+_TRIGGER_DDL = [
+    "DROP TRIGGER IF EXISTS trg_claims_rollup ON expense_claims",
+    """
+    CREATE TRIGGER trg_claims_rollup
+    AFTER INSERT OR UPDATE OR DELETE ON expense_claims
+    FOR EACH ROW EXECUTE FUNCTION claims_rollup_trigger()
+    """,
+]
+
+_REBUILD = [
+    "TRUNCATE claims_daily_rollup, claims_employee_rollup",
+    """
+    INSERT INTO claims_daily_rollup
+        (day, category, department, vendor, status,
+         claim_count, total_amount, auto_approved_count, fraud_count)
+    SELECT c.claim_date,
+           COALESCE(c.expense_category, ''), COALESCE(e.department, ''),
+           COALESCE(c.vendor_name, ''), COALESCE(c.status, ''),
+           COUNT(*), COALESCE(SUM(c.amount), 0),
+           COUNT(*) FILTER (WHERE c.auto_approved = TRUE),
+           COUNT(*) FILTER (WHERE c.fraud_flag = TRUE)
+    FROM expense_claims c
+    LEFT JOIN employees e ON e.employee_id = c.employee_id
+    GROUP BY 1, 2, 3, 4, 5
+    """,
+    """
+    INSERT INTO claims_employee_rollup (employee_id, claim_count, total_amount)
+    SELECT employee_id, COUNT(*), COALESCE(SUM(amount), 0)
+    FROM expense_claims
+    GROUP BY employee_id
+    """,
+]
+
+
+# ------------------------------------------------------------------
+# SCHEMA / MAINTENANCE
+# ------------------------------------------------------------------
+def _rebuild(conn) -> None:
+    # block writers so no delta lands between the TRUNCATE and the re-aggregation
+    conn.execute(text("LOCK TABLE expense_claims IN SHARE ROW EXCLUSIVE MODE"))
+    for stmt in _REBUILD:
+        conn.execute(text(stmt))
+
+
+def ensure_rollups() -> None:
+    """Create tables + trigger once; backfill from expense_claims the first time."""
+    global _ROLLUPS_READY
+    if _ROLLUPS_READY:
+        return
+    with db_utils.engine.begin() as conn:
+        # several API workers may start together
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('claims_rollup_install'))"))
+        existed = conn.execute(text("SELECT to_regclass('claims_daily_rollup') IS NOT NULL")).scalar()
+        for stmt in _DDL:
+            conn.execute(text(stmt))
+        has_trigger = conn.execute(text("""
+            SELECT EXISTS (SELECT 1 FROM pg_trigger
+                           WHERE tgname = 'trg_claims_rollup' AND tgrelid = 'expense_claims'::regclass)
+        """)).scalar()
+        if not has_trigger:
+            for stmt in _TRIGGER_DDL:
+                conn.execute(text(stmt))
+        if not existed:
+            _rebuild(conn)
+            print("[rollups] created and backfilled claims rollup tables")
+    _ROLLUPS_READY = True
+
+
+def rebuild_rollups() -> None:
+    """Full recompute; only needed after bulk data fixes or department moves."""
+    ensure_rollups()
+    with db_utils.engine.begin() as conn:
+        _rebuild(conn)
+
+
+# ------------------------------------------------------------------
+# READS
+# ------------------------------------------------------------------
+def _day_filter(start_date, end_date, col: str = "day"):
+    wh, params = ["claim_count <> 0"], {}
+    if start_date:
+        wh.append(f"{col} >= :start_date")
+        params["start_date"] = start_date
+    if end_date:
+        wh.append(f"{col} <= :end_date")
+        params["end_date"] = end_date
+    return "WHERE " + " AND ".join(wh), params
+
+
+def _rows(sql: str, params: dict) -> List[Dict[str, Any]]:
+    ensure_rollups()
+    with db_utils.engine.connect() as conn:
+        return [dict(r) for r in conn.execute(text(sql), params).mappings().all()]
+
+
+def get_claims_by_date(start_date: Optional[str], end_date: Optional[str]) -> Dict[str, List[Dict[str, Any]]]:
+    where_sql, params = _day_filter(start_date, end_date)
+    rows = _rows(f"""
+        SELECT day AS dt, SUM(claim_count)::int AS total_claims, SUM(total_amount)::float AS total_amount
+        FROM claims_daily_rollup {where_sql}
+        GROUP BY day ORDER BY day
+    """, params)
+    for r in rows:
+        r["total_amount"] = float(r["total_amount"] or 0.0)
+    return {"by_date": rows}
+
+
+def get_automation_rate_by_date(start_date: Optional[str], end_date: Optional[str]) -> Dict[str, List[Dict[str, Any]]]:
+    where_sql, params = _day_filter(start_date, end_date)
+    rows = _rows(f"""
+        SELECT day AS dt, SUM(auto_approved_count)::int AS auto_approved, SUM(claim_count)::int AS total
+        FROM claims_daily_rollup {where_sql}
+        GROUP BY day ORDER BY day
+    """, params)
+    for r in rows:
+        total = int(r["total"] or 0)
+        r["automation_rate"] = round((int(r["auto_approved"] or 0) / total) if total else 0.0, 4)
+    return {"by_date": rows}
+
+
+def get_claims_by_department(limit: int = 20) -> Dict[str, List[Dict[str, Any]]]:
+    rows = _rows("""
+        SELECT COALESCE(NULLIF(department, ''), 'Unknown') AS department,
+               SUM(claim_count)::int AS total_claims, SUM(total_amount)::float AS total_amount
+        FROM claims_daily_rollup
+        WHERE claim_count <> 0
+        GROUP BY 1 ORDER BY total_amount DESC
+        LIMIT :lim
+    """, {"lim": limit})
+    return {"by_department": rows}
+
+
+def get_top_employees(limit: int = 20) -> Dict[str, List[Dict[str, Any]]]:
+    rows = _rows("""
+        SELECT r.employee_id,
+               TRIM(COALESCE(e.first_name, '') || ' ' || COALESCE(e.last_name, '')) AS employee_name,
+               r.claim_count::int AS total_claims, r.total_amount::float AS total_amount
+        FROM claims_employee_rollup r
+        LEFT JOIN employees e ON e.employee_id = r.employee_id
+        WHERE r.claim_count <> 0
+        ORDER BY r.total_amount DESC
+        LIMIT :lim
+    """, {"lim": limit})
+    return {"top_employees": rows}
+
+
+def get_monthly_trend(start_date: date, end_date: date) -> List[Dict[str, Any]]:
+    where_sql, params = _day_filter(start_date, end_date)
+    return _rows(f"""
+        SELECT DATE_TRUNC('month', day)::date AS month,
+               COALESCE(SUM(total_amount)::float, 0) AS total_amount,
+               SUM(claim_count)::int AS claim_count
+        FROM claims_daily_rollup {where_sql}
+        GROUP BY 1 ORDER BY 1
+    """, params)
+
+
+def get_top_vendors(start_date: date, end_date: date, limit: int = 10) -> List[Dict[str, Any]]:
+    where_sql, params = _day_filter(start_date, end_date)
+    params["lim"] = limit
+    return _rows(f"""
+        SELECT COALESCE(NULLIF(vendor, ''), '(unknown)') AS vendor_name,
+               COALESCE(SUM(total_amount)::float, 0) AS total_amount,
+               SUM(claim_count)::int AS claim_count
+        FROM claims_daily_rollup {where_sql}
+        GROUP BY vendor ORDER BY total_amount DESC
+        LIMIT :lim
+    """, params)
+
+
+def get_claim_counts(
+    start_date: date,
+    end_date: date,
+    statuses: Optional[List[str]] = None,
+    category: Optional[str] = None,
+    vendor_like: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Exact claim counts for the /claims/list filters the rollup keys cover."""
+    where_sql, params = _day_filter(start_date, end_date)
+    if statuses:
+        where_sql += " AND status = ANY(:statuses)"
+        params["statuses"] = list(statuses)
+    if category:
+        where_sql += " AND category = :category"
+        params["category"] = category
+    if vendor_like:
+        where_sql += " AND vendor ILIKE :vendor_like"
+        params["vendor_like"] = vendor_like
+    rows = _rows(f"""
+        SELECT category AS expense_category, SUM(claim_count)::int AS claim_count
+        FROM claims_daily_rollup {where_sql}
+        GROUP BY category ORDER BY claim_count DESC
+    """, params)
+    return {"total": sum(r["claim_count"] for r in rows), "by_category": rows}
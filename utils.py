@@ -24,9 +24,28 @@ def _connect_smtp():
     server.login(EMAIL_USER, EMAIL_PASS)
     return server
 
+EMAIL_OUTBOX_ENABLED = os.environ.get("EMAIL_OUTBOX_ENABLED", "true").lower() == "true"
+
 def send_email(recipient_email: str, subject: str, body: str, from_name: str | None = None) -> bool:
     """
-    Sends a plain-text email via Gmail SMTP.
+    Queues a plain-text email in the durable outbox (outbox.py); a background
+    sender delivers it over a persistent SMTP connection.
+    Returns True once queued (or sent, when the outbox is disabled), False otherwise.
+    """
+    if not EMAIL_OUTBOX_ENABLED:
+        return send_email_now(recipient_email, subject, body, from_name)
+    try:
+        import outbox  # local import: outbox imports this module for SMTP config
+        outbox.enqueue_email(recipient_email, subject, body, from_name)
+        print(f"📨 Email queued for {recipient_email} | {subject}")
+        return True
+    except Exception as e:
+        print("❌ Could not queue email, sending directly:", e)
+        return send_email_now(recipient_email, subject, body, from_name)
+
+def send_email_now(recipient_email: str, subject: str, body: str, from_name: str | None = None) -> bool:
+    """
+    Sends a plain-text email via Gmail SMTP right away (one connection per call).
     Returns True on success, False otherwise (prints error).
     """
     sender_disp = formataddr((from_name or FROM_NAME, EMAIL_USER))
@@ -141,3 +160,43 @@ Sent: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 """
     )
     return subject, body
+
+
+def draft_decision_digest(
+    *,
+    recipient_name: str | None,
+    items: list[dict],   # claim_id, employee_id, actor_role, status, comment, amount, currency
+) -> tuple[str, str]:
+    """One subject/body summarising many manager/finance decisions."""
+    approved = sum(1 for i in items if i.get("status") == "Approved")
+    rejected = sum(1 for i in items if i.get("status") == "Rejected")
+    roles = sorted({i.get("actor_role") or "Reviewer" for i in items})
+    subject = (
+        f"[Expense Claim Update] {len(items)} claims reviewed by {'/'.join(roles)} "
+        f"— {approved} approved, {rejected} rejected"
+    )
+    lines = []
+    for i in items:
+        amt = _fmt_amount(i.get("amount"), i.get("currency") or "INR") if i.get("amount") is not None else "—"
+        lines.append(
+            f"• {i.get('claim_id')} | {i.get('employee_id') or '—'} | {amt} | "
+            f"{i.get('status')} by {i.get('actor_role') or 'Reviewer'}"
+            + (f" — {i['comment']}" if i.get("comment") else "")
+        )
+    body = (
+f"""Hi {recipient_name or 'there'},
+
+The following expense claims have been reviewed:
+
+{chr(10).join(lines)}
+
+Next steps:
+• If Approved: the claim will be processed as per policy timelines.
+• If Rejected: please check the reviewer comments and resubmit if applicable.
+
+Regards,
+{FROM_NAME}
+Sent: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+"""
+    )
+    return subject, body
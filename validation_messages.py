@@ -0,0 +1,141 @@
+# validation_messages.py
+"""
+Background completion of validation messages.
+
+ValidationAgent returns the rule-based decision and message immediately and
+hands the LLM rephrasing to this module. The result is keyed by a
+`message_ref` carried in the validation dict:
+
+  * stored in `validation_messages` (and a small in-process cache), so
+    GET /api/validation/messages/{ref} can serve it;
+  * merged into any expense_validation_logs row already written for that
+    ref; rows logged afterwards pick it up in db_utils.log_validation_result.
+"""
+
+import os
+import uuid
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Callable
+
+from sqlalchemy import text
+
+import db_utils
+
+VALIDATION_MESSAGE_WORKERS = int(os.getenv("VALIDATION_MESSAGE_WORKERS", "4"))
+_RECENT_MAX = 2000
+
+_executor = ThreadPoolExecutor(max_workers=VALIDATION_MESSAGE_WORKERS, thread_name_prefix="validation-msg")
+_lock = threading.Lock()
+_recent: "OrderedDict[str, str]" = OrderedDict()
+_stats = {"scheduled": 0, "completed": 0, "failed": 0, "total_ms": 0.0}
+
+_TABLE_READY = False
+
+
+def ensure_table() -> None:
+    global _TABLE_READY
+    if _TABLE_READY:
+        return
+    with db_utils.engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS validation_messages (
+                message_ref  varchar(40) PRIMARY KEY,
+                message      text NOT NULL,
+                created_at   timestamp without time zone NOT NULL DEFAULT now()
+            )
+        """))
+    _TABLE_READY = True
+
+
+def new_ref() -> str:
+    return uuid.uuid4().hex
+
+
+def _remember(ref: str, message: str) -> None:
+    with _lock:
+        _recent[ref] = message
+        _recent.move_to_end(ref)
+        while len(_recent) > _RECENT_MAX:
+            _recent.popitem(last=False)
+
+
+def store(ref: str, message: str) -> None:
+    _remember(ref, message)
+    ensure_table()
+    with db_utils.engine.begin() as conn:
+        conn.execute(
+            text("""
+                INSERT INTO validation_messages (message_ref, message) VALUES (:ref, :msg)
+                ON CONFLICT (message_ref) DO UPDATE SET message = EXCLUDED.message
+            """),
+            {"ref": ref, "msg": message},
+        )
+        # claim already saved + logged before the LLM answered
+        conn.execute(
+            text("""
+                UPDATE expense_validation_logs
+                SET raw_validation_json = raw_validation_json
+                    || jsonb_build_object('message', CAST(:msg AS text), 'message_source', 'llm')
+                WHERE raw_validation_json->>'message_ref' = :ref
+            """),
+            {"ref": ref, "msg": message},
+        )
+
+
+def _run(ref: str, produce: Callable[[], Optional[str]]) -> None:
+    t0 = time.perf_counter()
+    try:
+        message = produce()
+        if message:
+            store(ref, message)
+            _stats["completed"] += 1
+        else:
+            _stats["failed"] += 1
+    except Exception as ex:
+        _stats["failed"] += 1
+        print(f"[validation_messages] {ref}: {ex}")
+    finally:
+        _stats["total_ms"] += (time.perf_counter() - t0) * 1000
+
+
+def schedule(ref: str, produce: Callable[[], Optional[str]]) -> None:
+    """Run `produce` off the request path and persist what it returns under `ref`."""
+    _stats["scheduled"] += 1
+    _executor.submit(_run, ref, produce)
+
+
+def get_message(ref: str) -> Optional[str]:
+    with _lock:
+        if ref in _recent:
+            return _recent[ref]
+    ensure_table()
+    with db_utils.engine.connect() as conn:
+        return conn.execute(
+            text("SELECT message FROM validation_messages WHERE message_ref = :ref"), {"ref": ref}
+        ).scalar()
+
+
+def merge_into(validation_obj: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of validation_obj with the background message filled in, if it is ready."""
+    ref = validation_obj.get("message_ref") if isinstance(validation_obj, dict) else None
+    if not ref:
+        return validation_obj
+    try:
+        message = get_message(ref)
+    except Exception:
+        message = None
+    if not message:
+        return validation_obj
+    return {**validation_obj, "message": message, "message_source": "llm"}
+
+
+def stats() -> Dict[str, Any]:
+    done = _stats["completed"] + _stats["failed"]
+    return {
+        **{k: v for k, v in _stats.items() if k != "total_ms"},
+        "pending": _stats["scheduled"] - done,
+        "avg_ms": round(_stats["total_ms"] / done, 1) if done else None,
+    }